@@ -0,0 +1,80 @@
+"""
+Measure captures/s of the fswebcam backend in memory and file mode, and
+captures/s through the pipeline into the file system uploader, with a fake fswebcam.
+
+python3 -m benchmarks.bench_capture --count 50 --latency 0.05
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import tempfile
+import time
+
+from tests import fakes
+from cloud_camera import capture
+from cloud_camera.cam_utils import format_datetime
+from cloud_camera.pipeline import Capture_Pipeline, Upload_Worker, POLICY_BLOCK
+from cloud_camera.uploaders.filesystem_uploader import Filesystem_Uploader
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--count', type=int, default=50, help='Count of captures')
+parser.add_argument('--latency', type=float, default=0.0, help='Seconds the fake fswebcam takes')
+parser.add_argument('--width', type=int, default=1280, help='Width of the fake capture')
+parser.add_argument('--height', type=int, default=720, help='Height of the fake capture')
+parsed = parser.parse_args()
+
+
+def measure_backend(name, backend, count):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(count):
+            assert backend.capture() is not None
+        elapsed = time.perf_counter() - start
+
+    print('{0:<24} {1:>8.1f} captures/s'.format(name, count / elapsed))
+
+
+def measure_pipeline(backend, directory, count, size):
+    uploader = Filesystem_Uploader(directory, 2)
+    worker = Upload_Worker(uploader, queue_size=10, policy=POLICY_BLOCK)
+    pipeline = Capture_Pipeline([worker])
+    pipeline.start()
+
+    start_dt = datetime.datetime.now()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(count):
+            name = 'capture-{0}.jpg'.format(format_datetime(start_dt + datetime.timedelta(seconds=i)))
+            pipeline.publish(backend.capture(), name)
+
+        captured = time.perf_counter() - start
+        while worker.stats['uploaded'] < count:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+
+        pipeline.stop()
+
+    print('{0:<24} {1:>8.1f} captures/s, uploaded {2:.1f} MB/s'.format(
+        'pipeline',
+        count / captured,
+        count * size / elapsed / 1000000
+    ))
+
+
+with tempfile.TemporaryDirectory() as directory:
+    jpeg = fakes.make_jpeg(parsed.width, parsed.height)
+    fakes.install_fake_fswebcam(directory, latency=parsed.latency, jpeg=jpeg)
+
+    print('{0} captures of {1} bytes, fswebcam latency {2}s'.format(parsed.count, len(jpeg), parsed.latency))
+
+    measure_backend('fswebcam memory', capture.Fswebcam_Backend(), parsed.count)
+    measure_backend('fswebcam file', capture.Fswebcam_Backend(temp_file=os.path.join(directory, 'capture.jpg')),
+                    parsed.count)
+
+    target = os.path.join(directory, 'captures')
+    os.makedirs(target)
+    measure_pipeline(capture.Fswebcam_Backend(), target, parsed.count, len(jpeg))
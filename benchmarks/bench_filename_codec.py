@@ -0,0 +1,52 @@
+"""
+Compare parse rate of capture names between the fixed format codec
+and the dateutil based parsing it replaced.
+
+python3 -m benchmarks.bench_filename_codec --count 100000
+"""
+
+import argparse
+import datetime
+import time
+
+from dateutil.parser import parse
+
+from cloud_camera.cam_utils import format_datetime, get_datetime_from_name, parse_many, _NAME_REGEX
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--count', type=int, default=100000, help='Count of names to parse')
+parsed = parser.parse_args()
+
+
+def parse_dateutil(filename):
+    """
+    The original parsing, regex and dateutil for every name.
+    """
+
+    matches = _NAME_REGEX.search(filename)
+    if matches is None:
+        return None
+
+    return parse(matches.group(1))
+
+
+def measure(name, function, names):
+    start = time.perf_counter()
+    function(names)
+    elapsed = time.perf_counter() - start
+
+    print('{0:<24} {1:>12.0f} parses/s'.format(name, len(names) / elapsed))
+
+
+start_dt = datetime.datetime(2020, 1, 1)
+names = ['capture-{0}.jpg'.format(format_datetime(start_dt + datetime.timedelta(seconds=10 * i)))
+         for i in range(parsed.count)]
+
+# Sanity check, all paths have to agree.
+for name in names[:100]:
+    assert get_datetime_from_name(name) == parse_dateutil(name), name
+
+print('Parsing {0} capture names'.format(len(names)))
+measure('dateutil', lambda n: [parse_dateutil(x) for x in n], names)
+measure('get_datetime_from_name', lambda n: [get_datetime_from_name(x) for x in n], names)
+measure('parse_many', parse_many, names)
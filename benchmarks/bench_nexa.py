@@ -0,0 +1,73 @@
+"""
+Measure the timing error of the Nexa pulses sent with the RPi.GPIO transmitter
+against a mock GPIO recording the edges, compared to sleeping for every pulse
+as the original bit-banging did.
+
+python3 -m benchmarks.bench_nexa --sends 5
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+from tests import fakes
+from nexa_sockets import nexa_protocol, transmitters
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sends', type=int, default=5, help='Count of transmissions')
+parsed = parser.parse_args()
+
+gpio = fakes.install_recording_gpio()
+
+CODE = '10110011100011110000101010'
+
+
+def send_sleeping(pulses):
+    """
+    The original way, sleeping for every pulse.
+    """
+
+    for level, us in pulses:
+        gpio.output(4, level)
+        time.sleep(us / 1000000.0)
+    gpio.output(4, 0)
+
+
+def measure(name, send, pulses):
+    errors = []
+    frame_errors = []
+
+    for i in range(parsed.sends):
+        gpio.edges = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            send(pulses)
+
+        edges = gpio.edges
+        # The last edge ends the transmission.
+        for (start, level), (end, _), (expected_level, us) in zip(edges, edges[1:], pulses):
+            assert level == expected_level
+            errors.append(abs((end - start) / 1000.0 - us))
+
+        frame_errors.append((edges[len(pulses)][0] - edges[0][0]) / 1000.0 - nexa_protocol.get_duration(pulses))
+
+    errors.sort()
+    print('{0:<24} pulse error median {1:.1f}us, p99 {2:.1f}us, max {3:.1f}us, '
+          'transmission {4:.0f}us longer'.format(
+              name,
+              errors[len(errors) // 2],
+              errors[int(len(errors) * 0.99)],
+              errors[-1],
+              sum(frame_errors) / len(frame_errors)
+          ))
+
+
+pulses = nexa_protocol.encode(CODE, 1, 1)
+print('{0} transmissions of {1} pulses, {2} us'.format(parsed.sends, len(pulses), nexa_protocol.get_duration(pulses)))
+
+with contextlib.redirect_stdout(io.StringIO()):
+    transmitter = transmitters.Gpio_Transmitter(4)
+    transmitter.open()
+
+measure('sleep per pulse', send_sleeping, pulses)
+measure('busy-wait', transmitter.send, pulses)
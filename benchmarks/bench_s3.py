@@ -0,0 +1,99 @@
+"""
+Measure upload throughput to S3 and the time to reconcile and purge a bucket
+of many captures, against moto's in-process S3. Requires boto3 and moto.
+
+python3 -m benchmarks.bench_s3 --objects 10000
+python3 -m benchmarks.bench_s3 --objects 100000 --uploads 0
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import time
+
+from tests import fakes
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--objects', type=int, default=10000, help='Count of captures in the bucket to purge')
+parser.add_argument('--uploads', type=int, default=100, help='Count of captures to upload')
+parser.add_argument('--size', type=int, default=200000, help='Size of an uploaded capture in bytes')
+parsed = parser.parse_args()
+
+BUCKET_NAME = 'benchmark-captures'
+
+
+def create_uploader(file_count_limit):
+    # Imported inside the mock, so that boto3 never sees real credentials.
+    from cloud_camera.uploaders.s3_uploader import S3_Uploader
+
+    uploader = S3_Uploader('testing', 'testing', BUCKET_NAME, file_count_limit)
+    uploader.connect()
+    return uploader
+
+
+def measure_uploads(count, size):
+    from cloud_camera.cam_utils import format_datetime
+
+    uploader = create_uploader(count)
+    data = fakes.make_jpeg()[:size].ljust(size, b'\0')
+    start_dt = datetime.datetime(2020, 1, 1)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(count):
+            name = 'capture-{0}.jpg'.format(format_datetime(start_dt + datetime.timedelta(seconds=i)))
+            uploader.upload_data(data, name)
+        elapsed = time.perf_counter() - start
+
+    print('{0:<24} {1:>10.1f} uploads/s, {2:.1f} MB/s'.format(
+        'upload_data',
+        count / elapsed,
+        count * size / elapsed / 1000000
+    ))
+
+
+def measure_purge(client, count):
+    from cloud_camera.cam_utils import format_datetime
+
+    start_dt = datetime.datetime(2021, 1, 1)
+    for i in range(count):
+        name = 'capture-{0}.jpg'.format(format_datetime(start_dt + datetime.timedelta(seconds=10 * i)))
+        client.put_object(Bucket=BUCKET_NAME, Key=name, Body=b'')
+    for i in range(count // 100):
+        client.put_object(Bucket=BUCKET_NAME, Key='irrelevant-{0}.txt'.format(i), Body=b'')
+
+    # Half of the captures are over the limit.
+    uploader = create_uploader(count // 2)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        uploader.purge_irrelevant()
+        reconciled = time.perf_counter() - start
+
+        start = time.perf_counter()
+        uploader.purge_old()
+        purged = time.perf_counter() - start
+
+    print('{0:<24} {1:>10.2f} s for {2} objects'.format('purge_irrelevant', reconciled, count + count // 100))
+    print('{0:<24} {1:>10.2f} s for {2} deletes'.format('purge_old', purged, count - count // 2))
+    assert uploader.index.count() == count // 2
+
+
+with fakes.mock_s3():
+    import boto3
+
+    s3_client = boto3.client('s3')
+    s3_client.create_bucket(Bucket=BUCKET_NAME)
+
+    if parsed.uploads > 0:
+        measure_uploads(parsed.uploads, parsed.size)
+
+    # Start from an empty bucket.
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=BUCKET_NAME):
+        keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+        if len(keys) > 0:
+            s3_client.delete_objects(Bucket=BUCKET_NAME, Delete={'Objects': keys, 'Quiet': True})
+
+    if parsed.objects > 0:
+        measure_purge(s3_client, parsed.objects)
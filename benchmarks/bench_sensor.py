@@ -0,0 +1,99 @@
+"""
+Measure jitter and drift of the sensor samples taken on the scheduler from
+a mock DHT with latency and failures, and the cost of flushing the metrics
+to a UDP sink standing in for DogStatsD.
+
+python3 -m benchmarks.bench_sensor --interval 0.1 --samples 100 --latency 0.02 --failure_rate 0.2
+"""
+
+import argparse
+import contextlib
+import io
+import math
+import threading
+import time
+
+from tests import fakes
+from common.scheduler import Periodic_Scheduler
+from temp_hum_sensor.metrics_buffer import Metrics_Buffer
+from temp_hum_sensor.sensor_reader import Sensor_Reader
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--interval', type=float, default=0.1, help='Seconds between samples')
+parser.add_argument('--samples', type=int, default=100, help='Count of samples')
+parser.add_argument('--latency', type=float, default=0.02, help='Seconds a single sensor read takes')
+parser.add_argument('--failure_rate', type=float, default=0.2, help='Fraction of sensor reads which fail')
+parser.add_argument('--gauges', type=int, default=1000, help='Count of gauges flushed to the UDP sink')
+parsed = parser.parse_args()
+
+
+def measure_sampling():
+    reader = Sensor_Reader(fakes.make_dht_read(parsed.latency, parsed.failure_rate), 22, 4,
+                           timeout=parsed.interval * 0.9, retry_delay=parsed.latency)
+    scheduler = Periodic_Scheduler(name='sensor')
+    starts = []
+    done = threading.Event()
+
+    def sample():
+        starts.append(time.monotonic())
+        reader.read()
+        if len(starts) >= parsed.samples:
+            done.set()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        job = scheduler.add('readings', sample, parsed.interval, first_run=0)
+        thread = threading.Thread(target=scheduler.run)
+        thread.start()
+        done.wait()
+        scheduler.stop()
+        thread.join()
+        reader.close()
+
+    periods = [b - a for a, b in zip(starts, starts[1:])]
+    mean = sum(periods) / len(periods)
+    jitter = math.sqrt(sum((p - mean) ** 2 for p in periods) / len(periods))
+    drift = starts[-1] - starts[0] - (len(starts) - 1) * parsed.interval
+
+    print('{0:<24} mean period {1:.4f}s, jitter {2:.2f}ms, drift {3:.2f}ms over {4} samples'.format(
+        'sampling',
+        mean,
+        jitter * 1000,
+        drift * 1000,
+        len(starts)
+    ))
+    print('{0:<24} reads:{1}, failed:{2}, retries:{3}, skipped runs:{4}'.format(
+        'sensor',
+        reader.stats['reads'],
+        reader.stats['failed'],
+        reader.stats['retries'],
+        job.stats['skipped']
+    ))
+
+
+def measure_flush():
+    sink = fakes.Udp_Sink()
+    metrics = Metrics_Buffer(host=sink.host, port=sink.port)
+
+    for i in range(parsed.gauges):
+        metrics.gauge('benchmark.gauge{0}'.format(i), i)
+
+    start = time.perf_counter()
+    metrics.flush()
+    elapsed = time.perf_counter() - start
+
+    # Let the sink catch up.
+    time.sleep(0.2)
+    metrics.socket.close()
+    sink.close()
+
+    print('{0:<24} {1} gauges in {2:.2f}ms, {3} packets, {4} lines received'.format(
+        'metrics flush',
+        parsed.gauges,
+        elapsed * 1000,
+        sink.packets,
+        sink.lines
+    ))
+
+
+measure_sampling()
+measure_flush()
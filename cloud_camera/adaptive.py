@@ -0,0 +1,200 @@
+import os
+
+from cloud_camera.capture import parse_resolution
+
+# Defaults for the bounds within which the controller steps the capture settings.
+DEFAULT_MIN_QUALITY = 50
+DEFAULT_QUALITY_STEP = 10
+DEFAULT_MIN_FREE_BYTES = 500 * 1000 * 1000
+
+# Factor by which the capture interval is stepped.
+INTERVAL_STEP_FACTOR = 2
+
+# Decisions the controller makes.
+DECISION_DEGRADE = 'degrade'
+DECISION_RECOVER = 'recover'
+DECISION_HOLD = 'hold'
+
+
+class Adaptive_Controller:
+    """
+    Watches free disk, upload queue depth and recent upload latency, and steps
+    JPEG quality, resolution and capture interval within the given bounds,
+    so the device degrades gracefully instead of filling the card or falling behind.
+
+    Under pressure, quality is lowered first, then resolution, then the interval lengthened.
+    Recovery goes the other way round, and only once well clear of the thresholds.
+    """
+
+    def __init__(self, capture_backend, capture_job, workers, disk_path,
+                 min_quality=DEFAULT_MIN_QUALITY, quality_step=DEFAULT_QUALITY_STEP,
+                 resolutions=None, max_interval=None,
+                 min_free_bytes=DEFAULT_MIN_FREE_BYTES, max_depth=None, max_latency=None,
+                 latency_sources=None):
+        if disk_path is None or not os.path.isdir(disk_path):
+            raise ValueError('Invalid disk_path')
+        if min_quality is None or not isinstance(min_quality, int) or min_quality < 1 \
+                or min_quality > capture_backend.quality:
+            raise ValueError('Invalid min_quality')
+        if quality_step is None or not isinstance(quality_step, int) or quality_step < 1:
+            raise ValueError('Invalid quality_step')
+        if resolutions is not None and len(resolutions) > 0 and capture_backend.resolution is None:
+            raise ValueError('Stepping resolution requires the capture resolution')
+        for resolution in resolutions or []:
+            # Raises on an invalid resolution, which would otherwise only fail once stepped down to.
+            parse_resolution(resolution)
+        if max_interval is not None and max_interval < capture_job.interval:
+            raise ValueError('Invalid max_interval')
+        if min_free_bytes is None or min_free_bytes < 0:
+            raise ValueError('Invalid min_free_bytes')
+
+        self.capture_backend = capture_backend
+        self.capture_job = capture_job
+        self.workers = workers
+        self.disk_path = disk_path
+
+        # Bounds of the settings, the best being what the capture started with.
+        self.max_quality = capture_backend.quality
+        self.min_quality = min_quality
+        self.quality_step = quality_step
+        self.resolutions = [capture_backend.resolution] + list(resolutions or [])
+        self.resolution_index = 0
+        self.min_interval = capture_job.interval
+        self.max_interval = max_interval if max_interval is not None else capture_job.interval
+
+        # Thresholds above which the device is under pressure.
+        self.min_free_bytes = min_free_bytes
+        self.max_depth = max_depth
+        self.max_latency = max_latency if max_latency is not None else capture_job.interval
+        # Objects with recent_latency(), such as the S3 transfer.
+        self.latency_sources = latency_sources or []
+
+        self.stats = {
+            DECISION_DEGRADE: 0,
+            DECISION_RECOVER: 0,
+            DECISION_HOLD: 0,
+        }
+
+        print('Adaptive_Controller initialized with quality:{0}-{1}, resolutions:{2}, interval:{3}-{4}, '
+              'min_free_bytes:{5}, max_depth:{6}, max_latency:{7}'.format(
+                  self.min_quality,
+                  self.max_quality,
+                  self.resolutions,
+                  self.min_interval,
+                  self.max_interval,
+                  self.min_free_bytes,
+                  self.max_depth,
+                  self.max_latency
+              ))
+
+    def update(self):
+        """
+        Measure the device and step the capture settings once.
+        Returns the decision made.
+        """
+
+        free_bytes = self._free_bytes()
+        depth = max([worker.depth() for worker in self.workers] or [0])
+        latency = max([latency for latency in (source.recent_latency() for source in self.latency_sources)
+                       if latency is not None] or [0])
+
+        reasons = []
+        if free_bytes < self.min_free_bytes:
+            reasons.append('free disk {0} bytes below {1}'.format(free_bytes, self.min_free_bytes))
+        if self.max_depth is not None and depth > self.max_depth:
+            reasons.append('upload queue depth {0} above {1}'.format(depth, self.max_depth))
+        if latency > self.max_latency:
+            reasons.append('upload latency {0:.3f}s above {1:.3f}s'.format(latency, self.max_latency))
+
+        # Recover only when well clear of every threshold, so the settings don't flap.
+        clear = free_bytes >= 2 * self.min_free_bytes \
+            and depth == 0 \
+            and latency <= self.max_latency / 2
+
+        change = None
+        if len(reasons) > 0:
+            change = self._degrade()
+            decision = DECISION_DEGRADE if change is not None else DECISION_HOLD
+        elif clear:
+            change = self._recover()
+            decision = DECISION_RECOVER if change is not None else DECISION_HOLD
+        else:
+            decision = DECISION_HOLD
+
+        self.stats[decision] += 1
+
+        print('Adaptive decision {0}: {1}; free disk:{2} bytes, depth:{3}, latency:{4:.3f}s{5}'.format(
+            decision,
+            change if change is not None else ('no change' if len(reasons) == 0 and not clear else 'at bounds'),
+            free_bytes,
+            depth,
+            latency,
+            ', ' + ', '.join(reasons) if len(reasons) > 0 else ''
+        ))
+
+        return decision
+
+    def log_stats(self):
+        print('Adaptive controller stats: quality:{0}, resolution:{1}, interval:{2}, {3}'.format(
+            self.capture_backend.quality,
+            self.capture_backend.resolution,
+            self.capture_job.interval,
+            self.stats
+        ))
+
+    def _degrade(self):
+        """
+        Take one step down, returning description of the change, None if at the bounds.
+        """
+
+        quality = self.capture_backend.quality
+        if quality > self.min_quality:
+            return self._set_quality(max(quality - self.quality_step, self.min_quality))
+
+        if self.resolution_index < len(self.resolutions) - 1:
+            return self._set_resolution(self.resolution_index + 1)
+
+        interval = self.capture_job.interval
+        if interval < self.max_interval:
+            return self._set_interval(min(interval * INTERVAL_STEP_FACTOR, self.max_interval))
+
+        return None
+
+    def _recover(self):
+        """
+        Take one step up, returning description of the change, None if at the bounds.
+        """
+
+        interval = self.capture_job.interval
+        if interval > self.min_interval:
+            return self._set_interval(max(interval // INTERVAL_STEP_FACTOR, self.min_interval))
+
+        if self.resolution_index > 0:
+            return self._set_resolution(self.resolution_index - 1)
+
+        quality = self.capture_backend.quality
+        if quality < self.max_quality:
+            return self._set_quality(min(quality + self.quality_step, self.max_quality))
+
+        return None
+
+    def _set_quality(self, quality):
+        change = 'quality {0} -> {1}'.format(self.capture_backend.quality, quality)
+        self.capture_backend.quality = quality
+        return change
+
+    def _set_resolution(self, index):
+        resolution = self.resolutions[index]
+        change = 'resolution {0} -> {1}'.format(self.capture_backend.resolution, resolution)
+        self.resolution_index = index
+        self.capture_backend.set_resolution(resolution)
+        return change
+
+    def _set_interval(self, interval):
+        change = 'interval {0}s -> {1}s'.format(self.capture_job.interval, interval)
+        self.capture_job.interval = interval
+        return change
+
+    def _free_bytes(self):
+        stat = os.statvfs(self.disk_path)
+        return stat.f_bavail * stat.f_frsize
@@ -1,41 +1,120 @@
 import datetime
 import re
 
-from dateutil.parser import parse
+# Format of the timestamp in capture names, e.g. capture-2020-01-31T12:00:00.jpg
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+# Length of the timestamp formatted with TIMESTAMP_FORMAT.
+TIMESTAMP_LENGTH = 19
+CAPTURE_EXTENSION = '.jpg'
+# Extension of segments packing many captures, e.g. segment-2020-01-31T12:00:00.tar
+SEGMENT_EXTENSION = '.tar'
+# Both extensions are of the same length, so the fixed positions below apply to both.
+EXTENSIONS = (CAPTURE_EXTENSION, SEGMENT_EXTENSION)
+
+# Matches any name with a prefix, a timestamp of any format and the capture or segment extension.
+_NAME_REGEX = re.compile(r'^.+?-{1}(.+)\.(?:jpg|tar)', re.IGNORECASE)
+
+# Positions of the separator and the timestamp in a name in the fixed format.
+_SEPARATOR_INDEX = -(TIMESTAMP_LENGTH + len(CAPTURE_EXTENSION) + 1)
+_TIMESTAMP_START = _SEPARATOR_INDEX + 1
+_TIMESTAMP_END = -len(CAPTURE_EXTENSION)
+
+
+def format_datetime(dt):
+    """
+    Format datetime as it is used in capture names.
+    """
+    return dt.strftime(TIMESTAMP_FORMAT)
 
 
 def get_current_datetime_string():
     """
     Get the datetime string which is used to indicate date.
     """
-    return datetime.datetime.now().isoformat()[:-7]
+    return format_datetime(datetime.datetime.now())
 
 
 def get_current_filename():
     """
     Get the name for the most recent capture.
     """
-    return 'capture-{0}.jpg'.format(get_current_datetime_string())
+    return 'capture-{0}{1}'.format(get_current_datetime_string(), CAPTURE_EXTENSION)
 
 
-def get_datetime_from_name(filename):
+def get_segment_filename(dt):
     """
-    Extract datetime object from filename.
+    Get the name for the segment starting with the capture of the datetime.
+    """
+    return 'segment-{0}{1}'.format(format_datetime(dt), SEGMENT_EXTENSION)
+
+
+def _parse_fast(filename, fromisoformat=datetime.datetime.fromisoformat):
+    """
+    Parse a name in the fixed format by slicing the timestamp out of it.
+    Returns None if the name is not in the fixed format.
+    """
+
+    if len(filename) <= -_SEPARATOR_INDEX \
+            or filename[_SEPARATOR_INDEX] != '-' \
+            or filename[_TIMESTAMP_END:].lower() not in EXTENSIONS:
+        return None
+
+    try:
+        return fromisoformat(filename[_TIMESTAMP_START:_TIMESTAMP_END])
+    except ValueError:
+        return None
+
+
+def _parse_slow(filename):
+    """
+    Parse a name with any timestamp format dateutil understands.
     Returns None if name is invalid.
     """
 
     try:
-        regex = '^.+?-{1}(.+)\.jpg'
-        matches = re.search(regex, filename, re.IGNORECASE)
+        matches = _NAME_REGEX.search(filename)
 
         if matches is None:
             return None
 
-        date_string = matches.group(1)
-        dt = parse(date_string)
-        return dt
+        # Imported only here, as it is slow and seldom needed.
+        from dateutil.parser import parse
+
+        return parse(matches.group(1))
 
     except Exception as err:
         print('Exception while parsing filename {0}: {1}'.format(filename, err))
 
     return None
+
+
+def get_datetime_from_name(filename):
+    """
+    Extract datetime object from filename.
+    Returns None if name is invalid.
+    """
+
+    dt = _parse_fast(filename)
+    if dt is not None:
+        return dt
+
+    return _parse_slow(filename)
+
+
+def parse_many(filenames):
+    """
+    Extract datetime objects from many filenames.
+    Returns a list in the same order, with None for invalid names.
+    """
+
+    parse_fast = _parse_fast
+    parsed = []
+    append = parsed.append
+
+    for filename in filenames:
+        dt = parse_fast(filename)
+        if dt is None:
+            dt = _parse_slow(filename)
+        append(dt)
+
+    return parsed
@@ -1,234 +1,523 @@
 import argparse
 import json
 import os
-import sched
-import subprocess
+import signal
 import sys
 import time
 
+from cloud_camera import adaptive, capture
 from cloud_camera.cam_utils import get_current_filename
-from cloud_camera.uploaders import s3_uploader, filesystem_uploader
+from cloud_camera.pipeline import Capture_Pipeline, Upload_Worker, POLICIES, POLICY_DROP_OLDEST, POLICY_SPILL, \
+    UPLOAD_POLICIES, UPLOAD_ALWAYS
+from cloud_camera.uploaders import s3_uploader, s3_transfer, s3_retention, s3_spool, filesystem_uploader
+from common.scheduler import Periodic_Scheduler, OVERLAP_QUEUE, OVERLAP_SKIP
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--s3', action='store_true', help='Upload to AWS S3 bucket')
 parser.add_argument('--s3_bucket', help='S3 bucket name')
 parser.add_argument('--s3_limit', help='Limit of files in S3 bucket')
 parser.add_argument('--s3_interval', type=int, help='If present, upload only the n-th image to cloud')
+parser.add_argument('--s3_index', help='File in which the index of uploaded captures is kept')
+parser.add_argument('--s3_reconcile_interval', type=int, default=86400,
+                    help='Interval in seconds on which the index is reconciled with the bucket listing')
+parser.add_argument('--s3_multipart_threshold', type=int, default=s3_transfer.DEFAULT_MULTIPART_THRESHOLD,
+                    help='Size in bytes above which captures are uploaded in parts')
+parser.add_argument('--s3_chunk_size', type=int, default=s3_transfer.DEFAULT_MULTIPART_CHUNKSIZE,
+                    help='Size in bytes of a single part in multipart uploads')
+parser.add_argument('--s3_concurrency', type=int, default=s3_transfer.DEFAULT_MAX_CONCURRENCY,
+                    help='Count of threads uploading parts of a single capture')
+parser.add_argument('--s3_pool_size', type=int, default=s3_transfer.DEFAULT_MAX_POOL_CONNECTIONS,
+                    help='Count of kept-alive connections to S3')
+parser.add_argument('--s3_delete_concurrency', type=int, default=s3_retention.DEFAULT_MAX_WORKERS,
+                    help='Count of delete batches of up to 1000 keys run concurrently')
+parser.add_argument('--s3_dry_run', action='store_true',
+                    help='Only print which files would be deleted from S3 bucket')
+parser.add_argument('--s3_spool', help='Directory in which captures that failed to upload are kept until replayed')
+parser.add_argument('--s3_spool_limit', type=int, default=s3_spool.DEFAULT_MAX_BYTES // 1000000,
+                    help='Max megabytes of spooled captures, the oldest are dropped first')
+parser.add_argument('--s3_spool_count', type=int, default=s3_spool.DEFAULT_MAX_COUNT,
+                    help='Max count of spooled captures, the oldest are dropped first')
+parser.add_argument('--s3_replay_concurrency', type=int, default=s3_spool.DEFAULT_CONCURRENCY,
+                    help='Count of spooled captures uploaded concurrently once S3 is reachable')
+parser.add_argument('--s3_segment_minutes', type=int,
+                    help='If present, pack the captures of this many minutes into a single S3 object')
 parser.add_argument('--credentials', help='Credentials file')
 parser.add_argument('--filesystem', action='store_true', help='Save to file system')
+parser.add_argument('--filesystem_interval', type=int, default=1,
+                    help='With --filesystem_upload_on nth-or-change, save every n-th unchanged image')
 parser.add_argument('--filesystem_limit', type=int, help='Max days the captures are retained in file system')
+parser.add_argument('--filesystem_size_limit', type=int,
+                    help='Max megabytes of captures retained in file system, the oldest are removed first')
+parser.add_argument('--filesystem_count_limit', type=int,
+                    help='Max count of captures retained in file system, the oldest are removed first')
 parser.add_argument('--path', help='Path of directory into which to save the images')
 parser.add_argument('--interval', type=int, required=True, help='Interval on which to take pictures')
 parser.add_argument('--clean_interval', type=int, required=True, help='Interval on which to clean the old pictures')
-parsed = parser.parse_args()
-
-# List of uploaders which get passed the created file name.
-# Uploaders pass the file wherever they want to, to cloud or file system etc.
-uploaders = []
-
-# File name as which the latest image is saved and passed to uploaders.
+parser.add_argument('--capture_mode', choices=('memory', 'file'), default='memory',
+                    help='Read the capture from fswebcam output into memory, or through a temporary file')
+parser.add_argument('--capture_backend', choices=capture.BACKENDS, default=capture.BACKEND_FSWEBCAM,
+                    help='fswebcam to run it for every capture, opencv to keep the device open')
+parser.add_argument('--device', default=capture.DEFAULT_DEVICE, help='Webcam device')
+parser.add_argument('--resolution', help='Capture resolution, e.g. 1280x720')
+parser.add_argument('--jpeg_quality', type=int, default=capture.DEFAULT_JPEG_QUALITY, help='JPEG quality 1-100')
+parser.add_argument('--queue_size', type=int, default=10, help='Max count of captures queued for each uploader')
+parser.add_argument('--s3_backpressure', choices=POLICIES, default=POLICY_DROP_OLDEST,
+                    help='What to do with captures when the S3 upload queue is full')
+parser.add_argument('--filesystem_backpressure', choices=POLICIES, default=POLICY_DROP_OLDEST,
+                    help='What to do with captures when the file system upload queue is full')
+parser.add_argument('--motion', action='store_true', help='Compare every capture to the previous one')
+parser.add_argument('--motion_pixel_threshold', type=int, default=25,
+                    help='Difference of a pixel, 0-255, above which the pixel has changed')
+parser.add_argument('--motion_threshold', type=float, default=0.01,
+                    help='Fraction of changed pixels above which the capture has changed')
+parser.add_argument('--s3_upload_on', choices=UPLOAD_POLICIES, default=UPLOAD_ALWAYS,
+                    help='Which captures to send to S3, requires --motion unless always')
+parser.add_argument('--filesystem_upload_on', choices=UPLOAD_POLICIES, default=UPLOAD_ALWAYS,
+                    help='Which captures to save to file system, requires --motion unless always')
+parser.add_argument('--spill_path', default='spilled_captures',
+                    help='Directory into which captures are spilled when using the spill policy')
+# Captures never run concurrently, they share the device, the motion analyzer and the counters.
+parser.add_argument('--capture_overlap', choices=(OVERLAP_SKIP, OVERLAP_QUEUE), default=OVERLAP_SKIP,
+                    help='What to do when a capture is due while the previous one is still running')
+parser.add_argument('--thumbnails', action='store_true',
+                    help='Make a small thumbnail of every capture and an hourly contact sheet')
+parser.add_argument('--thumbnail_size', default='320x240', help='Size the thumbnails fit within, e.g. 320x240')
+parser.add_argument('--thumbnail_quality', type=int, default=70, help='JPEG quality of the thumbnails 1-100')
+parser.add_argument('--thumbnail_path', help='Path of directory into which to save the thumbnails')
+parser.add_argument('--thumbnail_limit', type=int,
+                    help='Max days the thumbnails are retained in file system, default --filesystem_limit or 7')
+parser.add_argument('--s3_thumbnail_prefix', default='thumbnails/', help='Folder of the thumbnails in S3 bucket')
+parser.add_argument('--s3_thumbnail_limit', type=int, default=10000, help='Limit of thumbnails in S3 bucket')
+parser.add_argument('--contact_sheet_tiles', type=int, default=60,
+                    help='Count of tiles in the hourly contact sheet, one per slot of the hour, 0 for no sheets')
+parser.add_argument('--contact_sheet_columns', type=int, default=10, help='Count of columns in the contact sheet')
+parser.add_argument('--contact_sheet_tile', default='96x72', help='Size a contact sheet tile fits within')
+parser.add_argument('--adaptive', action='store_true',
+                    help='Step JPEG quality, resolution and capture interval down when disk or uplink are under pressure')
+parser.add_argument('--adaptive_interval', type=int, default=60, help='Interval on which the adaptive controller runs')
+parser.add_argument('--adaptive_min_quality', type=int, default=adaptive.DEFAULT_MIN_QUALITY,
+                    help='Lowest JPEG quality the adaptive controller steps down to')
+parser.add_argument('--adaptive_resolutions',
+                    help='Comma separated lower resolutions to step down to, e.g. 960x540,640x360, requires --resolution')
+parser.add_argument('--adaptive_max_interval', type=int,
+                    help='Longest capture interval the adaptive controller steps up to, default --interval')
+parser.add_argument('--adaptive_min_free_mb', type=int, default=adaptive.DEFAULT_MIN_FREE_BYTES // 1000000,
+                    help='Free megabytes on disk below which captures are degraded')
+parser.add_argument('--adaptive_max_depth', type=int,
+                    help='Upload queue depth above which captures are degraded, default half of --queue_size')
+parser.add_argument('--adaptive_max_latency', type=float,
+                    help='Recent upload latency in seconds above which captures are degraded, default --interval')
+
+# Capture is read straight from the fswebcam output and passed to uploaders in memory.
+CAPTURE_MODE_MEMORY = 'memory'
+# Capture is written into the temporary file first and read from there once.
+CAPTURE_MODE_FILE = 'file'
+
+# File name as which the latest image is saved in file capture mode.
 TEMP_FILE_NAME = 'capture.jpg'
 
-# Interval at which pictures are taken.
-CAPTURE_INTERVAL_SECONDS = parsed.interval
-# Interval at which files are iterated and old captures removed.
-CLEAN_INTERVAL_SECONDS = parsed.clean_interval
-
-if CAPTURE_INTERVAL_SECONDS < 1:
-    print('Invalid interval {0}'.format(CAPTURE_INTERVAL_SECONDS))
-    sys.exit(1)
-
 DEFAULT_CREDENTIALS_FILE = os.path.join(
     os.path.dirname(os.path.realpath(__file__)),
     'credentials.json'
 )
-CREDENTIALS_FILE = parsed.credentials if parsed.credentials is not None else DEFAULT_CREDENTIALS_FILE
-if not os.path.exists(CREDENTIALS_FILE):
-    print('Credentials file does not exists')
-    sys.exit(1)
-
-if not parsed.s3 and not parsed.filesystem:
-    print('You specified no target for files, specify cloud provider and/or file system')
-    sys.exit(1)
-
-if parsed.s3:
-    # Set up S3 uploader.
-    print('Initializing S3 uploader')
-    try:
-        with open(CREDENTIALS_FILE) as f:
-            credentials_file = json.load(f)
-
-        AWS_ACCESS_KEY_ID = credentials_file['aws_key_id']
-        AWS_SECRET_ACCESS_KEY = credentials_file['aws_access_key']
-
-        if AWS_SECRET_ACCESS_KEY is None or len(AWS_SECRET_ACCESS_KEY) == 0:
-            raise Exception()
-        if AWS_ACCESS_KEY_ID is None or len(AWS_ACCESS_KEY_ID) == 0:
-            raise Exception()
-    except:
-        print('Failed to read credentials')
-        sys.exit(1)
 
-    try:
-        _uploader = s3_uploader.S3_Uploader(AWS_ACCESS_KEY_ID
-                                            , AWS_SECRET_ACCESS_KEY
-                                            , bucket_name=parsed.s3_bucket
-                                            , file_count_limit=parsed.s3_limit if parsed.s3_limit is not None else 1000
-                                            , take_nth=parsed.s3_interval if parsed.s3_interval is not None else 5)
-        _uploader.connect()
-        uploaders.append(_uploader)
-    except Exception as err:
-        print('Failed to connect to AWS S3: {0}'.format(err))
-        sys.exit(1)
+DEFAULT_S3_INDEX_FILE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    's3_index.db'
+)
 
-if parsed.filesystem:
-    # Set up file system uploader.
-    print('Initializing filesystem uploader')
-    try:
-        if not os.path.exists(parsed.path) or not os.path.isdir(parsed.path):
-            raise ValueError('Path {0} does not exist'.format(parsed.path))
+DEFAULT_S3_SPOOL_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    's3_spool'
+)
 
-        _uploader = filesystem_uploader.Filesystem_Uploader(target_directory=parsed.path,
-                                                            date_limit=parsed.filesystem_limit)
-        uploaders.append(_uploader)
-    except Exception as err:
-        print('Failed to set up file system uploader: {0}'.format(
-            err
-        ))
-        sys.exit(1)
+DEFAULT_S3_THUMBNAIL_INDEX_FILE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    's3_thumbnail_index.db'
+)
+
+# Days the thumbnails are retained in file system when no limit is given.
+DEFAULT_THUMBNAIL_LIMIT_DAYS = 7
 
-# Flag which indicates if capturing image or upload is in progress,
-# so another task doesn't start.
-in_progress = False
+# Share of the S3 spool limits taken by the thumbnail spool, the captures get the rest.
+THUMBNAIL_SPOOL_SHARE = 0.1
 
+# Seconds to wait for the running capture and uploads on exit.
+STOP_TIMEOUT_SECONDS = 30
 
-def take_photo():
+
+def main(argv=None, scheduler=None):
     """
-    Take a photo and return boolean value indicating the success.
+    Run the camera until the scheduler is stopped.
+    Scheduler can be passed in by a supervisor which stops it.
     """
 
-    print('Taking a photo')
+    parsed = parser.parse_args(argv)
 
-    # Run web cam program and create capture.
-    command = ['fswebcam', '--no-banner', '--jpeg', '95', TEMP_FILE_NAME]
+    if scheduler is None:
+        scheduler = Periodic_Scheduler(name='camera')
 
-    try:
-        process_result = subprocess.run(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-
-        code = process_result.returncode
-        stdout = process_result.stdout
-        stderr = process_result.stdout
-
-        if code != 0:
-            print('Non-ok return code {0} from capture subprocess'.format(code))
-            print('STDOUT: {0}'.format(stdout))
-            print('STDERR: {0}'.format(stderr))
-            return False
-    except Exception as err:
-        print('Exception while running capture subprocess: {0}'.format(err))
+    # List of uploaders which get passed the created file name.
+    # Uploaders pass the file wherever they want to, to cloud or file system etc.
+    uploaders = []
 
-    return True
+    try:
+        run(parsed, scheduler, uploaders)
+    finally:
+        # Stop the threads of the uploaders also when setting up failed,
+        # so that a restart by the supervisor doesn't leave them running.
+        for uploader in uploaders:
+            if hasattr(uploader, 'close'):
+                uploader.close()
 
 
-def capture_task():
+def run(parsed, scheduler, uploaders):
     """
-    Run photo capturing task.
+    Set up the camera and the uploaders, adding them to uploaders, and run until the scheduler is stopped.
     """
 
-    global in_progress
+    # Workers which feed the captures to uploaders, one per uploader.
+    upload_workers = []
+
+    # Adaptive controller, if enabled, which steps the capture settings.
+    controller = None
+
+    CAPTURE_MODE = parsed.capture_mode
+
+    # Interval at which pictures are taken.
+    CAPTURE_INTERVAL_SECONDS = parsed.interval
+    # Interval at which files are iterated and old captures removed.
+    CLEAN_INTERVAL_SECONDS = parsed.clean_interval
+
+    if CAPTURE_INTERVAL_SECONDS < 1:
+        print('Invalid interval {0}'.format(CAPTURE_INTERVAL_SECONDS))
+        sys.exit(1)
+
+    if parsed.queue_size < 1:
+        print('Invalid queue size {0}'.format(parsed.queue_size))
+        sys.exit(1)
 
-    if in_progress:
-        print('Deferring capture, in_progress=True')
-        return
+    if not parsed.motion and (parsed.s3_upload_on != UPLOAD_ALWAYS or parsed.filesystem_upload_on != UPLOAD_ALWAYS):
+        print('Uploading only changed captures requires --motion')
+        sys.exit(1)
 
-    in_progress = True
+    S3_INTERVAL = parsed.s3_interval if parsed.s3_interval is not None else 5
 
-    print('Running capture/upload sequence, timestamp {0}'.format(time.time()))
+    CREDENTIALS_FILE = parsed.credentials if parsed.credentials is not None else DEFAULT_CREDENTIALS_FILE
 
+    S3_INDEX_FILE = parsed.s3_index if parsed.s3_index is not None else DEFAULT_S3_INDEX_FILE
+    # Thumbnail index is kept next to the capture index.
+    S3_THUMBNAIL_INDEX_FILE = '{0}_thumbnails{1}'.format(*os.path.splitext(parsed.s3_index)) \
+        if parsed.s3_index is not None else DEFAULT_S3_THUMBNAIL_INDEX_FILE
+    S3_SPOOL_DIRECTORY = parsed.s3_spool if parsed.s3_spool is not None else DEFAULT_S3_SPOOL_DIRECTORY
+
+    # The captures and thumbnails share the spool limits given on the command line.
+    S3_THUMBNAIL_SPOOL_BYTES = int(parsed.s3_spool_limit * 1000000 * THUMBNAIL_SPOOL_SHARE) \
+        if parsed.thumbnails else 0
+    S3_THUMBNAIL_SPOOL_COUNT = int(parsed.s3_spool_count * THUMBNAIL_SPOOL_SHARE) if parsed.thumbnails else 0
+    S3_SPOOL_BYTES = parsed.s3_spool_limit * 1000000 - S3_THUMBNAIL_SPOOL_BYTES
+    S3_SPOOL_COUNT = parsed.s3_spool_count - S3_THUMBNAIL_SPOOL_COUNT
+    if not os.path.exists(CREDENTIALS_FILE):
+        print('Credentials file does not exists')
+        sys.exit(1)
+
+    if not parsed.s3 and not parsed.filesystem:
+        print('You specified no target for files, specify cloud provider and/or file system')
+        sys.exit(1)
+
+    if parsed.s3:
+        # Set up S3 uploader.
+        print('Initializing S3 uploader')
+        try:
+            with open(CREDENTIALS_FILE) as f:
+                credentials_file = json.load(f)
+
+            AWS_ACCESS_KEY_ID = credentials_file['aws_key_id']
+            AWS_SECRET_ACCESS_KEY = credentials_file['aws_access_key']
+
+            if AWS_SECRET_ACCESS_KEY is None or len(AWS_SECRET_ACCESS_KEY) == 0:
+                raise Exception()
+            if AWS_ACCESS_KEY_ID is None or len(AWS_ACCESS_KEY_ID) == 0:
+                raise Exception()
+        except:
+            print('Failed to read credentials')
+            sys.exit(1)
+
+        try:
+            _uploader = s3_uploader.S3_Uploader(AWS_ACCESS_KEY_ID
+                                                , AWS_SECRET_ACCESS_KEY
+                                                , bucket_name=parsed.s3_bucket
+                                                , file_count_limit=parsed.s3_limit if parsed.s3_limit is not None else 1000
+                                                # When uploading on change, the worker takes care of the n-th capture.
+                                                , take_nth=S3_INTERVAL if parsed.s3_upload_on == UPLOAD_ALWAYS else 1
+                                                , index_file=S3_INDEX_FILE
+                                                , reconcile_interval=parsed.s3_reconcile_interval
+                                                , multipart_threshold=parsed.s3_multipart_threshold
+                                                , multipart_chunksize=parsed.s3_chunk_size
+                                                , max_concurrency=parsed.s3_concurrency
+                                                , max_pool_connections=parsed.s3_pool_size
+                                                , delete_concurrency=parsed.s3_delete_concurrency
+                                                , dry_run=parsed.s3_dry_run
+                                                , spool_directory=S3_SPOOL_DIRECTORY
+                                                , spool_max_bytes=S3_SPOOL_BYTES
+                                                , spool_max_count=S3_SPOOL_COUNT
+                                                , replay_concurrency=parsed.s3_replay_concurrency
+                                                , segment_minutes=parsed.s3_segment_minutes)
+            try:
+                _uploader.connect()
+            except Exception as err:
+                # Captures are spooled, and the spool keeps trying to connect.
+                print('Failed to connect to AWS S3, spooling captures until connected: {0}'.format(err))
+            uploaders.append(_uploader)
+            upload_workers.append(Upload_Worker(_uploader,
+                                                queue_size=parsed.queue_size,
+                                                policy=parsed.s3_backpressure,
+                                                spill_directory=os.path.join(parsed.spill_path, 's3')
+                                                if parsed.s3_backpressure == POLICY_SPILL else None,
+                                                upload_on=parsed.s3_upload_on,
+                                                nth=S3_INTERVAL))
+        except Exception as err:
+            print('Failed to set up S3 uploader: {0}'.format(err))
+            sys.exit(1)
+
+    if parsed.filesystem:
+        # Set up file system uploader.
+        print('Initializing filesystem uploader')
+        try:
+            if not os.path.exists(parsed.path) or not os.path.isdir(parsed.path):
+                raise ValueError('Path {0} does not exist'.format(parsed.path))
+
+            size_limit = parsed.filesystem_size_limit * 1000000 if parsed.filesystem_size_limit is not None else None
+            _uploader = filesystem_uploader.Filesystem_Uploader(target_directory=parsed.path,
+                                                                date_limit=parsed.filesystem_limit,
+                                                                size_limit=size_limit,
+                                                                count_limit=parsed.filesystem_count_limit)
+            uploaders.append(_uploader)
+            upload_workers.append(Upload_Worker(_uploader,
+                                                queue_size=parsed.queue_size,
+                                                policy=parsed.filesystem_backpressure,
+                                                spill_directory=os.path.join(parsed.spill_path, 'filesystem')
+                                                if parsed.filesystem_backpressure == POLICY_SPILL else None,
+                                                upload_on=parsed.filesystem_upload_on,
+                                                nth=parsed.filesystem_interval))
+        except Exception as err:
+            print('Failed to set up file system uploader: {0}'.format(
+                err
+            ))
+            sys.exit(1)
+
+    # Backend which grabs the photos from webcam.
     try:
-        photo_success = take_photo()
-        if photo_success:
+        capture_backend = capture.create_backend(parsed.capture_backend,
+                                                 device=parsed.device,
+                                                 quality=parsed.jpeg_quality,
+                                                 resolution=parsed.resolution,
+                                                 temp_file=TEMP_FILE_NAME if CAPTURE_MODE == CAPTURE_MODE_FILE else None)
+    except Exception as err:
+        print('Failed to set up capture backend: {0}'.format(err))
+        sys.exit(1)
+
+    try:
+        # Optional stage which tells whether anything changed between captures.
+        analyzer = None
+        if parsed.motion:
+            try:
+                # NumPy and Pillow are only needed for the analysis.
+                from cloud_camera.motion import Change_Analyzer
+
+                analyzer = Change_Analyzer(pixel_threshold=parsed.motion_pixel_threshold,
+                                           change_threshold=parsed.motion_threshold)
+            except Exception as err:
+                print('Failed to set up change analysis: {0}'.format(err))
+                sys.exit(1)
+
+        if parsed.thumbnails:
+            # Set up the thumbnail stage, with uploaders of its own.
+            print('Initializing thumbnails')
+            try:
+                # Pillow is only needed for the thumbnails.
+                from cloud_camera.thumbnails import Thumbnail_Uploader, Contact_Sheet
+
+                thumbnail_uploaders = []
+                if parsed.thumbnail_path is not None:
+                    if not os.path.isdir(parsed.thumbnail_path):
+                        raise ValueError('Path {0} does not exist'.format(parsed.thumbnail_path))
+
+                    thumbnail_uploaders.append(filesystem_uploader.Filesystem_Uploader(
+                        target_directory=parsed.thumbnail_path,
+                        date_limit=parsed.thumbnail_limit if parsed.thumbnail_limit is not None
+                        else parsed.filesystem_limit if parsed.filesystem_limit is not None
+                        else DEFAULT_THUMBNAIL_LIMIT_DAYS))
+
+                if parsed.s3:
+                    _uploader = s3_uploader.S3_Uploader(AWS_ACCESS_KEY_ID
+                                                        , AWS_SECRET_ACCESS_KEY
+                                                        , bucket_name=parsed.s3_bucket
+                                                        , file_count_limit=parsed.s3_thumbnail_limit
+                                                        , index_file=S3_THUMBNAIL_INDEX_FILE
+                                                        , reconcile_interval=parsed.s3_reconcile_interval
+                                                        , max_pool_connections=parsed.s3_pool_size
+                                                        , delete_concurrency=parsed.s3_delete_concurrency
+                                                        , dry_run=parsed.s3_dry_run
+                                                        # The main spool ignores subdirectories.
+                                                        , spool_directory=os.path.join(S3_SPOOL_DIRECTORY, 'thumbnails')
+                                                        , spool_max_bytes=S3_THUMBNAIL_SPOOL_BYTES
+                                                        , spool_max_count=S3_THUMBNAIL_SPOOL_COUNT
+                                                        , replay_concurrency=parsed.s3_replay_concurrency
+                                                        , key_prefix=parsed.s3_thumbnail_prefix)
+                    try:
+                        _uploader.connect()
+                    except Exception as err:
+                        print('Failed to connect to AWS S3, spooling thumbnails until connected: {0}'.format(err))
+                    thumbnail_uploaders.append(_uploader)
+
+                if len(thumbnail_uploaders) == 0:
+                    raise ValueError('Thumbnails require --thumbnail_path or --s3')
+
+                sheet = None
+                if parsed.contact_sheet_tiles > 0:
+                    sheet = Contact_Sheet(tile_size=capture.parse_resolution(parsed.contact_sheet_tile),
+                                          columns=parsed.contact_sheet_columns,
+                                          tiles=parsed.contact_sheet_tiles)
+
+                _uploader = Thumbnail_Uploader(thumbnail_uploaders,
+                                               size=capture.parse_resolution(parsed.thumbnail_size),
+                                               quality=parsed.thumbnail_quality,
+                                               sheet=sheet)
+                uploaders.append(_uploader)
+                upload_workers.append(Upload_Worker(_uploader,
+                                                    queue_size=parsed.queue_size,
+                                                    policy=POLICY_DROP_OLDEST))
+            except Exception as err:
+                print('Failed to set up thumbnails: {0}'.format(err))
+                sys.exit(1)
+
+        # Pipeline which hands captures to upload workers, so that slow uploads
+        # don't delay the following captures.
+        pipeline = Capture_Pipeline(upload_workers, analyzer=analyzer)
+
+        def capture_task():
+            """
+            Run photo capturing task and queue the capture for the uploaders.
+            """
+
+            print('Running capture sequence, timestamp {0}'.format(time.time()))
+
+            print('Taking a photo')
+
             target_file_name = get_current_filename()
+            data = capture_backend.capture()
+
+            if data is not None:
+                pipeline.publish(data, target_file_name)
+            else:
+                pipeline.stats['failed'] += 1
+
+        def cleanup_task(rethrow=False):
+            print('Running cleanup task')
 
             for uploader in uploaders:
-                # Iterate the uploaders and send the capture to each.
-                print('Passing the capture to uploader {0}'.format(
-                    uploader.__class__.__name__
-                ))
                 try:
-                    uploader.upload(TEMP_FILE_NAME, target_file_name)
+                    uploader.purge_old()
                 except Exception as err:
-                    print('Exception in uploader {0}: {1}'.format(
+                    print('Exception while running purge_old for {0}: {1}'.format(
                         uploader.__class__.__name__,
                         err
                     ))
-    except Exception as err:
-        print('Exception while running capture/upload sequence: {0}'.format(err))
-
-    in_progress = False
-
-
-# Create scheduler
-scheduler = sched.scheduler(time.time, time.sleep)
-
-
-def schedule_capture_task():
-    print('Running capture task')
-    try:
-        capture_task()
-    except Exception as err:
-        print('Exception while running capture_task: {0}'.format(err))
 
-    # Reschedule the same task.
-    scheduler.enter(CAPTURE_INTERVAL_SECONDS, 1, schedule_capture_task)
+                    if rethrow:
+                        # Rethrow the exception to stop execution flow when requested.
+                        raise
 
+            capture_backend.log_stats()
+            pipeline.log_stats()
 
-def schedule_cleanup_task(rethrow=False):
-    print('Running cleanup task')
+            for uploader in uploaders:
+                if getattr(uploader, 'transfer', None) is not None:
+                    uploader.transfer.log_stats()
+                if getattr(uploader, 'spool', None) is not None:
+                    uploader.spool.log_stats()
+
+            if controller is not None:
+                controller.log_stats()
+
+            scheduler.log_stats()
+
+        print('Purging irrelevant files')
+        for uploader in uploaders:
+            # Iterate uploaders, order all to purge irrelevant files.
+            # Do this only once at startup.
+            try:
+                uploader.purge_irrelevant()
+            except Exception as err:
+                print('Exception while running purge_irrelevant for {0}: {1}'.format(
+                    uploader.__class__.__name__,
+                    err
+                ))
+                sys.exit(1)
 
-    for uploader in uploaders:
         try:
-            uploader.purge_old()
+            # Run the cleanup tasks for all uploaders for the first time
+            # to verify that cleanup works.
+            cleanup_task(rethrow=True)
         except Exception as err:
-            print('Exception while running purge_old for {0}: {1}'.format(
-                uploader.__class__.__name__,
+            print('Exception while running initial cleanup tasks: {0}'.format(
                 err
             ))
+            sys.exit(1)
+
+        # Schedule the image capturing and cleanup tasks.
+        capture_job = scheduler.add('capture', capture_task, CAPTURE_INTERVAL_SECONDS, overlap=parsed.capture_overlap)
+        scheduler.add('cleanup', cleanup_task, CLEAN_INTERVAL_SECONDS)
+
+        if parsed.adaptive:
+            # Controller which degrades the captures when disk or uplink can't keep up.
+            try:
+                controller = adaptive.Adaptive_Controller(
+                    capture_backend,
+                    capture_job,
+                    upload_workers,
+                    # Captures fill the file system target, or the spill directory.
+                    disk_path=parsed.path if parsed.filesystem else (
+                        parsed.spill_path if os.path.isdir(parsed.spill_path) else '.'),
+                    min_quality=parsed.adaptive_min_quality,
+                    resolutions=parsed.adaptive_resolutions.split(',') if parsed.adaptive_resolutions else None,
+                    max_interval=parsed.adaptive_max_interval,
+                    min_free_bytes=parsed.adaptive_min_free_mb * 1000000,
+                    max_depth=parsed.adaptive_max_depth if parsed.adaptive_max_depth is not None
+                    else parsed.queue_size // 2,
+                    max_latency=parsed.adaptive_max_latency,
+                    latency_sources=[uploader for uploader in uploaders if hasattr(uploader, 'recent_latency')]
+                )
+            except Exception as err:
+                print('Failed to set up adaptive controller: {0}'.format(err))
+                sys.exit(1)
+
+            scheduler.add('adaptive', controller.update, parsed.adaptive_interval)
+
+        # Start the upload workers once everything is set up.
+        pipeline.start()
+
+        print('Starting main application loop')
+        try:
+            scheduler.run()
+        finally:
+            # Let the running capture finish and the queued captures be uploaded or spilled.
+            scheduler.stop(timeout=STOP_TIMEOUT_SECONDS)
+            pipeline.stop(timeout=STOP_TIMEOUT_SECONDS)
+    finally:
+        # Release the device also when setting up failed, so that a restart doesn't leak it.
+        capture_backend.close()
 
-            if rethrow:
-                # Rethrow the exception to stop execution flow when requested.
-                raise
-
-    # Reschedule the same task.
-    scheduler.enter(CLEAN_INTERVAL_SECONDS, 1, schedule_cleanup_task)
 
+def handle_sigterm(signum, frame):
+    """
+    Exit normally on SIGTERM so that the running uploads finish.
+    """
+    print('Received SIGTERM, exiting')
+    sys.exit(0)
 
-print('Purging irrelevant files')
-for uploader in uploaders:
-    # Iterate uploaders, order all to purge irrelevant files.
-    # Do this only once at startup.
-    try:
-        uploader.purge_irrelevant()
-    except Exception as err:
-        print('Exception while running purge_irrelevant for {0}: {1}'.format(
-            uploader.__class__.__name__,
-            err
-        ))
-        sys.exit(1)
 
-try:
-    # Run the cleanup tasks for all uploaders for the first time.
-    # This will schedule the task periodically and also verify that cleanup works.
-    schedule_cleanup_task(rethrow=True)
-except Exception as err:
-    print('Exception while running initial cleanup tasks: {0}'.format(
-        err
-    ))
-    sys.exit(1)
-
-# Schedule the image capturing task.
-scheduler.enter(CAPTURE_INTERVAL_SECONDS, 1, schedule_capture_task)
-
-print('Starting main application loop')
-scheduler.run()
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    main()
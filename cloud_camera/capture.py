@@ -0,0 +1,274 @@
+import collections
+import subprocess
+import time
+
+# Names of the available capture backends.
+BACKEND_FSWEBCAM = 'fswebcam'
+BACKEND_OPENCV = 'opencv'
+BACKENDS = (BACKEND_FSWEBCAM, BACKEND_OPENCV)
+
+DEFAULT_DEVICE = '/dev/video0'
+DEFAULT_JPEG_QUALITY = 95
+
+# Count of frames read and discarded after opening the device, so that
+# exposure and white balance have settled before the first capture.
+WARMUP_FRAMES = 10
+
+# Count of most recent captures kept for the latency statistics.
+RECENT_CAPTURE_COUNT = 20
+
+
+class Capture_Backend:
+    """
+    Base for the ways of grabbing a JPEG from the webcam.
+    Subclasses implement _capture, which returns the JPEG as bytes.
+    """
+
+    def __init__(self, device=DEFAULT_DEVICE, quality=DEFAULT_JPEG_QUALITY, resolution=None):
+        if device is None or len(device) == 0:
+            raise ValueError('Invalid device')
+        if quality is None or not isinstance(quality, int) or quality < 1 or quality > 100:
+            raise ValueError('Invalid quality')
+
+        self.device = device
+        self.quality = quality
+        self.resolution = resolution
+        self.recent = collections.deque(maxlen=RECENT_CAPTURE_COUNT)
+        self.stats = {
+            'frames': 0,
+            'failed': 0,
+            'seconds': 0.0,
+        }
+
+    def open(self):
+        """
+        Prepare the device for capturing.
+        """
+        pass
+
+    def close(self):
+        """
+        Release the device.
+        """
+        pass
+
+    def set_resolution(self, resolution):
+        """
+        Change the resolution of the following captures.
+        """
+
+        self.resolution = resolution
+
+    def capture(self):
+        """
+        Take a photo and return the JPEG as bytes, None if capturing failed.
+        """
+
+        start = time.perf_counter()
+
+        try:
+            data = self._capture()
+        except Exception as err:
+            print('Exception while capturing with {0}: {1}'.format(
+                self.__class__.__name__,
+                err
+            ))
+            data = None
+
+        elapsed = time.perf_counter() - start
+
+        if data is None or len(data) == 0:
+            self.stats['failed'] += 1
+            return None
+
+        self.recent.append(elapsed)
+        self.stats['frames'] += 1
+        self.stats['seconds'] += elapsed
+
+        print('Captured {0} bytes in {1:.3f}s'.format(len(data), elapsed))
+
+        return data
+
+    def recent_latency(self):
+        """
+        Get the average latency in seconds of the most recent captures,
+        None if nothing has been captured.
+        """
+
+        if len(self.recent) == 0:
+            return None
+
+        return sum(self.recent) / len(self.recent)
+
+    def log_stats(self):
+        frames = self.stats['frames']
+
+        print('Capture backend {0} stats: frames:{1}, failed:{2}, average latency:{3:.3f}s'.format(
+            self.__class__.__name__,
+            frames,
+            self.stats['failed'],
+            self.stats['seconds'] / frames if frames > 0 else 0
+        ))
+
+    def _capture(self):
+        raise NotImplementedError()
+
+
+class Fswebcam_Backend(Capture_Backend):
+    """
+    Runs fswebcam for every capture. Slow, as the device is opened and
+    the format negotiated every time, but works with any webcam fswebcam supports.
+    """
+
+    def __init__(self, device=DEFAULT_DEVICE, quality=DEFAULT_JPEG_QUALITY, resolution=None, temp_file=None):
+        super().__init__(device, quality, resolution)
+
+        # When set, fswebcam writes into the file instead of the pipe.
+        self.temp_file = temp_file
+
+        print('Fswebcam_Backend initialized with device:{0}, quality:{1}, resolution:{2}, temp_file:{3}'.format(
+            self.device,
+            self.quality,
+            self.resolution,
+            self.temp_file
+        ))
+
+    def _capture(self):
+        # Run web cam program and create capture, either straight into the
+        # pipe or through the temporary file.
+        target = '-' if self.temp_file is None else self.temp_file
+        command = ['fswebcam', '--no-banner', '--device', self.device, '--jpeg', str(self.quality)]
+        if self.resolution is not None:
+            command.extend(['--resolution', self.resolution])
+        command.append(target)
+
+        process_result = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        code = process_result.returncode
+        stdout = process_result.stdout
+        stderr = process_result.stderr
+
+        if code != 0:
+            print('Non-ok return code {0} from capture subprocess'.format(code))
+            if self.temp_file is not None:
+                print('STDOUT: {0}'.format(stdout.decode(errors='replace')))
+            print('STDERR: {0}'.format(stderr.decode(errors='replace')))
+            return None
+
+        if self.temp_file is None:
+            return stdout
+
+        with open(self.temp_file, 'rb') as f:
+            return f.read()
+
+
+class OpenCV_Backend(Capture_Backend):
+    """
+    Keeps the device open through OpenCV and grabs frames on demand,
+    so the device setup and warm-up is paid only once.
+    """
+
+    def __init__(self, device=DEFAULT_DEVICE, quality=DEFAULT_JPEG_QUALITY, resolution=None):
+        super().__init__(device, quality, resolution)
+
+        self.camera = None
+        # Resolution changed while open, applied on the capture thread before the next frame.
+        self.pending_resolution = None
+
+        print('OpenCV_Backend initialized with device:{0}, quality:{1}, resolution:{2}'.format(
+            self.device,
+            self.quality,
+            self.resolution
+        ))
+
+    def open(self):
+        # OpenCV is only needed with this backend.
+        import cv2
+
+        self.cv2 = cv2
+
+        print('Opening device {0}'.format(self.device))
+        self.camera = cv2.VideoCapture(self.device, cv2.CAP_V4L2)
+
+        if not self.camera.isOpened():
+            self.camera = None
+            raise Exception('Could not open device {0}'.format(self.device))
+
+        # Keep only the latest frame in the driver, so a capture is never stale.
+        self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        if self.resolution is not None:
+            self._apply_resolution(self.resolution)
+
+        for i in range(WARMUP_FRAMES):
+            self.camera.grab()
+
+    def set_resolution(self, resolution):
+        super().set_resolution(resolution)
+        self.pending_resolution = resolution
+
+    def close(self):
+        if self.camera is not None:
+            print('Closing device {0}'.format(self.device))
+            self.camera.release()
+            self.camera = None
+
+    def _capture(self):
+        if self.camera is None:
+            raise Exception('Device is not open')
+
+        if self.pending_resolution is not None:
+            self._apply_resolution(self.pending_resolution)
+            self.pending_resolution = None
+
+        ok, image = self.camera.read()
+        if not ok:
+            print('Failed to read frame from device {0}'.format(self.device))
+            return None
+
+        ok, encoded = self.cv2.imencode('.jpg', image, [self.cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            print('Failed to encode frame')
+            return None
+
+        return encoded.tobytes()
+
+    def _apply_resolution(self, resolution):
+        width, height = parse_resolution(resolution)
+        self.camera.set(self.cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.camera.set(self.cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+
+def parse_resolution(resolution):
+    """
+    Parse resolution string such as 1280x720 into tuple of width and height.
+    """
+
+    try:
+        width, height = resolution.lower().split('x')
+        return int(width), int(height)
+    except Exception:
+        raise ValueError('Invalid resolution {0}'.format(resolution))
+
+
+def create_backend(name, device=DEFAULT_DEVICE, quality=DEFAULT_JPEG_QUALITY, resolution=None, temp_file=None):
+    """
+    Create and open the named capture backend.
+    Falls back to fswebcam if the backend cannot be opened.
+    """
+
+    if name not in BACKENDS:
+        raise ValueError('Invalid capture backend {0}'.format(name))
+
+    if name == BACKEND_OPENCV:
+        backend = OpenCV_Backend(device, quality, resolution)
+        try:
+            backend.open()
+            return backend
+        except Exception as err:
+            print('Failed to open OpenCV backend, falling back to fswebcam: {0}'.format(err))
+
+    backend = Fswebcam_Backend(device, quality, resolution, temp_file=temp_file)
+    backend.open()
+    return backend
@@ -0,0 +1,92 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+# Size of the grayscale thumbnail the frames are compared at.
+ANALYSIS_SIZE = (64, 48)
+
+# Default difference of a single pixel, out of 255, above which it counts as changed.
+DEFAULT_PIXEL_THRESHOLD = 25
+# Default fraction of changed pixels above which the frame counts as changed.
+DEFAULT_CHANGE_THRESHOLD = 0.01
+
+
+class Change_Analyzer:
+    """
+    Compares each frame to the previous one on a small grayscale thumbnail
+    and marks the frame changed when enough of the pixels differ.
+    """
+
+    def __init__(self, pixel_threshold=DEFAULT_PIXEL_THRESHOLD, change_threshold=DEFAULT_CHANGE_THRESHOLD):
+        if pixel_threshold is None or pixel_threshold < 0 or pixel_threshold > 255:
+            raise ValueError('Invalid pixel_threshold')
+        if change_threshold is None or change_threshold < 0 or change_threshold > 1:
+            raise ValueError('Invalid change_threshold')
+
+        self.pixel_threshold = pixel_threshold
+        self.change_threshold = change_threshold
+        self.previous = None
+        self.stats = {
+            'analyzed': 0,
+            'changed': 0,
+        }
+
+        print('Change_Analyzer initialized with pixel_threshold:{0}, change_threshold:{1}'.format(
+            self.pixel_threshold,
+            self.change_threshold
+        ))
+
+    def analyze(self, frame):
+        """
+        Set changed and score of the frame.
+        Frames which cannot be decoded are considered changed.
+        """
+
+        try:
+            current = self._to_thumbnail(frame.data)
+        except Exception as err:
+            print('Exception while decoding frame {0} for analysis: {1}'.format(
+                frame.target_name,
+                err
+            ))
+            frame.changed = True
+            return
+
+        self.stats['analyzed'] += 1
+
+        if self.previous is None:
+            frame.score = 1.0
+        else:
+            diff = np.abs(current - self.previous)
+            frame.score = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+
+        frame.changed = frame.score >= self.change_threshold
+        self.previous = current
+
+        if frame.changed:
+            self.stats['changed'] += 1
+
+        print('Frame {0} change score {1:.4f}, changed:{2}'.format(
+            frame.target_name,
+            frame.score,
+            frame.changed
+        ))
+
+    def log_stats(self):
+        print('Change analysis stats: {0}'.format(self.stats))
+
+    @staticmethod
+    def _to_thumbnail(data):
+        """
+        Decode the JPEG into a small grayscale array.
+        """
+
+        image = Image.open(io.BytesIO(data))
+
+        # Let the JPEG decoder skip most of the work by decoding straight
+        # to grayscale at a fraction of the size.
+        image.draft('L', (ANALYSIS_SIZE[0] * 2, ANALYSIS_SIZE[1] * 2))
+        image = image.convert('L').resize(ANALYSIS_SIZE, Image.BILINEAR)
+
+        return np.asarray(image, dtype=np.int16)
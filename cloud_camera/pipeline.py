@@ -0,0 +1,331 @@
+import os
+import queue
+import threading
+import time
+
+# Backpressure policies which decide what happens when an uploader's queue is full.
+# Drop the oldest queued capture to make room for the new one.
+POLICY_DROP_OLDEST = 'drop-oldest'
+# Block the capture task until the uploader has room.
+POLICY_BLOCK = 'block'
+# Move the new capture to disk and upload it once the queue has drained.
+POLICY_SPILL = 'spill'
+POLICIES = (POLICY_DROP_OLDEST, POLICY_BLOCK, POLICY_SPILL)
+
+# Upload policies which decide which captures an uploader gets.
+# Every capture.
+UPLOAD_ALWAYS = 'always'
+# Only captures which changed from the previous one.
+UPLOAD_ON_CHANGE = 'change'
+# Every n-th capture, and any capture which changed.
+UPLOAD_NTH_OR_CHANGE = 'nth-or-change'
+UPLOAD_POLICIES = (UPLOAD_ALWAYS, UPLOAD_ON_CHANGE, UPLOAD_NTH_OR_CHANGE)
+
+# Seconds the worker waits before retrying a spilled capture that failed to upload.
+SPILL_RETRY_SECONDS = 30
+
+
+class Frame:
+    """
+    Single capture shared by all upload workers.
+    All workers get the same in-memory JPEG buffer.
+    """
+
+    def __init__(self, data, target_name):
+        self.data = data
+        self.target_name = target_name
+
+        # Set by the analyzer, without one every frame counts as changed.
+        self.changed = True
+        self.score = None
+
+
+class Upload_Worker:
+    """
+    Drains captures from a bounded queue into a single uploader
+    on a dedicated thread.
+    """
+
+    def __init__(self, uploader, queue_size, policy, spill_directory=None, upload_on=UPLOAD_ALWAYS, nth=1):
+        if queue_size is None or not isinstance(queue_size, int) or queue_size < 1:
+            raise ValueError('Invalid queue_size')
+        if policy not in POLICIES:
+            raise ValueError('Invalid policy {0}'.format(policy))
+        if policy == POLICY_SPILL and spill_directory is None:
+            raise ValueError('Spill policy requires spill_directory')
+        if upload_on not in UPLOAD_POLICIES:
+            raise ValueError('Invalid upload_on {0}'.format(upload_on))
+        if nth is None or not isinstance(nth, int) or nth < 1:
+            raise ValueError('Invalid nth')
+
+        self.uploader = uploader
+        self.name = uploader.__class__.__name__
+        self.policy = policy
+        self.upload_on = upload_on
+        self.nth = nth
+        self.count_since_upload = 0
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.spill_directory = spill_directory
+        self.spilled = []
+        self.spill_retry_at = 0
+        self.stopping = threading.Event()
+        self.stats = {
+            'enqueued': 0,
+            'uploaded': 0,
+            'failed': 0,
+            'dropped': 0,
+            'spilled': 0,
+            'skipped': 0,
+        }
+
+        if self.spill_directory is not None:
+            if not os.path.exists(self.spill_directory):
+                os.makedirs(self.spill_directory)
+
+            # Pick up captures spilled before a restart, oldest first.
+            # Hidden files are partial writes left by a crash.
+            self.spilled = sorted(name for name in os.listdir(self.spill_directory) if not name.startswith('.'))
+            if len(self.spilled) > 0:
+                print('Found {0} spilled captures for {1}'.format(
+                    len(self.spilled),
+                    self.name
+                ))
+
+        self.thread = threading.Thread(target=self._run, name='upload-{0}'.format(self.name), daemon=True)
+
+        print('Upload_Worker initialized for {0} with queue_size:{1}, policy:{2}, upload_on:{3}, nth:{4}'.format(
+            self.name,
+            queue_size,
+            self.policy,
+            self.upload_on,
+            self.nth
+        ))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker after the running upload, waiting at most timeout seconds
+        for the queued captures to be spilled or uploaded.
+        """
+
+        self.stopping.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def submit(self, frame):
+        """
+        Queue the frame for upload, applying the backpressure policy if the queue is full.
+        """
+
+        if not self._wants(frame):
+            self.stats['skipped'] += 1
+            return
+
+        if self.policy == POLICY_BLOCK:
+            self.queue.put(frame)
+            self.stats['enqueued'] += 1
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(frame)
+                self.stats['enqueued'] += 1
+                return
+            except queue.Full:
+                pass
+
+            if self.policy == POLICY_SPILL:
+                self._spill(frame)
+                return
+
+            # Make room by discarding the oldest capture.
+            try:
+                oldest = self.queue.get_nowait()
+            except queue.Empty:
+                continue
+
+            print('Queue of {0} is full, dropping capture {1}'.format(
+                self.name,
+                oldest.target_name
+            ))
+            self.stats['dropped'] += 1
+
+    def _wants(self, frame):
+        """
+        Tell whether the frame should be uploaded according to the upload policy.
+        """
+
+        if self.upload_on == UPLOAD_ALWAYS:
+            return True
+
+        self.count_since_upload = self.count_since_upload + 1
+
+        if frame.changed or (self.upload_on == UPLOAD_NTH_OR_CHANGE and self.count_since_upload >= self.nth):
+            self.count_since_upload = 0
+            return True
+
+        return False
+
+    def depth(self):
+        """
+        Count of captures waiting for upload, including spilled ones
+        and the ones in the spool of the uploader.
+        """
+
+        spool = getattr(self.uploader, 'spool', None)
+
+        return self.queue.qsize() + len(self.spilled) + (spool.depth() if spool is not None else 0)
+
+    def _spill(self, frame):
+        """
+        Persist the frame into the spill directory.
+        """
+
+        spill_path = os.path.join(self.spill_directory, frame.target_name)
+        temp_path = os.path.join(self.spill_directory, '.{0}.tmp'.format(frame.target_name))
+
+        try:
+            # Write under a temporary name so a crash never leaves a partial capture.
+            with open(temp_path, 'wb') as f:
+                f.write(frame.data)
+            os.replace(temp_path, spill_path)
+
+            self.spilled.append(frame.target_name)
+            self.stats['spilled'] += 1
+        except Exception as err:
+            print('Failed to spill capture {0} for {1}: {2}'.format(
+                frame.target_name,
+                self.name,
+                err
+            ))
+            self.stats['dropped'] += 1
+
+    def _upload(self, upload, source, target_name):
+        """
+        Pass a single capture to the uploader, returning boolean value indicating the success.
+        """
+
+        print('Passing the capture to uploader {0}'.format(self.name))
+
+        try:
+            upload(source, target_name)
+            self.stats['uploaded'] += 1
+            return True
+        except Exception as err:
+            print('Exception in uploader {0}: {1}'.format(
+                self.name,
+                err
+            ))
+            self.stats['failed'] += 1
+
+        return False
+
+    def _upload_spilled(self):
+        """
+        Upload the oldest spilled capture.
+        Returns False if there was nothing to do.
+        """
+
+        if len(self.spilled) == 0 or time.time() < self.spill_retry_at:
+            return False
+
+        target_name = self.spilled[0]
+        spill_path = os.path.join(self.spill_directory, target_name)
+
+        if self._upload(self.uploader.upload, spill_path, target_name):
+            self.spilled.pop(0)
+            os.remove(spill_path)
+        else:
+            self.spill_retry_at = time.time() + SPILL_RETRY_SECONDS
+
+        return True
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                frame = self.queue.get_nowait()
+            except queue.Empty:
+                # Fresh captures take priority, spilled ones are uploaded when idle.
+                if self._upload_spilled():
+                    continue
+
+                try:
+                    frame = self.queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+
+            self._upload(self.uploader.upload_data, frame.data, frame.target_name)
+
+        self._drain()
+
+    def _drain(self):
+        """
+        Spill the queued captures, or upload them if spilling is not in use.
+        """
+
+        while True:
+            try:
+                frame = self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+            if self.spill_directory is not None:
+                self._spill(frame)
+            else:
+                self._upload(self.uploader.upload_data, frame.data, frame.target_name)
+
+
+class Capture_Pipeline:
+    """
+    Fans captures out to upload workers so that a slow uploader
+    never delays the next capture.
+    """
+
+    def __init__(self, workers, analyzer=None):
+        if workers is None or len(workers) == 0:
+            raise ValueError('Invalid workers')
+
+        self.workers = workers
+        # Optional stage which marks the frames changed or unchanged before the workers get them.
+        self.analyzer = analyzer
+        self.stats = {
+            'captured': 0,
+            'failed': 0,
+        }
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, timeout=None):
+        for worker in self.workers:
+            worker.stop(timeout)
+
+    def publish(self, data, target_name):
+        """
+        Hand a finished capture to every worker.
+        """
+
+        self.stats['captured'] += 1
+
+        frame = Frame(data, target_name)
+        if self.analyzer is not None:
+            self.analyzer.analyze(frame)
+
+        for worker in self.workers:
+            worker.submit(frame)
+
+    def log_stats(self):
+        print('Capture stats: {0}'.format(self.stats))
+
+        if self.analyzer is not None:
+            self.analyzer.log_stats()
+
+        for worker in self.workers:
+            print('Upload stats for {0}: depth:{1}, {2}'.format(
+                worker.name,
+                worker.depth(),
+                worker.stats
+            ))
@@ -0,0 +1,237 @@
+import datetime
+import io
+import threading
+
+from PIL import Image
+
+from cloud_camera.cam_utils import CAPTURE_EXTENSION, format_datetime, get_datetime_from_name
+
+DEFAULT_THUMBNAIL_SIZE = (320, 240)
+DEFAULT_THUMBNAIL_QUALITY = 70
+
+# Contact sheets show at most one tile per slot of the hour, e.g. one a minute with 60 tiles.
+DEFAULT_SHEET_TILE_SIZE = (96, 72)
+DEFAULT_SHEET_COLUMNS = 10
+DEFAULT_SHEET_TILES = 60
+DEFAULT_SHEET_QUALITY = 60
+
+# Colour of the slots without a capture.
+SHEET_BACKGROUND = (32, 32, 32)
+
+
+def make_thumbnail(data, size, quality=DEFAULT_THUMBNAIL_QUALITY):
+    """
+    Decode the JPEG into an image fitting within size, keeping the aspect ratio.
+    Returns tuple of the image and the thumbnail encoded as JPEG.
+    """
+
+    image = Image.open(io.BytesIO(data))
+
+    # Let the JPEG decoder skip most of the work by decoding straight
+    # at a fraction of the size, instead of decoding the full frame.
+    image.draft('RGB', size)
+    image = image.convert('RGB')
+    image.thumbnail(size, Image.BILINEAR)
+
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=quality)
+
+    return image, output.getvalue()
+
+
+class Contact_Sheet:
+    """
+    Collects small tiles of the captures of an hour into a grid, each in the slot
+    of its time within the hour, so that gaps in the captures show as empty slots.
+    """
+
+    def __init__(self, tile_size=DEFAULT_SHEET_TILE_SIZE, columns=DEFAULT_SHEET_COLUMNS,
+                 tiles=DEFAULT_SHEET_TILES, quality=DEFAULT_SHEET_QUALITY):
+        if columns is None or not isinstance(columns, int) or columns < 1:
+            raise ValueError('Invalid columns')
+        if tiles is None or not isinstance(tiles, int) or tiles < 1 or tiles > 3600:
+            raise ValueError('Invalid tiles')
+
+        self.tile_size = tile_size
+        self.columns = columns
+        self.tiles = tiles
+        self.quality = quality
+
+        # Start of the hour, the first capture's datetime and the tiles by slot.
+        self.hour = None
+        self.first = None
+        self.slots = dict()
+
+    def add(self, dt, image):
+        """
+        Add the capture, returning (name, data) of the sheet of the previous hour if it completed one.
+        """
+
+        hour = dt.replace(minute=0, second=0, microsecond=0)
+        completed = None
+        if self.hour is not None and hour != self.hour:
+            completed = self.flush()
+
+        if self.hour is None:
+            self.hour = hour
+            self.first = dt
+
+        slot = (dt.minute * 60 + dt.second) * self.tiles // 3600
+        if slot not in self.slots:
+            tile = image.copy()
+            tile.thumbnail(self.tile_size, Image.BILINEAR)
+            self.slots[slot] = tile
+
+        return completed
+
+    def due(self, now=None):
+        """
+        Tell whether the hour of the collected tiles has passed.
+        """
+
+        if self.hour is None:
+            return False
+
+        now = now if now is not None else datetime.datetime.now()
+        return now >= self.hour + datetime.timedelta(hours=1)
+
+    def flush(self):
+        """
+        Render the collected tiles, returning (name, data), None if there are none.
+        The sheet is named by its first capture, so that a sheet flushed on
+        restart never overwrites one of the same hour.
+        """
+
+        if len(self.slots) == 0:
+            return None
+
+        rows = (self.tiles + self.columns - 1) // self.columns
+        width, height = self.tile_size
+        sheet = Image.new('RGB', (self.columns * width, rows * height), SHEET_BACKGROUND)
+
+        for slot, tile in self.slots.items():
+            x = slot % self.columns * width + (width - tile.width) // 2
+            y = slot // self.columns * height + (height - tile.height) // 2
+            sheet.paste(tile, (x, y))
+
+        output = io.BytesIO()
+        sheet.save(output, 'JPEG', quality=self.quality)
+
+        name = 'contact-{0}{1}'.format(format_datetime(self.first), CAPTURE_EXTENSION)
+        print('Rendered contact sheet {0} of {1} tiles, {2} bytes'.format(name, len(self.slots), output.tell()))
+
+        self.hour = None
+        self.first = None
+        self.slots = dict()
+
+        return name, output.getvalue()
+
+
+class Thumbnail_Uploader:
+    """
+    Pipeline stage which makes a small thumbnail of every capture and an hourly
+    contact sheet, and passes them to its own uploaders, which keep them apart from
+    the full captures with their own retention. Runs on an upload worker like any
+    uploader, so decoding never delays the captures.
+    """
+
+    def __init__(self, uploaders, size=DEFAULT_THUMBNAIL_SIZE, quality=DEFAULT_THUMBNAIL_QUALITY, sheet=None):
+        if uploaders is None or len(uploaders) == 0:
+            raise ValueError('Invalid uploaders')
+        if quality is None or not isinstance(quality, int) or quality < 1 or quality > 100:
+            raise ValueError('Invalid quality')
+
+        self.uploaders = uploaders
+        self.size = size
+        self.quality = quality
+        # Optional contact sheet of every hour.
+        self.sheet = sheet
+        self._sheet_lock = threading.Lock()
+        self.stats = {
+            'thumbnails': 0,
+            'sheets': 0,
+            'bytes': 0,
+        }
+
+        print('Thumbnail_Uploader initialized with uploaders:{0}, size:{1}, quality:{2}, sheet:{3}'.format(
+            [uploader.__class__.__name__ for uploader in self.uploaders],
+            self.size,
+            self.quality,
+            self.sheet is not None
+        ))
+
+    def purge_irrelevant(self):
+        for uploader in self.uploaders:
+            uploader.purge_irrelevant()
+
+    def purge_old(self):
+        """
+        Upload the contact sheet once its hour has passed and remove
+        the old thumbnails from every uploader.
+        """
+
+        self.flush_sheet()
+
+        for uploader in self.uploaders:
+            uploader.purge_old()
+
+        print('Thumbnail stats: {0}'.format(self.stats))
+
+    def close(self):
+        try:
+            self.flush_sheet(force=True)
+        except Exception as err:
+            print('Failed to upload the pending contact sheet: {0}'.format(err))
+
+        for uploader in self.uploaders:
+            if hasattr(uploader, 'close'):
+                uploader.close()
+
+    def flush_sheet(self, force=False):
+        if self.sheet is None:
+            return
+
+        with self._sheet_lock:
+            sheet = self.sheet.flush() if force or self.sheet.due() else None
+
+        if sheet is not None:
+            self._send(*sheet)
+            self.stats['sheets'] += 1
+
+    def upload(self, file_path, target_name):
+        with open(file_path, 'rb') as f:
+            self.upload_data(f.read(), target_name)
+
+    def upload_data(self, data, target_name):
+        dt = get_datetime_from_name(target_name)
+        if dt is None:
+            raise ValueError('Invalid capture name {0}'.format(target_name))
+
+        image, thumbnail = make_thumbnail(data, self.size, self.quality)
+        self._send('thumb-{0}{1}'.format(format_datetime(dt), CAPTURE_EXTENSION), thumbnail)
+        self.stats['thumbnails'] += 1
+
+        if self.sheet is not None:
+            with self._sheet_lock:
+                sheet = self.sheet.add(dt, image)
+            if sheet is not None:
+                self._send(*sheet)
+                self.stats['sheets'] += 1
+
+    def _send(self, name, data):
+        """
+        Pass the image to every uploader, raising the last error after trying all.
+        """
+
+        self.stats['bytes'] += len(data)
+
+        error = None
+        for uploader in self.uploaders:
+            try:
+                uploader.upload_data(data, name)
+            except Exception as err:
+                print('Exception in thumbnail uploader {0}: {1}'.format(uploader.__class__.__name__, err))
+                error = err
+
+        if error is not None:
+            raise error
@@ -0,0 +1,232 @@
+import json
+import os
+import queue
+import threading
+import time
+
+# Name of the manifest file kept in the target directory.
+MANIFEST_FILENAME = '.manifest.json'
+
+# Count of files removed at a time, and seconds to pause between the batches,
+# so that deleting a big directory never hogs the SD card.
+DELETE_BATCH_SIZE = 100
+DELETE_BATCH_PAUSE_SECONDS = 0.05
+
+
+class Day_Manifest:
+    """
+    Count of files and bytes in each day directory, persisted in a JSON file
+    so that retention is planned without listing the directories.
+    """
+
+    def __init__(self, target_directory, is_day_directory):
+        self.target_directory = target_directory
+        self.path = os.path.join(target_directory, MANIFEST_FILENAME)
+        # Function telling whether a directory name is a day directory.
+        self.is_day_directory = is_day_directory
+
+        # Dict of day directory name to [files, bytes].
+        self.days = dict()
+        self._lock = threading.Lock()
+        # Serializes writes of the manifest file.
+        self._save_lock = threading.Lock()
+
+        self.load()
+
+    def load(self):
+        """
+        Load the manifest, scanning the day directories it doesn't know and the latest one,
+        which may have got captures after the manifest was saved.
+        """
+
+        days = dict()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    days = dict((name, list(value)) for name, value in json.load(f).items())
+            except Exception as err:
+                print('Invalid manifest {0}, rebuilding it: {1}'.format(self.path, err))
+
+        with os.scandir(self.target_directory) as entries:
+            names = sorted(entry.name for entry in entries
+                           if entry.is_dir(follow_symlinks=False) and self.is_day_directory(entry.name))
+
+        latest = names[-1] if len(names) > 0 else None
+        for name in names:
+            if name not in days or name == latest:
+                days[name] = scan_directory(os.path.join(self.target_directory, name))
+
+        # Forget the directories which have been removed.
+        for name in list(days):
+            if name not in names:
+                del days[name]
+
+        with self._lock:
+            self.days = days
+
+        print('Loaded manifest of {0} days, {1} files, {2} bytes'.format(len(days), *self.totals()))
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self.days)
+
+        temp_path = self.path + '.tmp'
+        with self._save_lock:
+            with open(temp_path, 'w') as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+
+    def add(self, day, files, size):
+        with self._lock:
+            entry = self.days.setdefault(day, [0, 0])
+            entry[0] = max(entry[0] + files, 0)
+            entry[1] = max(entry[1] + size, 0)
+
+    def remove_day(self, day):
+        with self._lock:
+            self.days.pop(day, None)
+
+    def snapshot(self):
+        """
+        Get list of (day, files, bytes), oldest first.
+        """
+
+        with self._lock:
+            return [(day, files, size) for day, (files, size) in sorted(self.days.items())]
+
+    def totals(self):
+        with self._lock:
+            return sum(files for files, _ in self.days.values()), sum(size for _, size in self.days.values())
+
+
+class Retention_Worker:
+    """
+    Deletes captures on a background thread in small batches,
+    oldest first, keeping the manifest up to date.
+    """
+
+    def __init__(self, target_directory, manifest):
+        self.target_directory = target_directory
+        self.manifest = manifest
+
+        # Tasks of (day, files_to_free, bytes_to_free), None meaning the whole directory,
+        # and None to stop the worker.
+        self.tasks = queue.Queue()
+        self.busy = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='upload-retention', daemon=True)
+        self.thread.start()
+        self.stats = {
+            'files': 0,
+            'bytes': 0,
+            'directories': 0,
+        }
+
+    def delete(self, day, files_to_free=None, bytes_to_free=None):
+        """
+        Queue deletion of the whole day directory, or of its oldest captures
+        until enough files and bytes have been freed.
+        """
+
+        self.busy.set()
+        self.tasks.put((day, files_to_free, bytes_to_free))
+
+    def is_busy(self):
+        return self.busy.is_set()
+
+    def stop(self, timeout=None):
+        """
+        Stop after the queued deletions, waiting at most timeout seconds for them.
+        """
+
+        self.tasks.put(None)
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+
+            day, files_to_free, bytes_to_free = task
+
+            try:
+                self._delete(day, files_to_free, bytes_to_free)
+            except Exception as err:
+                print('Exception while deleting captures of {0}: {1}'.format(day, err))
+
+            if self.tasks.empty():
+                self.manifest.save()
+                self.busy.clear()
+
+    def _delete(self, day, files_to_free, bytes_to_free):
+        directory = os.path.join(self.target_directory, day)
+        whole = files_to_free is None and bytes_to_free is None
+
+        if not os.path.exists(directory):
+            self.manifest.remove_day(day)
+            return
+
+        # Hidden files are captures still being written, which the manifest doesn't count.
+        with os.scandir(directory) as entries:
+            files = sorted((entry.name, entry.stat(follow_symlinks=False).st_size)
+                           for entry in entries
+                           if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'))
+
+        print('Removing {0} from {1} files in directory {2}'.format(
+            'all' if whole else 'the oldest',
+            len(files),
+            directory
+        ))
+
+        freed_files = 0
+        freed_bytes = 0
+
+        for i, (name, size) in enumerate(files):
+            if not whole and freed_files >= (files_to_free or 0) and freed_bytes >= (bytes_to_free or 0):
+                break
+
+            if i > 0 and i % DELETE_BATCH_SIZE == 0:
+                time.sleep(DELETE_BATCH_PAUSE_SECONDS)
+
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+
+            freed_files += 1
+            freed_bytes += size
+
+        self.stats['files'] += freed_files
+        self.stats['bytes'] += freed_bytes
+
+        if whole:
+            try:
+                os.rmdir(directory)
+                self.manifest.remove_day(day)
+                self.stats['directories'] += 1
+            except OSError as err:
+                # Captures written meanwhile are left for the next run.
+                print('Could not remove directory {0}: {1}'.format(directory, err))
+                self.manifest.add(day, -freed_files, -freed_bytes)
+        else:
+            self.manifest.add(day, -freed_files, -freed_bytes)
+
+        print('Removed {0} files, {1} bytes from directory {2}'.format(freed_files, freed_bytes, directory))
+
+
+def scan_directory(directory):
+    """
+    Get [files, bytes] of the captures in the directory.
+    """
+
+    files = 0
+    size = 0
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                files += 1
+                size += entry.stat(follow_symlinks=False).st_size
+
+    return [files, size]
@@ -3,65 +3,106 @@ import os
 import shutil
 from datetime import datetime, timedelta
 
+from cloud_camera.uploaders.filesystem_retention import Day_Manifest, Retention_Worker
+
 DATE_FORMAT = '%Y-%m-%d'
 DIR_PREFIX = 'captures'
+# Seconds to wait for the running deletions on close.
+RETENTION_STOP_TIMEOUT_SECONDS = 10
 
 
 class Filesystem_Uploader:
-    def __init__(self, target_directory, date_limit):
+    def __init__(self, target_directory, date_limit, size_limit=None, count_limit=None):
         if target_directory is None or not os.path.exists(target_directory) or not os.path.isdir(target_directory):
             raise ValueError('Invalid target_directory')
         if date_limit is None or not isinstance(date_limit, int) or date_limit < 0:
             raise ValueError('Invalid date_limit')
+        if size_limit is not None and (not isinstance(size_limit, int) or size_limit <= 0):
+            raise ValueError('Invalid size_limit')
+        if count_limit is not None and (not isinstance(count_limit, int) or count_limit <= 0):
+            raise ValueError('Invalid count_limit')
 
         self.target_directory = target_directory
         self.date_limit = date_limit
+        # Max bytes and count of captures kept, None for no limit.
+        self.size_limit = size_limit
+        self.count_limit = count_limit
 
-        print('Filesystem_Uploader initialized with target_directory:{0}, date_limit:{1}'.format(
-            self.target_directory,
-            self.date_limit,
-        ))
+        self.manifest = Day_Manifest(
+            target_directory,
+            lambda name: self._get_date_from_directory_filename(name) is not None
+        )
+        self.retention = Retention_Worker(target_directory, self.manifest)
+
+        print('Filesystem_Uploader initialized with target_directory:{0}, date_limit:{1}, '
+              'size_limit:{2}, count_limit:{3}'.format(
+                  self.target_directory,
+                  self.date_limit,
+                  self.size_limit,
+                  self.count_limit,
+              ))
 
     def purge_irrelevant(self):
         # This is not needed with file system at the moment.
         pass
 
+    def close(self, timeout=RETENTION_STOP_TIMEOUT_SECONDS):
+        """
+        Stop the retention thread, waiting at most timeout seconds for the running deletions.
+        """
+
+        self.retention.stop(timeout)
+        self.manifest.save()
+
     def purge_old(self):
         """
         Remove directories of captures that exceed the max age passed in to
-        the constructor.
+        the constructor, then the oldest captures until the size and count
+        limits are met. Planned from the manifest and deleted in the background.
         """
-        files = os.listdir(self.target_directory)
 
-        if len(files) == 0:
+        if self.retention.is_busy():
+            print('Previous removal of old captures still running, skipping')
+            return
+
+        days = self.manifest.snapshot()
+        if len(days) == 0:
             return
 
         print('Removing old captures from file system')
 
         today = datetime.today().date()
         purge_older_than = today - timedelta(days=self.date_limit)
+        total_files, total_bytes = self.manifest.totals()
 
-        for filename in files:
-            full_filename = os.path.join(self.target_directory, filename)
-            if not os.path.isdir(full_filename):
-                continue
+        for day, files, size in days:
+            file_date = self._get_date_from_directory_filename(day)
+            over_date = file_date is not None and file_date < purge_older_than
 
-            file_date = self._get_date_from_directory_filename(filename)
-            if file_date is None:
-                continue
+            files_to_free = total_files - self.count_limit if self.count_limit is not None else 0
+            bytes_to_free = total_bytes - self.size_limit if self.size_limit is not None else 0
 
-            if file_date < purge_older_than:
-                dir_file_count = len(os.listdir(full_filename))
+            if not over_date and files_to_free <= 0 and bytes_to_free <= 0:
+                break
 
-                print('Removing {0} files from old directory {1}'.format(
-                    dir_file_count,
-                    full_filename
-                ))
-                shutil.rmtree(full_filename)
+            # Deleting oldest first, the whole day goes when either limit needs all of it.
+            if over_date or files_to_free >= files or bytes_to_free >= size:
+                # The whole day goes, except for today's directory still being written.
+                if day == self._get_current_directory_name():
+                    self.retention.delete(day, files, size)
+                else:
+                    self.retention.delete(day)
+                total_files -= files
+                total_bytes -= size
+            else:
+                self.retention.delete(day, max(files_to_free, 0), max(bytes_to_free, 0))
+                break
+
+        self.manifest.save()
 
     def upload(self, file_path, target_filename):
         """
-        Copy or 'upload' the temporary capture file into the target
+        Link or copy the capture file into the target
         directory with other captures from today.
         """
 
@@ -70,6 +111,51 @@ class Filesystem_Uploader:
                 file_path
             ))
 
+        full_target_filename = self._get_target_filename(target_filename)
+        temp_filename = self._get_temp_filename(full_target_filename)
+
+        # Hard link the capture when on the same file system, so the bytes are
+        # not written again. Otherwise copy, in both cases under a temporary name
+        # which is then renamed, so that a partial capture is never visible.
+        print('Linking capture {0} to {1}'.format(
+            file_path,
+            full_target_filename
+        ))
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        try:
+            os.link(file_path, temp_filename)
+        except OSError:
+            shutil.copyfile(file_path, temp_filename)
+        os.replace(temp_filename, full_target_filename)
+        self._add_to_manifest(full_target_filename, os.path.getsize(full_target_filename))
+
+    def upload_data(self, data, target_filename):
+        """
+        Write the in-memory capture into the target directory
+        with other captures from today.
+        """
+
+        full_target_filename = self._get_target_filename(target_filename)
+        temp_filename = self._get_temp_filename(full_target_filename)
+
+        # Write once under a temporary name and rename, so that a partial
+        # capture is never visible in the directory.
+        print('Writing capture of {0} bytes to {1}'.format(
+            len(data),
+            full_target_filename
+        ))
+        with open(temp_filename, 'wb') as f:
+            f.write(data)
+        os.replace(temp_filename, full_target_filename)
+        self._add_to_manifest(full_target_filename, len(data))
+
+    def _get_target_filename(self, target_filename):
+        """
+        Get full path for target file in the directory of today's files,
+        creating the directory if needed.
+        """
+
         # Get name and full path for directory of today's files.
         dirname = self._get_current_directory_name()
         full_target_directory = os.path.join(self.target_directory, dirname)
@@ -81,15 +167,23 @@ class Filesystem_Uploader:
             ))
             os.mkdir(full_target_directory)
 
-        # Get full path for target file.
-        full_target_filename = os.path.join(full_target_directory, target_filename)
+        return os.path.join(full_target_directory, target_filename)
 
-        # Copy temp capture into permanent storage.
-        print('Copying capture {0} to {1}'.format(
-            file_path,
-            full_target_filename
-        ))
-        shutil.copyfile(file_path, full_target_filename)
+    def _add_to_manifest(self, full_target_filename, size):
+        """
+        Count the capture in the manifest of its day directory.
+        """
+
+        day = os.path.basename(os.path.dirname(full_target_filename))
+        self.manifest.add(day, 1, size)
+
+    def _get_temp_filename(self, full_target_filename):
+        """
+        Get hidden temporary name next to the target file.
+        """
+
+        directory, filename = os.path.split(full_target_filename)
+        return os.path.join(directory, '.{0}.tmp'.format(filename))
 
     def _get_current_directory_name(self):
         """
@@ -0,0 +1,101 @@
+import sqlite3
+import threading
+
+
+class S3_Index:
+    """
+    Local index of the captures uploaded into S3 bucket, ordered by
+    capture timestamp. Persisted in SQLite so that the retention does not need
+    to list the whole bucket on every run.
+    """
+
+    def __init__(self, index_file):
+        if index_file is None or len(index_file) == 0:
+            raise ValueError('Invalid index_file')
+
+        self.index_file = index_file
+        self._lock = threading.Lock()
+
+        # The index is shared between the upload worker and the cleanup task.
+        self.connection = sqlite3.connect(index_file, check_same_thread=False)
+
+        with self._lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS objects ('
+                'key TEXT PRIMARY KEY, '
+                'timestamp REAL NOT NULL)'
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS objects_timestamp ON objects (timestamp)'
+            )
+
+        print('S3_Index initialized with index_file:{0}, count:{1}'.format(
+            self.index_file,
+            self.count()
+        ))
+
+    def add(self, key, dt):
+        """
+        Add or update a single key with its capture datetime.
+        """
+
+        with self._lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO objects (key, timestamp) VALUES (?, ?)',
+                (key, dt.timestamp())
+            )
+
+    def remove(self, keys):
+        """
+        Remove keys from the index.
+        """
+
+        with self._lock, self.connection:
+            self.connection.executemany(
+                'DELETE FROM objects WHERE key = ?',
+                [(key,) for key in keys]
+            )
+
+    def contains(self, key):
+        with self._lock:
+            return self.connection.execute('SELECT 1 FROM objects WHERE key = ?', (key,)).fetchone() is not None
+
+    def count(self):
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM objects').fetchone()[0]
+
+    def oldest(self, count):
+        """
+        Get keys of the oldest count captures, oldest first.
+        """
+
+        if count <= 0:
+            return []
+
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT key FROM objects ORDER BY timestamp LIMIT ?',
+                (count,)
+            ).fetchall()
+
+        return [row[0] for row in rows]
+
+    def reconcile(self, entries):
+        """
+        Replace the contents of the index with the given (key, datetime) pairs
+        listed from the bucket.
+        Returns tuple of counts of added and removed keys.
+        """
+
+        listed = dict((key, dt.timestamp()) for key, dt in entries)
+
+        with self._lock, self.connection:
+            indexed = set(row[0] for row in self.connection.execute('SELECT key FROM objects'))
+
+            removed = [key for key in indexed if key not in listed]
+            added = [(key, timestamp) for key, timestamp in listed.items() if key not in indexed]
+
+            self.connection.executemany('DELETE FROM objects WHERE key = ?', [(key,) for key in removed])
+            self.connection.executemany('INSERT INTO objects (key, timestamp) VALUES (?, ?)', added)
+
+        return len(added), len(removed)
@@ -0,0 +1,137 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Max count of keys S3 accepts in a single delete_objects call.
+MAX_DELETE_BATCH = 1000
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Seconds to wait before the first retry, doubled on every attempt.
+RETRY_BACKOFF_SECONDS = 1
+
+
+class S3_Retention:
+    """
+    Deletes keys from a bucket in batches of at most 1000 keys,
+    running batches concurrently and retrying the keys S3 reports as failed.
+    """
+
+    def __init__(self, client, bucket_name, max_workers=DEFAULT_MAX_WORKERS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, dry_run=False):
+        if max_workers is None or not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError('Invalid max_workers')
+        if max_attempts is None or not isinstance(max_attempts, int) or max_attempts < 1:
+            raise ValueError('Invalid max_attempts')
+
+        self.client = client
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.dry_run = dry_run
+
+        print('S3_Retention initialized with max_workers:{0}, max_attempts:{1}, dry_run:{2}'.format(
+            self.max_workers,
+            self.max_attempts,
+            self.dry_run
+        ))
+
+    def plan(self, keys):
+        """
+        Split the keys into batches that are each deleted with a single call.
+        """
+
+        return [keys[i:i + MAX_DELETE_BATCH] for i in range(0, len(keys), MAX_DELETE_BATCH)]
+
+    def delete(self, keys):
+        """
+        Delete keys from the bucket.
+        Returns the list of deleted keys, which is empty in dry-run mode.
+        """
+
+        keys = list(keys)
+        batches = self.plan(keys)
+
+        if len(batches) == 0:
+            return []
+
+        if self.dry_run:
+            print('Dry run, would delete {0} keys in {1} batches'.format(
+                len(keys),
+                len(batches)
+            ))
+            for batch in batches:
+                print('Would delete batch of {0} keys from {1} to {2}'.format(
+                    len(batch),
+                    batch[0],
+                    batch[-1]
+                ))
+            return []
+
+        print('Deleting {0} keys in {1} batches'.format(
+            len(keys),
+            len(batches)
+        ))
+
+        deleted = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches)),
+                                thread_name_prefix='upload-delete') as executor:
+            for batch_deleted, batch_failed in executor.map(self._delete_batch, batches):
+                deleted.extend(batch_deleted)
+                failed.extend(batch_failed)
+
+        if len(failed) > 0:
+            print('Failed to delete {0} keys, first {1}'.format(
+                len(failed),
+                failed[0]
+            ))
+
+        return deleted
+
+    def _delete_batch(self, batch):
+        """
+        Delete a single batch, retrying the failed keys.
+        Returns tuple of deleted and failed keys.
+        """
+
+        deleted = []
+        pending = batch
+
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+            try:
+                response = self.client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={
+                        'Objects': [{'Key': key} for key in pending],
+                        'Quiet': True,
+                    }
+                )
+            except Exception as err:
+                print('Exception while deleting batch of {0} keys, attempt {1}: {2}'.format(
+                    len(pending),
+                    attempt + 1,
+                    err
+                ))
+                continue
+
+            # In quiet mode only the failed keys are reported.
+            errors = response.get('Errors', [])
+            failed_keys = set(error['Key'] for error in errors)
+
+            deleted.extend(key for key in pending if key not in failed_keys)
+            pending = [key for key in pending if key in failed_keys]
+
+            if len(pending) == 0:
+                break
+
+            print('{0} keys failed to delete on attempt {1}, first error: {2}'.format(
+                len(pending),
+                attempt + 1,
+                errors[0].get('Message')
+            ))
+
+        return deleted, pending
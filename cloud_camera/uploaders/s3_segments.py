@@ -0,0 +1,354 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import tarfile
+
+from cloud_camera.cam_utils import *
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--s3_bucket', required=True, help='S3 bucket name')
+parser.add_argument('--credentials', required=True, help='Credentials file')
+parser.add_argument('--timestamp', required=True, help='Timestamp of the capture, e.g. 2020-01-31T12:00:00')
+parser.add_argument('--output', required=True, help='File into which to save the capture')
+
+# Name of the offset index, the first member of every segment.
+INDEX_NAME = 'index.json'
+
+# Size of tar headers and the unit to which member data is padded.
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+# Bytes fetched with the first ranged GET, enough for the index of a few hundred frames.
+INDEX_FETCH_BYTES = 64 * 1024
+
+# Days searched back for the latest segment before a datetime, as segments never span two days.
+SEARCH_DAYS = 7
+
+
+def pack_segment(frames):
+    """
+    Pack the (name, data) frames into an uncompressed tar, whose first member is
+    the offset index of the JPEGs, so that a single frame can be read with a ranged GET.
+    Returns the segment as bytes.
+    """
+
+    # Offsets of the frames depend on the size of the index before them,
+    # so grow the index a block at a time until it fits.
+    index_size = BLOCK_SIZE
+    while True:
+        entries = []
+        offset = BLOCK_SIZE + index_size
+        for name, data in frames:
+            entries.append([name, offset + BLOCK_SIZE, len(data)])
+            offset += BLOCK_SIZE + _padded(len(data))
+
+        index = json.dumps({'frames': entries}).encode()
+        if len(index) <= index_size:
+            break
+        index_size = _padded(len(index))
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w', format=tarfile.USTAR_FORMAT) as tar:
+        _add_member(tar, INDEX_NAME, index.ljust(index_size, b' '))
+        for (name, data), (_, data_offset, _) in zip(frames, entries):
+            # A single header block is written for short names, which the offsets rely on.
+            if tar.offset + BLOCK_SIZE != data_offset:
+                raise Exception('Offset of {0} is {1}, expected {2}'.format(name, tar.offset + BLOCK_SIZE, data_offset))
+            _add_member(tar, name, data)
+
+    return buffer.getvalue()
+
+
+def parse_index(head):
+    """
+    Parse the offset index from the head of a segment.
+    Returns dict of frame name to (offset, size), None if the head is too short.
+    """
+
+    info = tarfile.TarInfo.frombuf(head[:BLOCK_SIZE], tarfile.ENCODING, 'surrogateescape')
+    if info.name != INDEX_NAME:
+        raise ValueError('Segment does not start with the index')
+
+    if len(head) < BLOCK_SIZE + info.size:
+        return None
+
+    index = json.loads(head[BLOCK_SIZE:BLOCK_SIZE + info.size].decode())
+    return dict((name, (offset, size)) for name, offset, size in index['frames'])
+
+
+class Segment_Packer:
+    """
+    Groups frames into segments covering windows of segment_minutes,
+    aligned to midnight so that a segment never spans two days.
+
+    With a directory, every pending frame is also written there as it is added,
+    and the frames found there are picked up again on restart, so a crash
+    doesn't lose the pending window. The files are removed once the segment is packed.
+    """
+
+    def __init__(self, segment_minutes, directory=None):
+        if segment_minutes is None or not isinstance(segment_minutes, int) or segment_minutes < 1 \
+                or segment_minutes > 1440:
+            raise ValueError('Invalid segment_minutes')
+        if directory is not None and len(directory) == 0:
+            raise ValueError('Invalid directory')
+
+        self.segment_minutes = segment_minutes
+        self.directory = directory
+        self.frames = []
+        self.window = None
+
+        if self.directory is not None:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            self._load()
+
+        print('Segment_Packer initialized with segment_minutes:{0}, directory:{1}, pending:{2}'.format(
+            self.segment_minutes,
+            self.directory,
+            len(self.frames)
+        ))
+
+    def add(self, name, data):
+        """
+        Add the frame, returning list of (key, data) of the segments it completed.
+        """
+
+        dt = get_datetime_from_name(name)
+        if dt is None:
+            raise ValueError('Invalid frame name {0}'.format(name))
+
+        window = self._get_window(dt)
+        completed = []
+        if self.window is not None and window != self.window:
+            completed.append(self.flush())
+
+        self.window = window
+        self.frames.append((name, data))
+        self._write(name, data)
+
+        return completed
+
+    def due(self, now=None):
+        """
+        Tell whether the window of the pending frames has passed.
+        """
+
+        if self.window is None:
+            return False
+
+        now = now if now is not None else datetime.datetime.now()
+        return now >= self.window + datetime.timedelta(minutes=self.segment_minutes)
+
+    def flush(self):
+        """
+        Pack the pending frames, returning (key, data), None if there are no frames.
+        The segment is named by its first frame, so that a segment flushed on
+        restart never overwrites one of the same window.
+        """
+
+        if len(self.frames) == 0:
+            return None
+
+        frames = self.frames
+        self.frames = []
+        self.window = None
+
+        key = get_segment_filename(get_datetime_from_name(frames[0][0]))
+        data = pack_segment(frames)
+
+        if self.directory is not None:
+            for name, _ in frames:
+                self._remove_file(name)
+
+        print('Packed {0} frames into segment {1} of {2} bytes'.format(len(frames), key, len(data)))
+
+        return key, data
+
+    def _get_window(self, dt):
+        midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        minutes = (dt.hour * 60 + dt.minute) // self.segment_minutes * self.segment_minutes
+        return midnight + datetime.timedelta(minutes=minutes)
+
+    def _load(self):
+        """
+        Pick up the frames pending before a restart, in order of capture.
+        Hidden files are partial writes left by a crash.
+        """
+
+        with os.scandir(self.directory) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_file())
+
+        for name in names:
+            path = os.path.join(self.directory, name)
+            dt = get_datetime_from_name(name)
+            if name.startswith('.') or dt is None:
+                os.remove(path)
+                continue
+
+            with open(path, 'rb') as f:
+                self.frames.append((name, f.read()))
+            self.window = self._get_window(dt)
+
+        if len(self.frames) > 0:
+            print('Found {0} pending segment frames'.format(len(self.frames)))
+
+    def _write(self, name, data):
+        if self.directory is None:
+            return
+        if '/' in name or name.startswith('.'):
+            raise ValueError('Invalid frame name {0}'.format(name))
+
+        path = os.path.join(self.directory, name)
+        temp_path = os.path.join(self.directory, '.{0}.tmp'.format(name))
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+class Segment_Reader:
+    """
+    Extracts single frames from the segments in a bucket with ranged GETs,
+    without downloading the whole segments.
+    """
+
+    def __init__(self, client, bucket_name):
+        if bucket_name is None or len(bucket_name) == 0:
+            raise ValueError('Invalid bucket_name')
+
+        self.client = client
+        self.bucket_name = bucket_name
+        # Offset indexes of the segments read so far.
+        self.indexes = dict()
+
+    def find_segment(self, dt):
+        """
+        Get the key of the segment which holds the capture of the datetime, None if there is none.
+        Before the first segment of the day, the latest segment of an earlier day is taken,
+        searching back at most SEARCH_DAYS.
+        """
+
+        target = get_segment_filename(dt)
+
+        paginator = self.client.get_paginator('list_objects_v2')
+        for days in range(SEARCH_DAYS + 1):
+            day = dt - datetime.timedelta(days=days)
+            prefix = 'segment-{0}'.format(day.strftime('%Y-%m-%d'))
+
+            found = None
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+                for item in page.get('Contents', []):
+                    if item['Key'] <= target:
+                        found = item['Key']
+
+            if found is not None:
+                return found
+
+        return None
+
+    def read_index(self, key):
+        """
+        Get dict of frame name to (offset, size) in the segment.
+        """
+
+        if key not in self.indexes:
+            head = self._get_range(key, 0, INDEX_FETCH_BYTES)
+            index = parse_index(head)
+            if index is None:
+                # Index is larger than the first fetch, get all of it.
+                info = tarfile.TarInfo.frombuf(head[:BLOCK_SIZE], tarfile.ENCODING, 'surrogateescape')
+                index = parse_index(self._get_range(key, 0, BLOCK_SIZE + info.size))
+            self.indexes[key] = index
+
+        return self.indexes[key]
+
+    def read_frame(self, dt):
+        """
+        Get (name, data) of the latest capture taken at or before the datetime,
+        None if there is none.
+        """
+
+        key = self.find_segment(dt)
+        if key is None:
+            return None
+
+        index = self.read_index(key)
+        target = format_datetime(dt)
+
+        names = [name for name, frame_dt in zip(index, parse_many(index))
+                 if frame_dt is not None and format_datetime(frame_dt) <= target]
+        if len(names) == 0:
+            return None
+
+        name = max(names)
+        offset, size = index[name]
+
+        print('Reading frame {0} from segment {1}, {2} bytes at {3}'.format(name, key, size, offset))
+
+        return name, self._get_range(key, offset, size)
+
+    def _get_range(self, key, offset, size):
+        response = self.client.get_object(
+            Bucket=self.bucket_name,
+            Key=key,
+            Range='bytes={0}-{1}'.format(offset, offset + size - 1)
+        )
+        return response['Body'].read()
+
+
+def _padded(size):
+    return (size + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+
+def _add_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    dt = get_datetime_from_name(name)
+    if dt is not None:
+        info.mtime = dt.timestamp()
+    tar.addfile(info, io.BytesIO(data))
+
+
+def main(argv=None):
+    """
+    Save a single capture from the segments in the bucket.
+    """
+
+    parsed = parser.parse_args(argv)
+
+    # boto3 is only needed when reading from the bucket.
+    import boto3
+
+    with open(parsed.credentials) as f:
+        credentials = json.load(f)
+
+    session = boto3.Session(
+        aws_access_key_id=credentials['aws_key_id'],
+        aws_secret_access_key=credentials['aws_access_key'],
+    )
+    reader = Segment_Reader(session.client('s3'), parsed.s3_bucket)
+
+    result = reader.read_frame(datetime.datetime.fromisoformat(parsed.timestamp))
+    if result is None:
+        print('No capture at or before {0}'.format(parsed.timestamp))
+        return 1
+
+    name, data = result
+    with open(parsed.output, 'wb') as f:
+        f.write(data)
+
+    print('Saved capture {0} into {1}'.format(name, parsed.output))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
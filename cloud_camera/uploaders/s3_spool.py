@@ -0,0 +1,299 @@
+import collections
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cloud_camera.cam_utils import get_datetime_from_name
+
+DEFAULT_MAX_BYTES = 500 * 1000 * 1000
+DEFAULT_MAX_COUNT = 10000
+DEFAULT_CONCURRENCY = 4
+
+# Seconds to wait before the first retry, doubled on every failed replay up to the max.
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 300
+
+# Count of entries replayed per round for every replay thread.
+ENTRIES_PER_THREAD = 4
+
+
+class S3_Spool:
+    """
+    Durable on-disk spool of captures which could not be uploaded.
+    Every entry is a file named by its key, written once under a temporary name
+    and renamed, so a crash never leaves a partial entry. Entries are replayed
+    oldest first by the time in their names, e.g. captures and segments interleaved,
+    on a background thread, in parallel, with exponential backoff
+    while uploads keep failing, and removed once uploaded.
+    """
+
+    def __init__(self, directory, replay, prepare=None, max_bytes=DEFAULT_MAX_BYTES,
+                 max_count=DEFAULT_MAX_COUNT, concurrency=DEFAULT_CONCURRENCY):
+        if directory is None or len(directory) == 0:
+            raise ValueError('Invalid directory')
+        if max_bytes is None or not isinstance(max_bytes, int) or max_bytes <= 0:
+            raise ValueError('Invalid max_bytes')
+        if max_count is None or not isinstance(max_count, int) or max_count <= 0:
+            raise ValueError('Invalid max_count')
+        if concurrency is None or not isinstance(concurrency, int) or concurrency < 1:
+            raise ValueError('Invalid concurrency')
+
+        self.directory = directory
+        # Function of (file_path, key) which uploads a single entry, raising on failure.
+        self.replay = replay
+        # Optional function run before every round, such as connecting, raising on failure.
+        self.prepare = prepare
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.concurrency = concurrency
+
+        # Ordered dict of key to size in bytes, oldest first by get_order.
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.backoff = 0
+        self.retry_at = 0
+        self.stats = {
+            'spooled': 0,
+            'replayed': 0,
+            'failed': 0,
+            'dropped': 0,
+        }
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        self._load()
+
+        self.thread = threading.Thread(target=self._run, name='upload-spool', daemon=True)
+
+        print('S3_Spool initialized with directory:{0}, max_bytes:{1}, max_count:{2}, concurrency:{3}, '
+              'depth:{4}'.format(
+                  self.directory,
+                  self.max_bytes,
+                  self.max_count,
+                  self.concurrency,
+                  self.depth()
+              ))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop replaying after the running round, which takes at most timeout seconds.
+        The entries are left for the next start.
+        """
+
+        self.stopping.set()
+        self.wake.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def put(self, key, data):
+        """
+        Spool an in-memory capture under the key, replacing any entry of the same key.
+        """
+
+        self._write(key, lambda temp_path: self._write_data(temp_path, data))
+
+    def put_file(self, key, file_path):
+        """
+        Spool a capture file under the key, replacing any entry of the same key.
+        """
+
+        with open(file_path, 'rb') as f:
+            self.put(key, f.read())
+
+    def depth(self):
+        """
+        Count of entries waiting for upload.
+        """
+
+        with self._lock:
+            return len(self.entries)
+
+    def is_backing_off(self):
+        """
+        Tell whether the last replay failed and the backoff hasn't passed yet,
+        meaning S3 is most likely still unreachable.
+        """
+
+        return time.time() < self.retry_at
+
+    def log_stats(self):
+        with self._lock:
+            depth = len(self.entries)
+            size = self.bytes
+
+        print('S3 spool stats: depth:{0}, bytes:{1}, backoff:{2}s, {3}'.format(
+            depth,
+            size,
+            self.backoff,
+            self.stats
+        ))
+
+    def _load(self):
+        """
+        Pick up the entries spooled before a restart, oldest first.
+        Hidden files are partial writes left by a crash.
+        """
+
+        with os.scandir(self.directory) as entries:
+            files = sorted((get_order(entry.name, entry.stat().st_mtime), entry.name, entry.stat().st_size)
+                           for entry in entries if entry.is_file())
+
+        for _, name, size in files:
+            if name.startswith('.'):
+                os.remove(os.path.join(self.directory, name))
+                continue
+
+            self.entries[name] = size
+            self.bytes += size
+
+        if len(self.entries) > 0:
+            print('Found {0} spooled captures, {1} bytes'.format(len(self.entries), self.bytes))
+
+    def _write(self, key, write):
+        if '/' in key or key.startswith('.'):
+            raise ValueError('Invalid key {0}'.format(key))
+
+        path = os.path.join(self.directory, key)
+        temp_path = os.path.join(self.directory, '.{0}.tmp'.format(key))
+
+        write(temp_path)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self.bytes -= self.entries.pop(key, 0)
+            last = next(reversed(self.entries), None)
+            self.entries[key] = size
+            self.bytes += size
+            self.stats['spooled'] += 1
+
+            # Entries arrive mostly in order, but e.g. a segment is spooled only
+            # once its window has passed, after newer captures of another uploader.
+            now = time.time()
+            if last is not None and get_order(last, now) > get_order(key, now):
+                self.entries = collections.OrderedDict(
+                    sorted(self.entries.items(), key=lambda item: get_order(item[0], now)))
+
+        self._enforce_limits()
+        self.wake.set()
+
+        print('Spooled {0} bytes as {1}, depth {2}'.format(size, key, self.depth()))
+
+    @staticmethod
+    def _write_data(temp_path, data):
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            # Make sure the entry is on the card before it is renamed into the spool.
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _enforce_limits(self):
+        """
+        Drop the oldest entries while the spool is over its limits.
+        """
+
+        while True:
+            with self._lock:
+                if len(self.entries) <= 1 or (len(self.entries) <= self.max_count and self.bytes <= self.max_bytes):
+                    return
+
+                key, size = self.entries.popitem(last=False)
+                self.bytes -= size
+                self.stats['dropped'] += 1
+
+            print('Spool is full, dropping capture {0}'.format(key))
+            self._remove_file(key)
+
+    def _remove(self, key):
+        """
+        Remove the replayed entry.
+        """
+
+        with self._lock:
+            size = self.entries.pop(key, None)
+            if size is None:
+                return
+            self.bytes -= size
+
+        self._remove_file(key)
+
+    def _remove_file(self, key):
+        try:
+            os.remove(os.path.join(self.directory, key))
+        except FileNotFoundError:
+            pass
+
+    def _replay_entry(self, key):
+        """
+        Upload a single entry, returning boolean value indicating the success.
+        """
+
+        try:
+            self.replay(os.path.join(self.directory, key), key)
+            return True
+        except FileNotFoundError:
+            # Dropped while waiting for replay.
+            return True
+        except Exception as err:
+            print('Failed to replay spooled capture {0}: {1}'.format(key, err))
+            return False
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='upload-spool') as executor:
+            while not self.stopping.is_set():
+                # Cleared before looking at the entries, so that a put meanwhile is never missed.
+                self.wake.clear()
+                with self._lock:
+                    keys = list(self.entries)[:self.concurrency * ENTRIES_PER_THREAD]
+
+                wait = self.retry_at - time.time()
+                if len(keys) == 0 or wait > 0:
+                    self.wake.wait(wait if len(keys) > 0 else None)
+                    continue
+
+                try:
+                    if self.prepare is not None:
+                        self.prepare()
+                    results = list(executor.map(self._replay_entry, keys))
+                except Exception as err:
+                    print('Failed to prepare replay of spooled captures: {0}'.format(err))
+                    results = [False]
+
+                for key, ok in zip(keys, results):
+                    if ok:
+                        self._remove(key)
+                        self.stats['replayed'] += 1
+
+                if all(results):
+                    self.backoff = 0
+                    continue
+
+                self.stats['failed'] += results.count(False)
+                self.backoff = min(self.backoff * 2 if self.backoff > 0 else BACKOFF_BASE_SECONDS,
+                                   BACKOFF_MAX_SECONDS)
+                # Jitter so that several devices don't retry in step.
+                self.retry_at = time.time() + self.backoff * random.uniform(0.5, 1)
+
+                print('Replay of spooled captures failed, {0} left, retrying in {1}s'.format(
+                    self.depth(),
+                    self.backoff
+                ))
+
+
+def get_order(key, mtime):
+    """
+    Get the sort key of an entry, the time in its name, or the modification time
+    of a file without one, so that entries of any prefix are replayed oldest first.
+    """
+
+    dt = get_datetime_from_name(key)
+    return dt.timestamp() if dt is not None else mtime, key
@@ -0,0 +1,150 @@
+import collections
+import io
+import threading
+import time
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+# Defaults for the transfer settings, tuned for a small device on a slow uplink.
+DEFAULT_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+DEFAULT_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+DEFAULT_MAX_CONCURRENCY = 2
+DEFAULT_MAX_POOL_CONNECTIONS = 4
+
+# Seconds to wait for a connection and for a response. Short, so that an outage
+# is noticed and the captures spooled within a capture interval or two,
+# instead of after the 60 second defaults and their retries.
+CONNECT_TIMEOUT_SECONDS = 5
+READ_TIMEOUT_SECONDS = 15
+
+# Count of most recent uploads kept for the latency statistics.
+RECENT_UPLOAD_COUNT = 20
+
+
+def get_client_config(max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+    """
+    Get the client configuration which keeps a pool of kept-alive connections,
+    so that uploads don't pay for connection setup and TLS handshake every time.
+    """
+
+    return Config(
+        max_pool_connections=max_pool_connections,
+        tcp_keepalive=True,
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        read_timeout=READ_TIMEOUT_SECONDS,
+        retries={'max_attempts': 3, 'mode': 'standard'},
+    )
+
+
+class S3_Transfer:
+    """
+    Uploads files or in-memory buffers into a bucket through a shared client
+    and records latency and throughput of every upload.
+    """
+
+    def __init__(self, client, bucket_name,
+                 multipart_threshold=DEFAULT_MULTIPART_THRESHOLD,
+                 multipart_chunksize=DEFAULT_MULTIPART_CHUNKSIZE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        if multipart_threshold is None or not isinstance(multipart_threshold, int) or multipart_threshold <= 0:
+            raise ValueError('Invalid multipart_threshold')
+        if multipart_chunksize is None or not isinstance(multipart_chunksize, int) or multipart_chunksize <= 0:
+            raise ValueError('Invalid multipart_chunksize')
+        if max_concurrency is None or not isinstance(max_concurrency, int) or max_concurrency < 1:
+            raise ValueError('Invalid max_concurrency')
+
+        self.client = client
+        self.bucket_name = bucket_name
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+            use_threads=max_concurrency > 1,
+        )
+
+        self._lock = threading.Lock()
+        self.recent = collections.deque(maxlen=RECENT_UPLOAD_COUNT)
+        self.stats = {
+            'uploads': 0,
+            'bytes': 0,
+            'seconds': 0.0,
+        }
+
+        print('S3_Transfer initialized with multipart_threshold:{0}, multipart_chunksize:{1}, '
+              'max_concurrency:{2}'.format(
+                  multipart_threshold,
+                  multipart_chunksize,
+                  max_concurrency
+              ))
+
+    def upload_file(self, file_path, key):
+        """
+        Upload a file from disk.
+        """
+
+        with open(file_path, 'rb') as f:
+            size = self._size_of(f)
+            return self._upload(f, key, size)
+
+    def upload_buffer(self, buffer, key):
+        """
+        Upload bytes or memoryview directly, without going through the disk.
+        """
+
+        return self._upload(io.BytesIO(buffer), key, len(buffer))
+
+    def recent_latency(self):
+        """
+        Get the average latency in seconds of the most recent uploads,
+        None if nothing has been uploaded.
+        """
+
+        with self._lock:
+            if len(self.recent) == 0:
+                return None
+
+            return sum(self.recent) / len(self.recent)
+
+    def log_stats(self):
+        with self._lock:
+            uploads = self.stats['uploads']
+            total_bytes = self.stats['bytes']
+            seconds = self.stats['seconds']
+
+        if uploads == 0:
+            print('No uploads to S3 yet')
+            return
+
+        print('S3 upload stats: uploads:{0}, average latency:{1:.3f}s, throughput:{2:.0f} bytes/s'.format(
+            uploads,
+            seconds / uploads,
+            total_bytes / seconds if seconds > 0 else 0
+        ))
+
+    def _upload(self, fileobj, key, size):
+        start = time.perf_counter()
+        self.client.upload_fileobj(fileobj, self.bucket_name, key, Config=self.transfer_config)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.recent.append(elapsed)
+            self.stats['uploads'] += 1
+            self.stats['bytes'] += size
+            self.stats['seconds'] += elapsed
+
+        print('Uploaded {0} bytes as {1} in {2:.3f}s ({3:.0f} bytes/s)'.format(
+            size,
+            key,
+            elapsed,
+            size / elapsed if elapsed > 0 else 0
+        ))
+
+        return elapsed
+
+    @staticmethod
+    def _size_of(f):
+        f.seek(0, io.SEEK_END)
+        size = f.tell()
+        f.seek(0)
+        return size
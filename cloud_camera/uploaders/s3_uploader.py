@@ -1,12 +1,38 @@
 import os
+import threading
+import time
 
 import boto3
 
 from cloud_camera.cam_utils import *
+from cloud_camera.uploaders.s3_index import S3_Index
+from cloud_camera.uploaders.s3_retention import S3_Retention, DEFAULT_MAX_WORKERS
+from cloud_camera.uploaders import s3_spool
+from cloud_camera.uploaders.s3_segments import Segment_Packer
+from cloud_camera.uploaders.s3_transfer import *
+
+# Max count of keys returned by a single bucket listing request.
+LIST_PAGE_SIZE = 1000
+
+# Subdirectory of the spool in which the frames of the pending segment are kept, the spool ignores it.
+SEGMENT_PENDING_DIRECTORY = 'segment-pending'
 
 
 class S3_Uploader:
-    def __init__(self, key_id, key, bucket_name, file_count_limit, take_nth=1):
+    def __init__(self, key_id, key, bucket_name, file_count_limit, take_nth=1,
+                 index_file=':memory:', reconcile_interval=86400,
+                 multipart_threshold=DEFAULT_MULTIPART_THRESHOLD,
+                 multipart_chunksize=DEFAULT_MULTIPART_CHUNKSIZE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+                 delete_concurrency=DEFAULT_MAX_WORKERS,
+                 dry_run=False,
+                 spool_directory=None,
+                 spool_max_bytes=s3_spool.DEFAULT_MAX_BYTES,
+                 spool_max_count=s3_spool.DEFAULT_MAX_COUNT,
+                 replay_concurrency=s3_spool.DEFAULT_CONCURRENCY,
+                 segment_minutes=None,
+                 key_prefix=''):
         if key_id is None or len(key_id) == 0:
             raise ValueError('Invalid key_id')
         if key is None or len(key) == 0:
@@ -17,26 +43,123 @@ class S3_Uploader:
             raise ValueError('Invalid file_count_limit')
         if take_nth is None or not isinstance(take_nth, int):
             raise ValueError('Invalid take_nth')
+        if reconcile_interval is None or not isinstance(reconcile_interval, int) or reconcile_interval <= 0:
+            raise ValueError('Invalid reconcile_interval')
+        if max_pool_connections is None or not isinstance(max_pool_connections, int) or max_pool_connections < 1:
+            raise ValueError('Invalid max_pool_connections')
+        if key_prefix is None or key_prefix.startswith('/') or (len(key_prefix) > 0 and not key_prefix.endswith('/')):
+            raise ValueError('Invalid key_prefix')
 
         self.bucket_name = bucket_name
+        # Folder of the keys, e.g. thumbnails/, the default being the top level of the bucket.
+        self.key_prefix = key_prefix
         self.key_id = key_id
         self.key = key
         self.file_count_limit = file_count_limit
         self.take_nth = take_nth
         self.connected = False
         self.count_since_sending = 0
-
-        print('S3 uploader initialized with bucket_name:{0}, file_count_limit:{1}, take_nth:{2}'.format(
-            self.bucket_name,
-            self.file_count_limit,
-            self.take_nth
-        ))
+        self.index = S3_Index(index_file)
+        self.reconcile_interval = reconcile_interval
+        self.last_reconciled = None
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self.max_concurrency = max_concurrency
+        self.max_pool_connections = max_pool_connections
+        self.transfer = None
+        self.delete_concurrency = delete_concurrency
+        self.dry_run = dry_run
+        self.retention = None
+        self._connect_lock = threading.Lock()
+        # Set when the irrelevant files could not be purged at startup for lack of connection.
+        self.purge_irrelevant_pending = False
+
+        # Captures which failed to upload are spooled on disk and replayed once S3 is reachable.
+        self.spool = None
+        if spool_directory is not None:
+            self.spool = s3_spool.S3_Spool(spool_directory,
+                                           replay=self._replay,
+                                           prepare=self._ensure_connected,
+                                           max_bytes=spool_max_bytes,
+                                           max_count=spool_max_count,
+                                           concurrency=replay_concurrency)
+
+        # When set, captures are packed into segments of segment_minutes uploaded as single objects.
+        # The pending frames are kept in the spool directory, so a crash doesn't lose them.
+        self.packer = None
+        if segment_minutes is not None:
+            self.packer = Segment_Packer(segment_minutes,
+                                         directory=os.path.join(spool_directory, SEGMENT_PENDING_DIRECTORY)
+                                         if spool_directory is not None else None)
+        self._packer_lock = threading.Lock()
+
+        print('S3 uploader initialized with bucket_name:{0}, file_count_limit:{1}, take_nth:{2}, '
+              'reconcile_interval:{3}, spool_directory:{4}, segment_minutes:{5}, key_prefix:{6}'.format(
+                  self.bucket_name,
+                  self.file_count_limit,
+                  self.take_nth,
+                  self.reconcile_interval,
+                  spool_directory,
+                  segment_minutes,
+                  self.key_prefix
+              ))
 
     def connect(self):
         """
-        Connect to AWS.
+        Connect to AWS, and start replaying the spooled captures.
+        If connecting fails, the spool keeps retrying it with backoff.
+        """
+
+        try:
+            with self._connect_lock:
+                self._connect()
+        finally:
+            if self.spool is not None and not self.spool.thread.is_alive():
+                self.spool.start()
+
+    def close(self):
+        """
+        Upload the pending segment and stop replaying the spooled captures,
+        they are left for the next start.
+        """
+
+        try:
+            self.flush_segments(force=True)
+        except Exception as err:
+            print('Failed to upload the pending segment: {0}'.format(err))
+
+        if self.spool is not None:
+            self.spool.stop(timeout=s3_spool.BACKOFF_BASE_SECONDS)
+
+    def flush_segments(self, force=False):
+        """
+        Upload the pending segment once its window has passed, or right away if forced.
+        """
+
+        if self.packer is None:
+            return
+
+        with self._packer_lock:
+            segment = self.packer.flush() if force or self.packer.due() else None
+
+        if segment is not None:
+            key, data = segment
+            self._upload_buffer(data, key)
+
+    def recent_latency(self):
+        """
+        Get the average latency in seconds of the most recent uploads,
+        None if nothing has been uploaded.
         """
 
+        return self.transfer.recent_latency() if self.transfer is not None else None
+
+    def _ensure_connected(self):
+        with self._connect_lock:
+            if not self.connected:
+                self._connect()
+
+    def _connect(self):
         print('Connecting to S3 bucket {0}'.format(self.bucket_name))
         self.session = boto3.Session(
             aws_access_key_id=self.key_id,
@@ -45,7 +168,8 @@ class S3_Uploader:
 
         print('Fetching bucket {0}'.format(self.bucket_name))
 
-        s3 = self.session.resource('s3')
+        # All requests share the connection pool of the resource's client.
+        s3 = self.session.resource('s3', config=get_client_config(self.max_pool_connections))
         self.s3_bucket = s3.Bucket(self.bucket_name)
         self.s3_bucket.load()
 
@@ -55,52 +179,100 @@ class S3_Uploader:
 
         print('Got bucket')
 
+        self.transfer = S3_Transfer(s3.meta.client,
+                                    self.bucket_name,
+                                    multipart_threshold=self.multipart_threshold,
+                                    multipart_chunksize=self.multipart_chunksize,
+                                    max_concurrency=self.max_concurrency)
+        self.retention = S3_Retention(s3.meta.client,
+                                      self.bucket_name,
+                                      max_workers=self.delete_concurrency,
+                                      dry_run=self.dry_run)
+
         self.connected = True
 
+    def reconcile(self):
+        """
+            List the bucket page by page and replace the index contents with
+            the listed captures.
+            Returns the keys which are not captures.
+        """
+
+        if not self.connected: raise Exception('Not connected')
+
+        print('Reconciling index with bucket {0}'.format(self.bucket_name))
+
+        files = list(self._get_all_files_in_bucket(self.s3_bucket))
+
+        entries = []
+        irrelevant = []
+        for file, dt in zip(files, parse_many(files)):
+            if dt is None:
+                irrelevant.append(file)
+            else:
+                entries.append((file, dt))
+
+        added, removed = self.index.reconcile(entries)
+        self.last_reconciled = time.time()
+
+        print('Index reconciled, {0} captures in bucket, {1} added, {2} removed'.format(
+            len(entries),
+            added,
+            removed
+        ))
+
+        return irrelevant
+
     def purge_irrelevant(self):
         """
             Delete all irrelevant files from the bucket.
             Irrelevant file is any that cannot be parsed.
+            Also reconciles the index, as the bucket is listed anyway.
         """
 
+        if not self.connected and self.spool is not None:
+            print('Not connected to S3, purging irrelevant files once connected')
+            self.purge_irrelevant_pending = True
+            return
+
         if not self.connected: raise Exception('Not connected')
 
-        files = self._get_all_files_in_bucket(self.s3_bucket)
+        self.purge_irrelevant_pending = False
 
-        files_to_delete = []
-        for file in files:
-            if get_datetime_from_name(file) is None:
-                files_to_delete.append({
-                    'Key': file
-                })
-                print('Found irrelevant file {0}'.format(file))
+        files_to_delete = self.reconcile()
+        for file in files_to_delete:
+            print('Found irrelevant file {0}'.format(file))
 
         if len(files_to_delete) == 0:
             return
 
         print('Deleting {0} irrelevant files from bucket'.format(len(files_to_delete)))
 
-        self.s3_bucket.delete_objects(Delete={
-            'Objects': files_to_delete
-        })
+        self.retention.delete(files_to_delete)
 
     def purge_old(self):
         """
             Maintain the max count of files in bucket.
-            Sort the file names and delete old entries so that the
-            max list size is maintained.
+            Take the oldest entries from the index and delete them so that
+            the max list size is maintained. With segments, each segment counts as one file.
         """
+        self.flush_segments()
+
+        if not self.connected and self.spool is not None:
+            print('Not connected to S3, skipping removal of old files')
+            return
+
         if not self.connected: raise Exception('Not connected')
 
-        print('Checking for old files..')
+        if self.purge_irrelevant_pending:
+            self.purge_irrelevant()
 
-        files = self._get_all_files_in_bucket(self.s3_bucket)
+        if self.last_reconciled is None or time.time() - self.last_reconciled >= self.reconcile_interval:
+            self.reconcile()
 
-        file_dict = dict()
-        dt_list = []
+        print('Checking for old files..')
 
-        # Get the count of files to delete.
-        file_count = len(list(files))
+        file_count = self.index.count()
 
         print('Total files in bucket: {0}'.format(file_count))
 
@@ -111,74 +283,151 @@ class S3_Uploader:
             ))
             return
 
-        for file in files:
-            dt = get_datetime_from_name(file)
-            if dt is None:
-                continue
+        filenames_to_delete = self.index.oldest(delete_count)
 
-            file_dict[str(dt)] = file
-            dt_list.append(dt)
+        if len(filenames_to_delete) == 0:
+            return
 
-        # Sort the datetimes and delete oldest entries.
-        dt_list.sort()
-        files_deleted = 0
-        filenames_to_delete = []
+        print('Deleting {0} old files, oldest {1}'.format(
+            len(filenames_to_delete),
+            filenames_to_delete[0]
+        ))
 
-        for dt_to_delete in dt_list:
-            filename_to_delete = file_dict[str(dt_to_delete)]
-            filenames_to_delete.append({
-                'Key': filename_to_delete
-            })
+        deleted = self.retention.delete(filenames_to_delete)
+        self.index.remove(deleted)
 
-            print('Marking file {0} to be deleted from bucket'
-                  .format(filename_to_delete))
+    def upload(self, file_path, target_name):
+        """
+        Upload a file into S3 bucket, spooling it if the upload fails.
+        """
+        if not self.connected and self.spool is None: raise Exception('Not connected')
 
-            files_deleted = files_deleted + 1
-            if files_deleted >= delete_count:
-                break
+        if not os.path.exists(file_path):
+            print('Cannot upload file {0}, it doesn\'t exist!'.format(file_path))
+            return
 
-        if len(filenames_to_delete) == 0:
+        if not self._should_send():
             return
 
-        print('Deleting {0} old files'.format(len(filenames_to_delete)))
+        if self.packer is not None:
+            with open(file_path, 'rb') as f:
+                self._pack(f.read(), target_name)
+            return
 
-        self.s3_bucket.delete_objects(Delete={
-            'Objects': filenames_to_delete
-        })
+        if self._is_unreachable():
+            print('S3 is unreachable, spooling {0}'.format(target_name))
+            self.spool.put_file(target_name, file_path)
+            return
 
-    def upload(self, file_path, target_name):
+        print('Uploading file {0} as {1}'.format(file_path, target_name))
+        try:
+            if not self.connected: raise Exception('Not connected')
+            self.transfer.upload_file(file_path, self._get_key(target_name))
+        except Exception as err:
+            if self.spool is None: raise
+            print('Failed to upload {0}, spooling it: {1}'.format(target_name, err))
+            self.spool.put_file(target_name, file_path)
+            return
+
+        self._add_to_index(target_name)
+
+    def upload_data(self, data, target_name):
         """
-        Upload a file into S3 bucket.
+        Upload an in-memory capture into S3 bucket, spooling it if the upload fails.
         """
-        if not self.connected: raise Exception('Not connected')
+        if not self.connected and self.spool is None: raise Exception('Not connected')
 
-        if not os.path.exists(file_path):
-            print('Cannot upload file {0}, it doesn\'t exist!'.format(file_path))
+        if not self._should_send():
+            return
+
+        if self.packer is not None:
+            self._pack(data, target_name)
             return
 
+        self._upload_buffer(data, target_name)
+
+    def _pack(self, data, target_name):
+        """
+        Add the capture to the pending segment, uploading the segments it completed.
+        """
+
+        with self._packer_lock:
+            segments = self.packer.add(target_name, data)
+
+        for key, segment in segments:
+            self._upload_buffer(segment, key)
+
+    def _upload_buffer(self, data, target_name):
+        if self._is_unreachable():
+            print('S3 is unreachable, spooling {0}'.format(target_name))
+            self.spool.put(target_name, data)
+            return
+
+        print('Uploading {0} bytes as {1}'.format(len(data), target_name))
+        try:
+            if not self.connected: raise Exception('Not connected')
+            self.transfer.upload_buffer(data, self._get_key(target_name))
+        except Exception as err:
+            if self.spool is None: raise
+            print('Failed to upload {0}, spooling it: {1}'.format(target_name, err))
+            self.spool.put(target_name, data)
+            return
+
+        self._add_to_index(target_name)
+
+    def _is_unreachable(self):
+        """
+        Tell whether S3 is known to be unreachable, so that captures go straight
+        into the spool instead of each waiting for the upload to time out.
+        """
+
+        return self.spool is not None and (not self.connected or self.spool.is_backing_off())
+
+    def _replay(self, file_path, target_name):
+        """
+        Upload a spooled capture. Uploads are idempotent by key, a capture
+        already in the index was uploaded before a crash and is skipped.
+        """
+
+        if self.index.contains(self._get_key(target_name)):
+            print('Spooled capture {0} already uploaded, skipping'.format(target_name))
+            return
+
+        print('Replaying spooled capture {0}'.format(target_name))
+        self.transfer.upload_file(file_path, self._get_key(target_name))
+        self._add_to_index(target_name)
+
+    def _should_send(self):
+        """
+        Count the capture and tell whether it is the n-th one which is sent.
+        """
+
         # Send only the take_nth of captures, so that one can for example
         # save every capture to file system and only send some to S3 to reduce
         # costs.
         self.count_since_sending = self.count_since_sending + 1
         if self.count_since_sending < self.take_nth:
-            return
+            return False
 
         # Reset counter.
         self.count_since_sending = 0
+        return True
 
-        print('Uploading file {0} as {1}'.format(file_path, target_name))
-        self.s3_bucket.upload_file(file_path, target_name)
+    def _get_key(self, target_name):
+        return self.key_prefix + target_name
+
+    def _add_to_index(self, target_name):
+        dt = get_datetime_from_name(target_name)
+        if dt is not None:
+            self.index.add(self._get_key(target_name), dt)
 
     def _get_all_files_in_bucket(self, bucket):
         """
-        Get file names for all objects in the bucket as list.
+        Iterate file names for all objects in the bucket, fetching a page at a time.
         """
         if not self.connected: raise Exception('Not connected')
 
-        all_objects = list(bucket.objects.all())
-
-        return list(
-            map(
-                lambda x: x.key, all_objects
-            )
-        )
+        # Only the keys directly under the prefix, the deeper ones belong to other uploaders.
+        for page in bucket.objects.filter(Prefix=self.key_prefix, Delimiter='/').page_size(LIST_PAGE_SIZE).pages():
+            for obj in page:
+                yield obj.key
@@ -0,0 +1,244 @@
+import heapq
+import math
+import threading
+import time
+
+# Overlap policies which decide what happens when a run of a job is due
+# while the previous run is still going.
+# Skip the run.
+OVERLAP_SKIP = 'skip'
+# Run it right after the previous run finishes.
+OVERLAP_QUEUE = 'queue'
+# Run it on another thread at the same time.
+OVERLAP_CONCURRENT = 'concurrent'
+OVERLAP_POLICIES = (OVERLAP_SKIP, OVERLAP_QUEUE, OVERLAP_CONCURRENT)
+
+# Max count of runs waiting with the queue policy, further runs are skipped.
+MAX_QUEUED_RUNS = 10
+
+
+class Periodic_Job:
+    """
+    Function run periodically against absolute deadlines, so that
+    the time the function takes doesn't add to the period.
+    """
+
+    def __init__(self, name, function, interval, overlap=OVERLAP_SKIP, args=(), thread_name=None):
+        if name is None or len(name) == 0:
+            raise ValueError('Invalid name')
+        if function is None:
+            raise ValueError('Invalid function')
+        if interval is None or interval <= 0:
+            raise ValueError('Invalid interval')
+        if overlap not in OVERLAP_POLICIES:
+            raise ValueError('Invalid overlap {0}'.format(overlap))
+
+        self.name = name
+        self.function = function
+        # Can be changed while running, applies from the next deadline on.
+        self.interval = interval
+        self.overlap = overlap
+        self.args = args
+        self.thread_name = thread_name if thread_name is not None else 'job-{0}'.format(name)
+
+        self.running = 0
+        self.queued = []
+        self._lock = threading.Lock()
+        self._threads = set()
+
+        # Running mean and sum of squared differences of lateness.
+        self._lateness_mean = 0.0
+        self._lateness_m2 = 0.0
+        self.stats = {
+            'runs': 0,
+            'failed': 0,
+            'skipped': 0,
+            'missed': 0,
+            'lateness_max': 0.0,
+            'duration_max': 0.0,
+            'duration_total': 0.0,
+        }
+
+    def dispatch(self, deadline):
+        """
+        Start a run due at the deadline according to the overlap policy.
+        """
+
+        with self._lock:
+            if self.running > 0 and self.overlap != OVERLAP_CONCURRENT:
+                if self.overlap == OVERLAP_SKIP or len(self.queued) >= MAX_QUEUED_RUNS:
+                    print('Skipping run of {0}, previous run is still going'.format(self.name))
+                    self.stats['skipped'] += 1
+                    return
+
+                self.queued.append(deadline)
+                return
+
+            self.running += 1
+
+        self._start(deadline)
+
+    def jitter(self):
+        """
+        Standard deviation of the lateness of the runs in seconds.
+        """
+
+        if self.stats['runs'] < 2:
+            return 0.0
+
+        return math.sqrt(self._lateness_m2 / (self.stats['runs'] - 1))
+
+    def join(self, timeout=None):
+        """
+        Wait for the running runs to finish.
+        """
+
+        for thread in list(self._threads):
+            thread.join(timeout)
+
+    def log_stats(self):
+        runs = self.stats['runs']
+
+        print('Job {0} stats: runs:{1}, failed:{2}, skipped:{3}, missed:{4}, lateness mean:{5:.3f}s '
+              'max:{6:.3f}s jitter:{7:.3f}s, duration mean:{8:.3f}s max:{9:.3f}s'.format(
+                  self.name,
+                  runs,
+                  self.stats['failed'],
+                  self.stats['skipped'],
+                  self.stats['missed'],
+                  self._lateness_mean,
+                  self.stats['lateness_max'],
+                  self.jitter(),
+                  self.stats['duration_total'] / runs if runs > 0 else 0,
+                  self.stats['duration_max']
+              ))
+
+    def _start(self, deadline):
+        thread = threading.Thread(target=self._run, args=(deadline,), name=self.thread_name, daemon=True)
+        with self._lock:
+            self._threads.add(thread)
+        thread.start()
+
+    def _run(self, deadline):
+        while True:
+            start = time.monotonic()
+            self._record_lateness(start - deadline)
+
+            try:
+                self.function(*self.args)
+            except Exception as err:
+                print('Exception while running {0}: {1}'.format(self.name, err))
+                self.stats['failed'] += 1
+
+            duration = time.monotonic() - start
+            self.stats['duration_total'] += duration
+            self.stats['duration_max'] = max(self.stats['duration_max'], duration)
+
+            with self._lock:
+                if len(self.queued) == 0 or self.overlap == OVERLAP_CONCURRENT:
+                    self.running -= 1
+                    self._threads.discard(threading.current_thread())
+                    return
+
+                deadline = self.queued.pop(0)
+
+    def _record_lateness(self, lateness):
+        with self._lock:
+            self.stats['runs'] += 1
+            delta = lateness - self._lateness_mean
+            self._lateness_mean += delta / self.stats['runs']
+            self._lateness_m2 += delta * (lateness - self._lateness_mean)
+            self.stats['lateness_max'] = max(self.stats['lateness_max'], lateness)
+
+
+class Periodic_Scheduler:
+    """
+    Runs periodic jobs on their own threads against absolute deadlines
+    kept in a heap. Uses the monotonic clock, so that the wall clock
+    being set, e.g. by NTP after boot, doesn't disturb the schedule.
+    """
+
+    def __init__(self, name='job'):
+        # Prefix of the job thread names, tells apart the threads of several schedulers.
+        self.name = name
+        self.jobs = []
+        self._heap = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def add(self, name, function, interval, first_run=None, overlap=OVERLAP_SKIP, args=()):
+        """
+        Add a job which runs every interval seconds, first after first_run
+        seconds, by default after one interval.
+        """
+
+        job = Periodic_Job(name, function, interval, overlap=overlap, args=args,
+                           thread_name='{0}-{1}'.format(self.name, name))
+        first_deadline = time.monotonic() + (first_run if first_run is not None else interval)
+
+        with self._condition:
+            self.jobs.append(job)
+            self._push(first_deadline, job)
+            self._condition.notify()
+
+        print('Scheduled job {0} with interval:{1}, overlap:{2}'.format(name, interval, overlap))
+
+        return job
+
+    def run(self):
+        """
+        Run the jobs until stop is called.
+        """
+
+        with self._condition:
+            while not self._stopped:
+                if len(self._heap) == 0:
+                    self._condition.wait()
+                    continue
+
+                deadline, _, job = self._heap[0]
+                now = time.monotonic()
+
+                if deadline > now:
+                    self._condition.wait(deadline - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                job.dispatch(deadline)
+
+                # Skip the deadlines which have already passed.
+                next_deadline = deadline + job.interval
+                now = time.monotonic()
+                if next_deadline <= now:
+                    missed = int((now - next_deadline) // job.interval) + 1
+                    print('Job {0} missed {1} runs'.format(job.name, missed))
+                    job.stats['missed'] += missed
+                    next_deadline = next_deadline + missed * job.interval
+
+                self._push(next_deadline, job)
+
+    def stop(self, timeout=None):
+        """
+        Stop running jobs and wait at most timeout seconds for the running ones to finish.
+        """
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        for job in self.jobs:
+            with job._lock:
+                job.queued.clear()
+
+        for job in self.jobs:
+            job.join(timeout)
+
+    def log_stats(self):
+        for job in self.jobs:
+            job.log_stats()
+
+    def _push(self, deadline, job):
+        # Sequence keeps jobs with the same deadline in insertion order.
+        heapq.heappush(self._heap, (deadline, self._sequence, job))
+        self._sequence += 1
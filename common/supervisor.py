@@ -0,0 +1,271 @@
+import argparse
+import importlib
+import os
+import shlex
+import signal
+import sys
+import threading
+import time
+
+from common.scheduler import Periodic_Scheduler
+
+# Components which can be hosted, by name: module with the main(argv, scheduler) function
+# and the prefixes of the names of the threads the component runs on.
+COMPONENTS = {
+    'camera': ('cloud_camera.camera_app', ('camera', 'upload-')),
+    'sensor': ('temp_hum_sensor.temperature_dd', ('sensor',)),
+    'sockets': ('nexa_sockets.socket_daemon', ('sockets',)),
+}
+
+# Seconds to wait before restarting a failed component, doubled on every failure in a row.
+BACKOFF_INITIAL_SECONDS = 1
+BACKOFF_MAX_SECONDS = 300
+# Seconds a component has to run for the backoff to be reset.
+HEALTHY_SECONDS = 60
+# Seconds to wait for the components to stop.
+STOP_TIMEOUT_SECONDS = 30
+DEFAULT_STATS_INTERVAL_SECONDS = 300
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+# Threads have native ids from Python 3.8 on. Without them the CPU time
+# can't be attributed to the components and is all counted as other.
+NATIVE_THREAD_IDS = hasattr(threading, 'get_native_id')
+
+
+class Component:
+    """
+    Runs the main function of a monitor on its own thread, restarting it
+    with a growing backoff when it fails or returns.
+    """
+
+    def __init__(self, name, module, argv, thread_prefixes):
+        if name is None or len(name) == 0:
+            raise ValueError('Invalid name')
+        if module is None or len(module) == 0:
+            raise ValueError('Invalid module')
+
+        self.name = name
+        self.module = module
+        self.argv = argv
+        self.thread_prefixes = thread_prefixes
+
+        # Scheduler of the running instance, stopping it makes the main function return.
+        self.scheduler = None
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.stats = {
+            'starts': 0,
+            'failures': 0,
+        }
+
+        print('Component initialized with name:{0}, module:{1}, argv:{2}'.format(
+            self.name,
+            self.module,
+            self.argv
+        ))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+
+        scheduler = self.scheduler
+        if scheduler is not None:
+            scheduler.stop(timeout)
+
+        self.thread.join(timeout)
+
+    def owns_thread(self, thread_name):
+        return thread_name.startswith(self.thread_prefixes)
+
+    def _run(self):
+        backoff = BACKOFF_INITIAL_SECONDS
+
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            self.stats['starts'] += 1
+            print('Starting component {0}'.format(self.name))
+
+            try:
+                # Imported on first start, so that a component with missing
+                # dependencies doesn't prevent the others from running.
+                main = importlib.import_module(self.module).main
+
+                self.scheduler = Periodic_Scheduler(name=self.name)
+                if self.stopping.is_set():
+                    return
+
+                main(self.argv, self.scheduler)
+                print('Component {0} returned'.format(self.name))
+            except BaseException as err:
+                # Monitors exit on invalid configuration, which must not end the supervisor.
+                print('Component {0} failed: {1!r}'.format(self.name, err))
+                self.stats['failures'] += 1
+
+            if self.stopping.is_set():
+                return
+
+            if time.monotonic() - started >= HEALTHY_SECONDS:
+                backoff = BACKOFF_INITIAL_SECONDS
+
+            print('Restarting component {0} in {1} seconds'.format(self.name, backoff))
+            self.stopping.wait(backoff)
+            backoff = min(backoff * 2, BACKOFF_MAX_SECONDS)
+
+
+class Supervisor:
+    """
+    Hosts the monitors in a single interpreter and logs the CPU time
+    of each and the memory use of the process.
+    """
+
+    def __init__(self, components, stats_interval=DEFAULT_STATS_INTERVAL_SECONDS):
+        if components is None or len(components) == 0:
+            raise ValueError('Invalid components')
+        if stats_interval is None or stats_interval <= 0:
+            raise ValueError('Invalid stats_interval')
+
+        self.components = components
+        self.stats_interval = stats_interval
+        self.scheduler = Periodic_Scheduler(name='supervisor')
+        # CPU seconds of each thread at the previous stats run, by thread id.
+        self.thread_cpu = dict()
+
+        print('Supervisor initialized with components:{0}, stats_interval:{1}'.format(
+            [component.name for component in self.components],
+            self.stats_interval
+        ))
+
+        if not NATIVE_THREAD_IDS:
+            print('Python {0}.{1} has no native thread ids, CPU time is not attributed to the components'.format(
+                *sys.version_info[:2]
+            ))
+
+    def run(self):
+        """
+        Run the components until stop is called.
+        """
+
+        for component in self.components:
+            component.start()
+
+        self.scheduler.add('stats', self.log_stats, self.stats_interval)
+        self.scheduler.run()
+
+        print('Stopping components')
+        for component in self.components:
+            component.stop(STOP_TIMEOUT_SECONDS)
+
+        print('Supervisor stopped')
+
+    def stop(self):
+        # Only wakes up the main loop, so it's safe to call from a signal handler.
+        self.scheduler.stop(timeout=0)
+
+    def log_stats(self):
+        """
+        Log the CPU time of every component since the previous run, attributed by the
+        names of the threads it used. Threads of libraries which don't take a name,
+        such as the transfer threads of boto3, are counted as other. Threads which
+        ended since the previous run, such as socket connections, are not counted at all.
+        Before Python 3.8 all CPU time is counted as other.
+        """
+
+        names = dict((thread.native_id, thread.name) for thread in threading.enumerate()) \
+            if NATIVE_THREAD_IDS else dict()
+        cpu = get_thread_cpu()
+
+        usage = dict((component.name, 0.0) for component in self.components)
+        usage['other'] = 0.0
+
+        for thread_id, seconds in cpu.items():
+            delta = seconds - self.thread_cpu.get(thread_id, 0.0)
+            name = names.get(thread_id, '')
+
+            owner = 'other'
+            for component in self.components:
+                if component.owns_thread(name):
+                    owner = component.name
+                    break
+
+            usage[owner] += delta
+
+        self.thread_cpu = cpu
+
+        for name, seconds in usage.items():
+            print('CPU of {0}: {1:.2f}s, {2:.1f}%'.format(
+                name,
+                seconds,
+                100.0 * seconds / self.stats_interval
+            ))
+
+        for component in self.components:
+            print('Component {0} stats: {1}'.format(component.name, component.stats))
+
+        print('Process RSS: {0} kB, threads: {1}'.format(get_rss_kb(), len(cpu)))
+
+
+def get_thread_cpu():
+    """
+    Get the user and system CPU seconds of each thread of the process, by thread id.
+    """
+
+    cpu = dict()
+
+    for tid in os.listdir('/proc/self/task'):
+        try:
+            with open('/proc/self/task/{0}/stat'.format(tid)) as f:
+                stat = f.read()
+        except OSError:
+            # Thread ended while listing.
+            continue
+
+        # Thread name may contain spaces, the fields follow the closing parenthesis.
+        fields = stat[stat.rindex(')') + 2:].split()
+        cpu[int(tid)] = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    return cpu
+
+
+def get_rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the monitors in a single process')
+    for name in COMPONENTS:
+        parser.add_argument('--{0}'.format(name), help='Arguments of the {0} monitor, in quotes'.format(name))
+    parser.add_argument('--stats_interval', type=int, default=DEFAULT_STATS_INTERVAL_SECONDS,
+                        help='Interval in seconds at which CPU and memory use are logged')
+    parsed = parser.parse_args()
+
+    components = []
+    for name, (module, thread_prefixes) in COMPONENTS.items():
+        args = getattr(parsed, name)
+        if args is not None:
+            components.append(Component(name, module, shlex.split(args), thread_prefixes))
+
+    if len(components) == 0:
+        print('Specify at least one of {0}'.format(', '.join('--' + name for name in COMPONENTS)))
+        sys.exit(1)
+
+    supervisor = Supervisor(components, stats_interval=parsed.stats_interval)
+
+    def handle_sigterm(signum, frame):
+        print('Received signal {0}, stopping'.format(signum))
+        supervisor.stop()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    signal.signal(signal.SIGINT, handle_sigterm)
+
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
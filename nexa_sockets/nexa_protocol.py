@@ -0,0 +1,129 @@
+# Based on reverse engineering of the Nexa protocol in the following blog
+# http://tech.jolowe.se/home-automation-rf-protocols/
+
+# Nexa controllers repeat the code five times.
+CODE_REPEATS = 5
+# Length of a single time slot in microseconds.
+T_LENGTH = 250
+# Fixed and only allowed length of a code.
+CODE_LENGTH = 26
+# Units which can be controlled with one code.
+UNITS = (1, 2, 3)
+# Unit which stands for all units of a code, sent as one command to each of them.
+ALL_UNITS = 'all'
+
+HIGH = 1
+LOW = 0
+
+# Symbols as count of low time slots following a single high time slot.
+SYMBOL_HIGH = 1
+SYMBOL_LOW = 5
+SYMBOL_SYNC = 10
+SYMBOL_PAUSE = 40
+
+# Unit bits, sent after the channel bits.
+UNIT_SYMBOLS = {
+    1: (SYMBOL_HIGH, SYMBOL_HIGH),
+    2: (SYMBOL_HIGH, SYMBOL_LOW),
+    3: (SYMBOL_LOW, SYMBOL_HIGH),
+}
+
+
+def validate(code, unit, onoff):
+    if code is None or not isinstance(code, str) or len(code) != CODE_LENGTH:
+        raise ValueError('Invalid code. Code has to be exactly 26 bits.')
+    for i, bit in enumerate(code):
+        if bit not in ('0', '1'):
+            raise ValueError('Invalid bit in code: {0}, at position {1}'.format(bit, i))
+    if unit not in UNITS:
+        raise ValueError('Invalid unit {0}'.format(unit))
+    if onoff not in (0, 1):
+        raise ValueError('Invalid onoff {0}'.format(onoff))
+
+
+def expand_commands(commands):
+    """
+    Replace every (code, ALL_UNITS, onoff) command with a command to each unit of the code.
+    :param commands: List of (code, unit, onoff) tuples.
+    :return: List of (code, unit, onoff) tuples, with units 1-3 only.
+    """
+
+    expanded = []
+    for code, unit, onoff in commands:
+        if unit == ALL_UNITS:
+            expanded.extend((code, each, onoff) for each in UNITS)
+        else:
+            expanded.append((code, unit, onoff))
+
+    return expanded
+
+
+def encode_symbols(code, unit, onoff):
+    """
+    Encode a single frame of code and control bits into symbols.
+    """
+
+    validate(code, unit, onoff)
+
+    symbols = [SYMBOL_SYNC]
+    symbols.extend(SYMBOL_HIGH if bit == '1' else SYMBOL_LOW for bit in code)
+    # Group bit, sent like the on/off bit.
+    symbols.append(SYMBOL_LOW if onoff else SYMBOL_HIGH)
+    symbols.append(SYMBOL_LOW if onoff else SYMBOL_HIGH)
+    # Two high bits signify Nexa device.
+    # Other products also use the same protocol.
+    symbols.extend((SYMBOL_HIGH, SYMBOL_HIGH))
+    symbols.extend(UNIT_SYMBOLS[unit])
+    symbols.append(SYMBOL_PAUSE)
+
+    return symbols
+
+
+def encode(code, unit, onoff, repeats=CODE_REPEATS):
+    """
+    Compile the full transmission into pulses.
+    :param code: The 26 bits long unique code which is registered to socket.
+    :param unit: Unit to control 1-3.
+    :param onoff: 1 to turn unit on, 0 to turn it off.
+    :param repeats: Count of times the frame is sent.
+    :return: List of (level, microseconds) tuples.
+    """
+
+    if repeats is None or repeats < 1:
+        raise ValueError('Invalid repeats')
+
+    pulses = []
+    for symbol in encode_symbols(code, unit, onoff):
+        pulses.append((HIGH, T_LENGTH))
+        pulses.append((LOW, T_LENGTH * symbol))
+
+    return pulses * repeats
+
+
+def encode_batch(commands, repeats=CODE_REPEATS):
+    """
+    Compile several commands into a single transmission, sent back to back.
+    The pause ending each frame is the only gap the receivers need between commands.
+    Every command still takes its repeats of frames, 145 ms to 290 ms with the
+    default repeats depending on the ones and zeros of the code, so three commands
+    take at most 0.87 s and four or more can take over a second.
+    :param commands: List of (code, unit, onoff) tuples.
+    :return: List of (level, microseconds) tuples.
+    """
+
+    if commands is None or len(commands) == 0:
+        raise ValueError('Invalid commands')
+
+    pulses = []
+    for code, unit, onoff in commands:
+        pulses.extend(encode(code, unit, onoff, repeats))
+
+    return pulses
+
+
+def get_duration(pulses):
+    """
+    Get the duration of the pulses in microseconds.
+    """
+
+    return sum(us for _, us in pulses)
@@ -0,0 +1,376 @@
+import argparse
+import collections
+import errno
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+
+from common.scheduler import Periodic_Scheduler
+from nexa_sockets import nexa_protocol, transmitters
+
+DEFAULT_SOCKET_PATH = '/tmp/nexa_sockets.sock'
+DEFAULT_CLIENT_TIMEOUT_SECONDS = 5
+# Count of encoded frames kept in memory.
+DEFAULT_CACHE_SIZE = 64
+DEFAULT_STATS_INTERVAL_SECONDS = 3600
+# Seconds to wait for the running transmission on exit.
+STOP_TIMEOUT_SECONDS = 10
+# Only the owner and the group of the daemon can send commands.
+SOCKET_MODE = 0o660
+# Max count of commands sent in one transmission, the rest go in the next one. Each command is
+# 340 pulses with the default repeats, so this stays well within the pulses of a pigpio wave.
+MAX_BATCH_COMMANDS = 8
+
+parser = argparse.ArgumentParser(description='Daemon which keeps the 433Mhz transmitter set up and '
+                                             'sends the Nexa commands it receives over a Unix socket')
+parser.add_argument('--pin', type=int, required=True, help='Data pin for 433Mhz transceiver')
+parser.add_argument('--socket_path', default=DEFAULT_SOCKET_PATH, help='Unix socket to listen for commands on')
+parser.add_argument('--transmitter', choices=transmitters.TRANSMITTERS, default=transmitters.TRANSMITTER_PIGPIO,
+                    help='pigpio for hardware timed pulses, gpio to time them in Python with RPi.GPIO')
+parser.add_argument('--repeats', type=int, default=1, help='Default count of repeats of each command')
+parser.add_argument('--repeat_delay', type=float, default=1, help='Delay in seconds between repeats')
+parser.add_argument('--stats_interval', type=int, default=DEFAULT_STATS_INTERVAL_SECONDS,
+                    help='Interval in seconds at which the daemon stats are logged')
+
+
+class Nexa_Daemon:
+    """
+    Accepts commands over a Unix socket and sends them one at a time
+    from a single thread, so that transmissions never interleave.
+    Pending commands to the same unit are coalesced into the latest one.
+    """
+
+    def __init__(self, transmitter, socket_path=DEFAULT_SOCKET_PATH, repeats=1, repeat_delay=1,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        if transmitter is None:
+            raise ValueError('Invalid transmitter')
+        if socket_path is None or len(socket_path) == 0:
+            raise ValueError('Invalid socket_path')
+        if repeats is None or repeats < 1:
+            raise ValueError('Repeats has to be above 0')
+        if repeat_delay is None or repeat_delay < 0:
+            raise ValueError('Invalid repeat_delay')
+
+        self.transmitter = transmitter
+        self.socket_path = socket_path
+        self.repeats = repeats
+        self.repeat_delay = repeat_delay
+        self.cache_size = cache_size
+
+        # Commands waiting for the transmitter, oldest first, by (code, unit).
+        self.pending = collections.OrderedDict()
+        # Encoded frames, least recently used first, by (code, unit, onoff).
+        self.frames = collections.OrderedDict()
+        self._condition = threading.Condition()
+        self.stopping = threading.Event()
+        self.server = None
+        self.server_thread = None
+        self.transmit_thread = threading.Thread(target=self._run, name='sockets-transmit', daemon=True)
+        self.stats = {
+            'received': 0,
+            'coalesced': 0,
+            'sent': 0,
+            'failed': 0,
+            'transmissions': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+        }
+
+        print('Nexa_Daemon initialized with socket_path:{0}, repeats:{1}, repeat_delay:{2}'.format(
+            self.socket_path,
+            self.repeats,
+            self.repeat_delay
+        ))
+
+    def start(self):
+        self._remove_stale_socket()
+
+        self.server = _Command_Server(self.socket_path, _Command_Handler)
+        os.chmod(self.socket_path, SOCKET_MODE)
+        self.server.daemon_threads = True
+        self.server.nexa_daemon = self
+
+        self.server_thread = threading.Thread(target=self.server.serve_forever, name='sockets-server', daemon=True)
+        self.server_thread.start()
+        self.transmit_thread.start()
+
+        print('Listening for commands on {0}'.format(self.socket_path))
+
+    def stop(self, timeout=None):
+        """
+        Stop accepting commands, waiting at most timeout seconds for the running transmission.
+        """
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+        self.stopping.set()
+        with self._condition:
+            self._condition.notify()
+
+        if self.transmit_thread.is_alive():
+            self.transmit_thread.join(timeout)
+
+    def _remove_stale_socket(self):
+        """
+        Remove the socket left behind by a previous run, raising if another daemon
+        is listening on it, as both would drive the radio at the same time.
+        """
+
+        if not os.path.exists(self.socket_path):
+            return
+
+        if not stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+            raise Exception('{0} exists and is not a socket'.format(self.socket_path))
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            try:
+                client.connect(self.socket_path)
+            except OSError as err:
+                if err.errno != errno.ECONNREFUSED:
+                    raise
+
+                print('Removing stale socket {0}'.format(self.socket_path))
+                os.remove(self.socket_path)
+                return
+
+        raise Exception('Another daemon is listening on {0}'.format(self.socket_path))
+
+    def submit(self, code, unit, onoff, repeats=None):
+        """
+        Queue a command, replacing the pending command to the same unit.
+        Returns the count of pending commands.
+        """
+
+        return self.submit_batch([(code, unit, onoff)], repeats=repeats)
+
+    def submit_batch(self, commands, repeats=None):
+        """
+        Queue several (code, unit, onoff) commands, which are sent back to back
+        together with the other pending commands. Unit "all" queues a command to each unit.
+        Returns the count of pending commands.
+        """
+
+        if commands is None or len(commands) == 0:
+            raise ValueError('Invalid commands')
+        commands = nexa_protocol.expand_commands(commands)
+        for code, unit, onoff in commands:
+            nexa_protocol.validate(code, unit, onoff)
+        if repeats is not None and (not isinstance(repeats, int) or repeats < 1):
+            raise ValueError('Invalid repeats')
+
+        with self._condition:
+            for code, unit, onoff in commands:
+                key = (code, unit)
+                self.stats['received'] += 1
+
+                if key in self.pending:
+                    print('Coalescing command to unit {0} of code {1}'.format(unit, code))
+                    self.stats['coalesced'] += 1
+                    # The newer command goes after the commands received in between.
+                    self.pending.move_to_end(key)
+
+                self.pending[key] = (onoff, repeats if repeats is not None else self.repeats)
+
+            self._condition.notify()
+
+            return len(self.pending)
+
+    def encode(self, code, unit, onoff):
+        """
+        Get the pulses of a command, encoding them only on first use.
+        """
+
+        key = (code, unit, onoff)
+
+        pulses = self.frames.get(key)
+        if pulses is not None:
+            self.frames.move_to_end(key)
+            self.stats['cache_hits'] += 1
+            return pulses
+
+        self.stats['cache_misses'] += 1
+        pulses = nexa_protocol.encode(code, unit, onoff)
+
+        self.frames[key] = pulses
+        if len(self.frames) > self.cache_size:
+            self.frames.popitem(last=False)
+
+        return pulses
+
+    def log_stats(self):
+        print('Nexa daemon stats: pending:{0}, {1}'.format(len(self.pending), self.stats))
+        self.transmitter.log_stats()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self.pending) == 0 and not self.stopping.is_set():
+                    self._condition.wait()
+
+                if self.stopping.is_set():
+                    return
+
+                # The oldest pending commands are sent in one transmission, the rest in the next.
+                batch = []
+                while len(self.pending) > 0 and len(batch) < MAX_BATCH_COMMANDS:
+                    batch.append(self.pending.popitem(last=False))
+
+            print('Sending {0} commands: {1}'.format(
+                len(batch),
+                ', '.join('unit:{0} onoff:{1}'.format(unit, onoff) for (_, unit), (onoff, _) in batch)
+            ))
+
+            try:
+                for i in range(max(repeats for _, (_, repeats) in batch)):
+                    if i > 0 and self.stopping.wait(self.repeat_delay):
+                        return
+
+                    pulses = []
+                    for (code, unit), (onoff, repeats) in batch:
+                        if repeats > i:
+                            pulses.extend(self.encode(code, unit, onoff))
+
+                    self.transmitter.send(pulses)
+                    self.stats['transmissions'] += 1
+
+                self.stats['sent'] += len(batch)
+            except Exception as err:
+                print('Exception while sending {0} commands: {1}'.format(len(batch), err))
+                self.stats['failed'] += len(batch)
+
+
+class _Command_Server(socketserver.ThreadingUnixStreamServer):
+    """
+    Handles every connection on its own thread, named so that the supervisor
+    counts its CPU time to the sockets.
+    """
+
+    def process_request_thread(self, request, client_address):
+        threading.current_thread().name = 'sockets-handler'
+        super().process_request_thread(request, client_address)
+
+
+class _Command_Handler(socketserver.StreamRequestHandler):
+    """
+    Reads commands as JSON lines of form {"code": "...", "unit": 1, "onoff": "on"},
+    or batches of form {"commands": [...]}, and answers each with a JSON line.
+    Unit "all" sends the command to units 1-3.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if len(line.strip()) == 0:
+                continue
+
+            try:
+                request = json.loads(line.decode('utf-8'))
+                commands = request.get('commands', [request])
+                pending = self.server.nexa_daemon.submit_batch(
+                    [(command.get('code'), command.get('unit'), parse_onoff(command.get('onoff')))
+                     for command in commands],
+                    repeats=request.get('repeats')
+                )
+                reply = {'ok': True, 'pending': pending}
+            except Exception as err:
+                print('Invalid command {0}: {1}'.format(line, err))
+                reply = {'ok': False, 'error': str(err)}
+
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+def parse_onoff(onoff):
+    if onoff == 'on':
+        return 1
+    elif onoff == 'off':
+        return 0
+
+    raise ValueError('Invalid onoff, must be "on" or "off"')
+
+
+def send_command(code, unit, onoff, repeats=None, socket_path=DEFAULT_SOCKET_PATH,
+                 timeout=DEFAULT_CLIENT_TIMEOUT_SECONDS):
+    """
+    Queue a command on the daemon.
+    :param unit: Unit 1-3, or "all" for all units of the code.
+    :param onoff: "on" or "off".
+    :return: Count of commands pending on the daemon.
+    """
+
+    return send_commands([(code, unit, onoff)], repeats=repeats, socket_path=socket_path, timeout=timeout)
+
+
+def send_commands(commands, repeats=None, socket_path=DEFAULT_SOCKET_PATH, timeout=DEFAULT_CLIENT_TIMEOUT_SECONDS):
+    """
+    Queue several (code, unit, onoff) commands on the daemon, which sends them back to back.
+    :return: Count of commands pending on the daemon.
+    """
+
+    request = {'commands': [{'code': code, 'unit': unit, 'onoff': onoff} for code, unit, onoff in commands]}
+    if repeats is not None:
+        request['repeats'] = repeats
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+
+        with client.makefile('rb') as f:
+            reply = json.loads(f.readline().decode('utf-8'))
+
+    if not reply.get('ok'):
+        raise Exception('Daemon refused the commands: {0}'.format(reply.get('error')))
+
+    return reply.get('pending')
+
+
+def main(argv=None, scheduler=None):
+    """
+    Run the daemon until the scheduler is stopped.
+    Scheduler can be passed in by a supervisor which stops it.
+    """
+
+    parsed = parser.parse_args(argv)
+
+    if scheduler is None:
+        scheduler = Periodic_Scheduler(name='sockets')
+
+    transmitter = transmitters.create_transmitter(parsed.transmitter, parsed.pin)
+
+    try:
+        daemon = Nexa_Daemon(transmitter,
+                             socket_path=parsed.socket_path,
+                             repeats=parsed.repeats,
+                             repeat_delay=parsed.repeat_delay)
+        daemon.start()
+
+        scheduler.add('stats', daemon.log_stats, parsed.stats_interval)
+
+        print('Entering main application loop')
+        try:
+            scheduler.run()
+        finally:
+            daemon.stop(timeout=STOP_TIMEOUT_SECONDS)
+    finally:
+        transmitter.close()
+
+
+def handle_sigterm(signum, frame):
+    """
+    Exit normally on SIGTERM so that the pin is released.
+    """
+    print('Received SIGTERM, exiting')
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    main()
@@ -0,0 +1,188 @@
+import gc
+import time
+
+# Names of the available transmitters.
+TRANSMITTER_PIGPIO = 'pigpio'
+TRANSMITTER_GPIO = 'gpio'
+TRANSMITTERS = (TRANSMITTER_PIGPIO, TRANSMITTER_GPIO)
+
+# Seconds between polls of whether pigpio has sent the wave.
+WAVE_POLL_SECONDS = 0.01
+
+
+class Transmitter:
+    """
+    Base for the ways of driving the 433Mhz transmitter data pin.
+    Subclasses implement _send, which outputs a list of (level, microseconds) pulses.
+    """
+
+    def __init__(self, pin):
+        if pin is None or not isinstance(pin, int) or pin < 0:
+            raise ValueError('Invalid pin number')
+
+        self.pin = pin
+        self.stats = {
+            'sent': 0,
+            'seconds': 0.0,
+        }
+
+    def open(self):
+        """
+        Set up the pin for output.
+        """
+        pass
+
+    def close(self):
+        """
+        Release the pin.
+        """
+        pass
+
+    def send(self, pulses):
+        start = time.perf_counter()
+        self._send(pulses)
+        duration = time.perf_counter() - start
+
+        self.stats['sent'] += 1
+        self.stats['seconds'] += duration
+
+        print('Sent {0} pulses in {1:.3f}s'.format(len(pulses), duration))
+
+    def log_stats(self):
+        print('Transmitter {0} stats: {1}'.format(self.__class__.__name__, self.stats))
+
+    def _send(self, pulses):
+        raise NotImplementedError()
+
+
+class Pigpio_Transmitter(Transmitter):
+    """
+    Sends the pulses as a pigpio wave, which the pigpio daemon
+    times with DMA, independent of Python and the kernel scheduler.
+    """
+
+    def __init__(self, pin):
+        super().__init__(pin)
+
+        self.pi = None
+
+        print('Pigpio_Transmitter initialized with pin:{0}'.format(self.pin))
+
+    def open(self):
+        # pigpio is only needed with this transmitter.
+        import pigpio
+
+        self.pigpio = pigpio
+
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            self.pi = None
+            raise Exception('Could not connect to pigpio daemon')
+
+        print('Setting pin {0} as OUTPUT'.format(self.pin))
+        self.pi.set_mode(self.pin, pigpio.OUTPUT)
+        self.pi.write(self.pin, 0)
+
+    def close(self):
+        if self.pi is not None:
+            self.pi.write(self.pin, 0)
+            self.pi.stop()
+            self.pi = None
+
+    def _send(self, pulses):
+        if self.pi is None:
+            raise Exception('Transmitter is not open')
+
+        mask = 1 << self.pin
+        wave = [self.pigpio.pulse(mask, 0, us) if level else self.pigpio.pulse(0, mask, us)
+                for level, us in pulses]
+
+        self.pi.wave_clear()
+        self.pi.wave_add_generic(wave)
+        wave_id = self.pi.wave_create()
+
+        try:
+            self.pi.wave_send_once(wave_id)
+            while self.pi.wave_tx_busy():
+                time.sleep(WAVE_POLL_SECONDS)
+        finally:
+            self.pi.wave_delete(wave_id)
+            self.pi.write(self.pin, 0)
+
+
+class Gpio_Transmitter(Transmitter):
+    """
+    Sends the pulses with RPi.GPIO, busy-waiting against absolute deadlines
+    so that the errors of the single pulses don't add up.
+    """
+
+    def __init__(self, pin):
+        super().__init__(pin)
+
+        self.gpio = None
+
+        print('Gpio_Transmitter initialized with pin:{0}'.format(self.pin))
+
+    def open(self):
+        # RPi.GPIO is only needed with this transmitter.
+        import RPi.GPIO as GPIO
+
+        self.gpio = GPIO
+
+        # Set pin mode as BCM.
+        GPIO.setmode(GPIO.BCM)
+
+        print('Setting pin {0} as OUTPUT'.format(self.pin))
+        GPIO.setup(self.pin, GPIO.OUT, initial=GPIO.LOW)
+
+    def close(self):
+        if self.gpio is not None:
+            print('Cleaning up')
+            self.gpio.cleanup()
+            self.gpio = None
+
+    def _send(self, pulses):
+        if self.gpio is None:
+            raise Exception('Transmitter is not open')
+
+        output = self.gpio.output
+        pin = self.pin
+        clock = time.perf_counter_ns
+
+        # A collection in the middle of the frame would stretch a pulse.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            deadline = clock()
+            for level, us in pulses:
+                output(pin, level)
+                deadline += us * 1000
+                while clock() < deadline:
+                    pass
+        finally:
+            output(pin, 0)
+            if gc_enabled:
+                gc.enable()
+
+
+def create_transmitter(name, pin):
+    """
+    Create and open the named transmitter.
+    Falls back to RPi.GPIO if the transmitter cannot be opened.
+    """
+
+    if name not in TRANSMITTERS:
+        raise ValueError('Invalid transmitter {0}'.format(name))
+
+    if name == TRANSMITTER_PIGPIO:
+        transmitter = Pigpio_Transmitter(pin)
+        try:
+            transmitter.open()
+            return transmitter
+        except Exception as err:
+            print('Failed to open pigpio transmitter, falling back to RPi.GPIO: {0}'.format(err))
+
+    transmitter = Gpio_Transmitter(pin)
+    transmitter.open()
+    return transmitter
@@ -7,8 +7,10 @@ DD_PROCESS_PID2=$(pgrep sh -a | grep bin/agent | cut -d ' ' -f 1)
 DD_PROCESS_PID3=$(pgrep python -a | grep agent/dogstatsd.py | cut -d ' ' -f 1)
 DD_PROCESS_PID4=$(pgrep python -a | grep agent/jmxfetch.py | cut -d ' ' -f 1)
 
-TEMP_PROCESS_PID=$(pgrep python3 -a | grep "temperature_dd.py" | cut -d ' ' -f 1)
-CAM_PROCESS_PID=$(pgrep python3 -a | grep "camera_app.py" | cut -d ' ' -f 1)
+SUPERVISOR_PID=$(pgrep -f "common.supervisor")
+
+# Seconds the monitors get to write out their buffers before they are killed.
+STOP_TIMEOUT=60
 
 # Datadog processes.
 
@@ -34,12 +36,19 @@ fi
 
 # Other processes.
 
-if [[ "$TEMP_PROCESS_PID" ]]; then
-    echo "Stopping Temperature/Humidity process $TEMP_PROCESS_PID"
-    kill -9 $TEMP_PROCESS_PID
+if [[ "$SUPERVISOR_PID" ]]; then
+    echo "Stopping monitoring process $SUPERVISOR_PID"
+    kill -TERM $SUPERVISOR_PID
+
+    for i in $(seq $STOP_TIMEOUT); do
+        if ! kill -0 $SUPERVISOR_PID 2>/dev/null; then
+            break
+        fi
+        sleep 1
+    done
+
+    if kill -0 $SUPERVISOR_PID 2>/dev/null; then
+        echo "Monitoring process $SUPERVISOR_PID did not stop, killing it"
+        kill -9 $SUPERVISOR_PID
+    fi
 fi
-
-if [[ "$CAM_PROCESS_PID" ]]; then
-    echo "Stopping S3 WebCam process $CAM_PROCESS_PID"
-    kill -9 $CAM_PROCESS_PID
-fi
\ No newline at end of file
@@ -0,0 +1,304 @@
+"""
+Fixed-width binary storage for measurements, one file per measurement.
+Every record is a little-endian int32 UNIX timestamp and a float32 value,
+records are in timestamp order, so the files can be memory mapped and
+range queried with a binary search.
+
+Convert existing CSV files with
+python3 -m temp_hum_sensor.binary_storage --source CSV_DIRECTORY --target BINARY_DIRECTORY
+"""
+
+import argparse
+import fcntl
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+RECORD_DTYPE = np.dtype([('timestamp', '<i4'), ('value', '<f4')])
+EXTENSION = 'bin'
+
+# Lock file held by the writer of a directory, so that a conversion never
+# replaces a file which a running writer appends to.
+LOCK_FILENAME = '.binary_storage.lock'
+
+DEFAULT_FLUSH_LINES = 60
+DEFAULT_FLUSH_INTERVAL_SECONDS = 300
+
+# Matches the daily CSV files, e.g. temperature-2020-01-31.csv
+_CSV_NAME_REGEX = re.compile(r'^(.+)-(\d{4}-\d{2}-\d{2})\.csv$')
+
+
+def get_filename(meas_name):
+    """
+    Get the name of the binary file for the given measurement.
+    """
+    return '{0}.{1}'.format(meas_name, EXTENSION)
+
+
+class Binary_Writer:
+    """
+    Appends measurements into binary files, buffering records in memory
+    and writing them out when enough records or time has accumulated.
+    """
+
+    def __init__(self, directory, flush_lines=DEFAULT_FLUSH_LINES,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL_SECONDS):
+        if directory is None or not os.path.isdir(directory):
+            raise ValueError('Invalid directory')
+        if flush_lines is None or not isinstance(flush_lines, int) or flush_lines < 1:
+            raise ValueError('Invalid flush_lines')
+        if flush_interval is None or flush_interval < 0:
+            raise ValueError('Invalid flush_interval')
+
+        self.directory = directory
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+
+        # Open file, last written timestamp and buffered records for each measurement.
+        self.files = dict()
+        self.last_timestamps = dict()
+        self.buffers = dict()
+        self.buffered_count = 0
+        self.last_flush = time.time()
+        self._lock = threading.Lock()
+        self._lock_file = lock_directory(directory)
+
+        print('Binary_Writer initialized with directory:{0}, flush_lines:{1}, flush_interval:{2}'.format(
+            self.directory,
+            self.flush_lines,
+            self.flush_interval
+        ))
+
+    def write(self, meas_name, timestamp, value):
+        """
+        Buffer a single measurement, flushing if a threshold is exceeded.
+        Measurements older than the last one are dropped to keep the file sorted.
+        """
+
+        timestamp = int(timestamp)
+
+        with self._lock:
+            if meas_name not in self.files:
+                self._open(meas_name)
+
+            if timestamp < self.last_timestamps[meas_name]:
+                print('Dropping out of order measurement {0} at {1}'.format(meas_name, timestamp))
+                return
+
+            self.last_timestamps[meas_name] = timestamp
+            self.buffers.setdefault(meas_name, []).append((timestamp, value))
+            self.buffered_count += 1
+
+            if self.buffered_count >= self.flush_lines \
+                    or time.time() - self.last_flush >= self.flush_interval:
+                self._flush_all()
+
+    def flush(self):
+        """
+        Write all buffered records into files.
+        """
+
+        with self._lock:
+            self._flush_all()
+
+    def close(self):
+        """
+        Flush and close all files.
+        """
+
+        with self._lock:
+            self._flush_all()
+
+            for f in self.files.values():
+                f.close()
+            self.files.clear()
+
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+        print('Binary_Writer closed')
+
+    def _flush_all(self):
+        for meas_name, records in self.buffers.items():
+            if len(records) == 0:
+                continue
+
+            f = self.files[meas_name]
+            f.write(np.array(records, dtype=RECORD_DTYPE).tobytes())
+            f.flush()
+
+        self.buffers.clear()
+        self.buffered_count = 0
+        self.last_flush = time.time()
+
+    def _open(self, meas_name):
+        full_path = os.path.join(self.directory, get_filename(meas_name))
+        print('Opening measurement file {0}'.format(full_path))
+
+        records = _map(full_path)
+        self.last_timestamps[meas_name] = int(records['timestamp'][-1]) if len(records) > 0 else 0
+        self.files[meas_name] = open(full_path, mode='ab')
+
+        # Drop a partial record left by a crash, so that records stay aligned.
+        size = os.path.getsize(full_path)
+        if size % RECORD_DTYPE.itemsize != 0:
+            print('Truncating partial record from {0}'.format(full_path))
+            self.files[meas_name].truncate(size - size % RECORD_DTYPE.itemsize)
+
+
+def lock_directory(directory, lock_filename=LOCK_FILENAME):
+    """
+    Take the lock of the files in the directory, by default of the binary files,
+    raising if another writer holds it.
+    Returns the open lock file, which holds the lock until closed.
+    """
+
+    f = open(os.path.join(directory, lock_filename), 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        raise Exception('Files in {0} are in use by another writer, {1} is locked'.format(directory, lock_filename))
+
+    return f
+
+
+def _map(full_path):
+    """
+    Memory map the records of a file, empty array if there are none.
+    """
+
+    if not os.path.exists(full_path):
+        return np.empty(0, dtype=RECORD_DTYPE)
+
+    count = os.path.getsize(full_path) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+
+    return np.memmap(full_path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+
+
+def read_range(directory, meas_name, start=None, end=None):
+    """
+    Read measurements with start <= timestamp < end, either bound can be None.
+    Returns tuple of timestamp and value arrays.
+    """
+
+    records = _map(os.path.join(directory, get_filename(meas_name)))
+    timestamps = records['timestamp']
+
+    first = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+    last = len(records) if end is None else np.searchsorted(timestamps, end, side='left')
+
+    selected = records[first:last]
+
+    return np.array(selected['timestamp']), np.array(selected['value'])
+
+
+def convert_csv(source_directory, target_directory):
+    """
+    Convert the daily CSV files in source directory into binary files,
+    merging them with the existing binary files.
+    Refuses to run while a writer has the target directory open, as the
+    merged files replace the ones the writer appends to.
+    Returns the count of converted records for each measurement.
+    """
+
+    lock_file = lock_directory(target_directory)
+    try:
+        return _convert_csv(source_directory, target_directory)
+    finally:
+        lock_file.close()
+
+
+def _convert_csv(source_directory, target_directory):
+
+    csv_files = dict()
+    for filename in os.listdir(source_directory):
+        matches = _CSV_NAME_REGEX.match(filename)
+        if matches is None:
+            continue
+
+        csv_files.setdefault(matches.group(1), []).append(os.path.join(source_directory, filename))
+
+    converted = dict()
+    for meas_name, paths in csv_files.items():
+        parts = [_map(os.path.join(target_directory, get_filename(meas_name)))]
+
+        for path in sorted(paths):
+            parts.append(_read_csv(path))
+
+        records = np.concatenate(parts)
+        records = records[np.argsort(records['timestamp'], kind='stable')]
+
+        # Drop duplicates of records already converted earlier.
+        _, unique = np.unique(records['timestamp'], return_index=True)
+        records = records[unique]
+
+        target_path = os.path.join(target_directory, get_filename(meas_name))
+        temp_path = target_path + '.tmp'
+        records.tofile(temp_path)
+        os.replace(temp_path, target_path)
+
+        converted[meas_name] = len(records)
+        print('Converted {0} files of {1} into {2} records'.format(
+            len(paths),
+            meas_name,
+            len(records)
+        ))
+
+    return converted
+
+
+def _read_csv(path):
+    """
+    Read the timestamp,value rows of a CSV file into records, skipping malformed rows
+    and the partial last line which a crash in the middle of a write leaves behind.
+    """
+
+    timestamps = []
+    values = []
+    skipped = 0
+
+    with open(path) as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+
+            parts = line.split(',')
+            try:
+                if not line.endswith('\n') or len(parts) != 2:
+                    raise ValueError()
+                timestamp = int(float(parts[0]))
+                value = float(parts[1])
+            except ValueError:
+                skipped += 1
+                continue
+
+            timestamps.append(timestamp)
+            values.append(value)
+
+    if skipped > 0:
+        print('Skipped {0} malformed rows of {1}'.format(skipped, path))
+
+    part = np.empty(len(timestamps), dtype=RECORD_DTYPE)
+    part['timestamp'] = timestamps
+    part['value'] = values
+
+    return part
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert measurement CSV files into binary files')
+    parser.add_argument('--source', required=True, help='Directory of the CSV files')
+    parser.add_argument('--target', required=True, help='Directory into which the binary files are written')
+    parsed = parser.parse_args()
+
+    if not os.path.isdir(parsed.target):
+        os.makedirs(parsed.target)
+
+    convert_csv(parsed.source, parsed.target)
@@ -0,0 +1,136 @@
+import datetime
+import os
+import threading
+import time
+
+DEFAULT_FLUSH_LINES = 60
+DEFAULT_FLUSH_INTERVAL_SECONDS = 300
+
+
+def get_filename(meas_name, date_str, extension='csv'):
+    """
+    Generate the daily rotating file name for the given measurement.
+    """
+    return '{0}-{1}.{2}'.format(meas_name, date_str, extension)
+
+
+class Buffered_Csv_Writer:
+    """
+    Appends measurements into daily CSV files per measurement.
+    Keeps the file of the day open and buffers lines in memory, writing them
+    out when enough lines or time has accumulated, so the SD card is not
+    written on every reading.
+    """
+
+    def __init__(self, directory, flush_lines=DEFAULT_FLUSH_LINES,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL_SECONDS, extension='csv'):
+        if directory is None or not os.path.isdir(directory):
+            raise ValueError('Invalid directory')
+        if flush_lines is None or not isinstance(flush_lines, int) or flush_lines < 1:
+            raise ValueError('Invalid flush_lines')
+        if flush_interval is None or flush_interval < 0:
+            raise ValueError('Invalid flush_interval')
+
+        self.directory = directory
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.extension = extension
+
+        # Open file and its date string for each measurement.
+        self.files = dict()
+        # Date string and buffered lines for each measurement.
+        self.buffers = dict()
+        self.buffered_count = 0
+        self.last_flush = time.time()
+        self._lock = threading.Lock()
+
+        print('Buffered_Csv_Writer initialized with directory:{0}, flush_lines:{1}, flush_interval:{2}'.format(
+            self.directory,
+            self.flush_lines,
+            self.flush_interval
+        ))
+
+    def write(self, meas_name, timestamp, value):
+        """
+        Buffer a single measurement, flushing if a threshold is exceeded.
+        """
+
+        date_str = datetime.datetime.fromtimestamp(timestamp).date().isoformat()
+
+        with self._lock:
+            buffer = self.buffers.get(meas_name)
+
+            # Day changed, the lines of the previous day go to its own file.
+            if buffer is not None and buffer[0] != date_str:
+                self._flush_measurement(meas_name)
+                buffer = None
+
+            if buffer is None:
+                buffer = (date_str, [])
+                self.buffers[meas_name] = buffer
+
+            buffer[1].append('{0},{1}\n'.format(int(timestamp), float(value)))
+            self.buffered_count += 1
+
+            if self.buffered_count >= self.flush_lines \
+                    or time.time() - self.last_flush >= self.flush_interval:
+                self._flush_all()
+
+    def flush(self):
+        """
+        Write all buffered lines into files.
+        """
+
+        with self._lock:
+            self._flush_all()
+
+    def close(self):
+        """
+        Flush and close all files.
+        """
+
+        with self._lock:
+            self._flush_all()
+
+            for meas_name, (date_str, f) in self.files.items():
+                f.close()
+            self.files.clear()
+
+        print('Buffered_Csv_Writer closed')
+
+    def _flush_all(self):
+        for meas_name in list(self.buffers.keys()):
+            self._flush_measurement(meas_name)
+
+        self.last_flush = time.time()
+
+    def _flush_measurement(self, meas_name):
+        date_str, lines = self.buffers.pop(meas_name)
+        if len(lines) == 0:
+            return
+
+        self.buffered_count -= len(lines)
+
+        f = self._get_file(meas_name, date_str)
+        f.write(''.join(lines))
+        f.flush()
+
+    def _get_file(self, meas_name, date_str):
+        """
+        Get the open file of the day, rotating the file when the day has changed.
+        """
+
+        current = self.files.get(meas_name)
+        if current is not None:
+            if current[0] == date_str:
+                return current[1]
+
+            current[1].close()
+
+        full_path = os.path.join(self.directory, get_filename(meas_name, date_str, self.extension))
+        print('Opening measurement file {0}'.format(full_path))
+
+        f = open(full_path, mode='a')
+        self.files[meas_name] = (date_str, f)
+
+        return f
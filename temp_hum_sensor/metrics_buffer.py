@@ -0,0 +1,219 @@
+import ipaddress
+import os
+import socket
+import threading
+import time
+
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 8125
+DEFAULT_FLUSH_INTERVAL_SECONDS = 60
+
+# Max size of a single UDP packet, safe for the usual MTU.
+DEFAULT_MAX_PACKET_SIZE = 1432
+# Max size of the spool file, lines which don't fit are dropped.
+DEFAULT_MAX_SPOOL_BYTES = 10 * 1024 * 1024
+
+
+class Metrics_Buffer:
+    """
+    Aggregates gauges and histograms in memory and sends them to DogStatsD
+    as batched multi-metric packets on flush. When the agent cannot be reached
+    the lines are appended to a spool file and replayed on the next successful flush.
+
+    A down agent is only noticed on loopback, where the kernel reports the refused
+    datagram on the following send. The error from a remote host arrives too late,
+    if at all, so with a remote agent the lines sent meanwhile can be lost unspooled.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, tags=None, spool_file=None,
+                 max_packet_size=DEFAULT_MAX_PACKET_SIZE, max_spool_bytes=DEFAULT_MAX_SPOOL_BYTES):
+        if host is None or len(host) == 0:
+            raise ValueError('Invalid host')
+        if port is None or not isinstance(port, int) or port <= 0:
+            raise ValueError('Invalid port')
+        if max_packet_size is None or not isinstance(max_packet_size, int) or max_packet_size < 64:
+            raise ValueError('Invalid max_packet_size')
+
+        self.host = host
+        self.port = port
+        self.tags = tags if tags is not None else []
+        self.spool_file = spool_file
+        self.max_packet_size = max_packet_size
+        self.max_spool_bytes = max_spool_bytes
+
+        # Latest value of each gauge and all values of each histogram since the last flush.
+        self.gauges = dict()
+        self.histograms = dict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'flushes': 0,
+            'packets': 0,
+            'spooled': 0,
+            'replayed': 0,
+            'dropped': 0,
+        }
+
+        # Connected socket gets errors back when nothing listens on the port.
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.connect((self.host, self.port))
+
+        if not ipaddress.ip_address(self.socket.getpeername()[0]).is_loopback:
+            print('DogStatsD host {0} is not local, metrics sent while the agent is down can be lost '
+                  'instead of spooled'.format(self.host))
+
+        print('Metrics_Buffer initialized with host:{0}, port:{1}, tags:{2}, spool_file:{3}'.format(
+            self.host,
+            self.port,
+            self.tags,
+            self.spool_file
+        ))
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = float(value)
+
+    def histogram(self, name, value):
+        with self._lock:
+            self.histograms.setdefault(name, []).append(float(value))
+
+    def flush(self):
+        """
+        Send the aggregated metrics, replaying the spool first if there is one.
+        """
+
+        with self._lock:
+            gauges = self.gauges
+            histograms = self.histograms
+            self.gauges = dict()
+            self.histograms = dict()
+
+        timestamp = int(time.time())
+        tag_suffix = '|#{0}'.format(','.join(self.tags)) if len(self.tags) > 0 else ''
+
+        lines = []
+        for name, value in gauges.items():
+            lines.append(('{0}:{1}|g{2}'.format(name, value, tag_suffix), True))
+        for name, values in histograms.items():
+            # Multi-value packets carry all samples of a histogram in one line.
+            lines.append(('{0}:{1}|h{2}'.format(name, ':'.join(str(v) for v in values), tag_suffix), False))
+
+        self.stats['flushes'] += 1
+
+        if not self._replay():
+            self._spool(lines, timestamp)
+            return
+
+        sent = self._send([line for line, _ in lines])
+        if sent < len(lines):
+            self._spool(lines[sent:], timestamp)
+
+    def close(self):
+        self.flush()
+        self.socket.close()
+
+        print('Metrics_Buffer closed, stats: {0}'.format(self.stats))
+
+    def _send(self, lines):
+        """
+        Send lines packed into as few packets as fit.
+        Returns the count of lines sent before an error.
+        """
+
+        if len(lines) == 0:
+            return 0
+
+        # Errors of a connected UDP socket are only reported on the following send.
+        # An empty probe makes sure the first packet isn't the one lost if the agent is down.
+        if not self._send_packet([]):
+            return 0
+
+        sent = 0
+        packet = []
+        packet_size = 0
+
+        for line in lines:
+            line_size = len(line) + 1
+            if len(packet) > 0 and packet_size + line_size > self.max_packet_size:
+                if not self._send_packet(packet):
+                    return sent
+                sent += len(packet)
+                packet = []
+                packet_size = 0
+
+            packet.append(line)
+            packet_size += line_size
+
+        if len(packet) > 0:
+            if not self._send_packet(packet):
+                return sent
+            sent += len(packet)
+
+        return sent
+
+    def _send_packet(self, packet):
+        try:
+            self.socket.send('\n'.join(packet).encode('utf-8'))
+            if len(packet) > 0:
+                self.stats['packets'] += 1
+            return True
+        except OSError as err:
+            print('Failed to send metrics to {0}:{1}: {2}'.format(self.host, self.port, err))
+            return False
+
+    def _spool(self, lines, timestamp):
+        """
+        Append lines to the spool file. Gauges get their timestamp,
+        so that they are recorded at the right time when replayed.
+        DogStatsD takes no timestamp for histograms, so they are recorded
+        at the time of the replay.
+        """
+
+        if len(lines) == 0:
+            return
+
+        if self.spool_file is None:
+            self.stats['dropped'] += len(lines)
+            return
+
+        data = ''.join(
+            '{0}|T{1}\n'.format(line, timestamp) if timestamped else line + '\n'
+            for line, timestamped in lines
+        )
+
+        size = os.path.getsize(self.spool_file) if os.path.exists(self.spool_file) else 0
+        if size + len(data) > self.max_spool_bytes:
+            print('Metrics spool {0} is full, dropping {1} lines'.format(self.spool_file, len(lines)))
+            self.stats['dropped'] += len(lines)
+            return
+
+        with open(self.spool_file, mode='a') as f:
+            f.write(data)
+
+        self.stats['spooled'] += len(lines)
+
+    def _replay(self):
+        """
+        Send the spooled lines.
+        Returns False if the agent still cannot be reached.
+        """
+
+        if self.spool_file is None or not os.path.exists(self.spool_file):
+            return True
+
+        with open(self.spool_file) as f:
+            lines = [line.rstrip('\n') for line in f if len(line.strip()) > 0]
+
+        sent = self._send(lines)
+        self.stats['replayed'] += sent
+
+        if sent < len(lines):
+            # Keep the unsent lines for the next attempt.
+            temp_file = self.spool_file + '.tmp'
+            with open(temp_file, mode='w') as f:
+                f.write(''.join(line + '\n' for line in lines[sent:]))
+            os.replace(temp_file, self.spool_file)
+            return False
+
+        print('Replayed {0} spooled metric lines'.format(sent))
+        os.remove(self.spool_file)
+        return True
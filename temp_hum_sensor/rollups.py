@@ -0,0 +1,317 @@
+"""
+Min/max/mean/count rollups of measurements at minute, hour and day resolution,
+maintained as the readings arrive so that history can be queried without
+scanning the raw measurements.
+
+Query hourly temperature for the last 90 days with
+python3 -m temp_hum_sensor.rollups query --path PATH --meas temperature --resolution hour --days 90
+
+Rebuild rollups from binary storage files with
+python3 -m temp_hum_sensor.rollups rebuild --path PATH --meas temperature
+"""
+
+import argparse
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+
+from temp_hum_sensor import binary_storage
+
+# Bucket lengths in seconds. Buckets are aligned to UTC.
+RESOLUTIONS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+ROLLUP_DTYPE = np.dtype([
+    ('timestamp', '<i4'),
+    ('min', '<f4'),
+    ('max', '<f4'),
+    ('sum', '<f8'),
+    ('count', '<i4'),
+])
+EXTENSION = 'rollup'
+
+# Lock file held by the writer of the rollups of a directory, so that a rebuild
+# never replaces a file which a running writer appends to.
+LOCK_FILENAME = '.rollups.lock'
+
+
+def get_filename(meas_name, resolution):
+    """
+    Get the name of the rollup file for the given measurement and resolution.
+    """
+    return '{0}-{1}.{2}'.format(meas_name, resolution, EXTENSION)
+
+
+def aggregate(timestamps, values, seconds):
+    """
+    Aggregate sorted measurements into buckets of given length.
+    Returns array of ROLLUP_DTYPE records.
+    """
+
+    if len(timestamps) == 0:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+
+    buckets = timestamps - timestamps % seconds
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+
+    records = np.empty(len(starts), dtype=ROLLUP_DTYPE)
+    records['timestamp'] = buckets[starts]
+    records['min'] = np.minimum.reduceat(values, starts)
+    records['max'] = np.maximum.reduceat(values, starts)
+    records['sum'] = np.add.reduceat(values, starts)
+    records['count'] = np.diff(np.concatenate((starts, [len(values)])))
+
+    return records
+
+
+def merge(records, seconds):
+    """
+    Aggregate sorted rollup records further into buckets of given length,
+    for example hours into days.
+    """
+
+    if len(records) == 0:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+
+    timestamps = records['timestamp'].astype(np.int64)
+    buckets = timestamps - timestamps % seconds
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+
+    merged = np.empty(len(starts), dtype=ROLLUP_DTYPE)
+    merged['timestamp'] = buckets[starts]
+    merged['min'] = np.minimum.reduceat(records['min'], starts)
+    merged['max'] = np.maximum.reduceat(records['max'], starts)
+    merged['sum'] = np.add.reduceat(records['sum'], starts)
+    merged['count'] = np.add.reduceat(records['count'], starts)
+
+    return merged
+
+
+class Rollup_Writer:
+    """
+    Keeps the current bucket of every measurement and resolution in memory,
+    appending the bucket into its rollup file once a reading falls into a later bucket.
+    """
+
+    def __init__(self, directory, resolutions=None):
+        if directory is None or not os.path.isdir(directory):
+            raise ValueError('Invalid directory')
+
+        self.directory = directory
+        self.resolutions = resolutions if resolutions is not None else list(RESOLUTIONS.keys())
+
+        for resolution in self.resolutions:
+            if resolution not in RESOLUTIONS:
+                raise ValueError('Invalid resolution {0}'.format(resolution))
+
+        # Open bucket as [timestamp, min, max, sum, count] for each measurement and resolution.
+        self.buckets = dict()
+        # Timestamp of the last bucket in the file of each measurement and resolution.
+        self.last_timestamps = dict()
+        self._lock = threading.Lock()
+        self._lock_file = binary_storage.lock_directory(directory, LOCK_FILENAME)
+
+        print('Rollup_Writer initialized with directory:{0}, resolutions:{1}'.format(
+            self.directory,
+            self.resolutions
+        ))
+
+    def write(self, meas_name, timestamp, value):
+        """
+        Add a single measurement into the rollups.
+        """
+
+        timestamp = int(timestamp)
+        value = float(value)
+
+        with self._lock:
+            for resolution in self.resolutions:
+                key = (meas_name, resolution)
+                bucket_timestamp = timestamp - timestamp % RESOLUTIONS[resolution]
+
+                bucket = self.buckets.get(key)
+                if bucket is None and self.last_timestamps.get(key, bucket_timestamp) == bucket_timestamp:
+                    bucket = self._resume(meas_name, resolution, bucket_timestamp)
+
+                if bucket is None and bucket_timestamp < self.last_timestamps.get(key, bucket_timestamp):
+                    # Reading older than the file, e.g. the clock stepped back after
+                    # a restart. Dropped to keep the file sorted.
+                    print('Dropping {0} rollup of {1} at {2}, older than the last written'.format(
+                        resolution,
+                        meas_name,
+                        timestamp
+                    ))
+                    continue
+
+                if bucket is not None and bucket[0] != bucket_timestamp:
+                    if bucket_timestamp < bucket[0]:
+                        # Out of order reading, the bucket is already written.
+                        continue
+
+                    self._append(meas_name, resolution, bucket)
+                    bucket = None
+
+                if bucket is None:
+                    self.buckets[key] = [bucket_timestamp, value, value, value, 1]
+                    continue
+
+                bucket[1] = min(bucket[1], value)
+                bucket[2] = max(bucket[2], value)
+                bucket[3] += value
+                bucket[4] += 1
+
+    def close(self):
+        """
+        Write the open buckets. They are resumed when the next reading
+        falls into the same bucket after a restart.
+        """
+
+        with self._lock:
+            for (meas_name, resolution), bucket in self.buckets.items():
+                self._append(meas_name, resolution, bucket)
+            self.buckets.clear()
+
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+        print('Rollup_Writer closed')
+
+    def _append(self, meas_name, resolution, bucket):
+        record = np.array([tuple(bucket)], dtype=ROLLUP_DTYPE)
+
+        full_path = os.path.join(self.directory, get_filename(meas_name, resolution))
+        with open(full_path, mode='ab') as f:
+            f.write(record.tobytes())
+
+        self.last_timestamps[(meas_name, resolution)] = bucket[0]
+
+    def _resume(self, meas_name, resolution, bucket_timestamp):
+        """
+        Load the last written bucket back into memory if the reading belongs to it,
+        removing it from the file to be written again when complete.
+        """
+
+        full_path = os.path.join(self.directory, get_filename(meas_name, resolution))
+        records = _map(full_path)
+
+        if len(records) > 0:
+            self.last_timestamps[(meas_name, resolution)] = int(records['timestamp'][-1])
+
+        if len(records) == 0 or int(records['timestamp'][-1]) != bucket_timestamp:
+            return None
+
+        last = records[-1]
+        bucket = [int(last['timestamp']), float(last['min']), float(last['max']),
+                  float(last['sum']), int(last['count'])]
+        del records
+
+        with open(full_path, mode='r+b') as f:
+            f.truncate((os.path.getsize(full_path) // ROLLUP_DTYPE.itemsize - 1) * ROLLUP_DTYPE.itemsize)
+
+        self.buckets[(meas_name, resolution)] = bucket
+        return bucket
+
+
+def _map(full_path):
+    """
+    Memory map the records of a rollup file, empty array if there are none.
+    """
+
+    if not os.path.exists(full_path):
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+
+    count = os.path.getsize(full_path) // ROLLUP_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=ROLLUP_DTYPE)
+
+    return np.memmap(full_path, dtype=ROLLUP_DTYPE, mode='r', shape=(count,))
+
+
+def query(directory, meas_name, resolution, start=None, end=None):
+    """
+    Get rollups of a measurement with start <= timestamp < end, either bound can be None.
+    Returns tuple of timestamp, min, max, mean and count arrays.
+    """
+
+    if resolution not in RESOLUTIONS:
+        raise ValueError('Invalid resolution {0}'.format(resolution))
+
+    records = _map(os.path.join(directory, get_filename(meas_name, resolution)))
+    timestamps = records['timestamp']
+
+    first = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+    last = len(records) if end is None else np.searchsorted(timestamps, end, side='left')
+
+    selected = np.array(records[first:last])
+
+    return (selected['timestamp'],
+            selected['min'],
+            selected['max'],
+            selected['sum'] / selected['count'],
+            selected['count'])
+
+
+def rebuild(directory, meas_name):
+    """
+    Recompute all rollups of a measurement from its binary storage file.
+    Refuses to run while a writer maintains the rollups of the directory,
+    as the rebuilt files replace the ones the writer appends to.
+    """
+
+    lock_file = binary_storage.lock_directory(directory, LOCK_FILENAME)
+    try:
+        _rebuild(directory, meas_name)
+    finally:
+        lock_file.close()
+
+
+def _rebuild(directory, meas_name):
+    timestamps, values = binary_storage.read_range(directory, meas_name)
+
+    # Every resolution is computed from the finest one, not from the raw values again.
+    records = None
+    for resolution, seconds in sorted(RESOLUTIONS.items(), key=lambda x: x[1]):
+        if records is None:
+            records = aggregate(timestamps, values, seconds)
+        else:
+            records = merge(records, seconds)
+
+        full_path = os.path.join(directory, get_filename(meas_name, resolution))
+        temp_path = full_path + '.tmp'
+        records.tofile(temp_path)
+        os.replace(temp_path, full_path)
+
+        print('Rebuilt {0} {1} rollups of {2}'.format(len(records), resolution, meas_name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query or rebuild measurement rollups')
+    parser.add_argument('command', choices=('query', 'rebuild'))
+    parser.add_argument('--path', required=True, help='Directory of the measurement files')
+    parser.add_argument('--meas', required=True, help='Measurement name, e.g. temperature')
+    parser.add_argument('--resolution', choices=RESOLUTIONS.keys(), default='hour', help='Resolution to query')
+    parser.add_argument('--days', type=int, default=1, help='Count of most recent days to query')
+    parsed = parser.parse_args()
+
+    if parsed.command == 'rebuild':
+        rebuild(parsed.path, parsed.meas)
+    else:
+        query_start = int(time.time()) - parsed.days * RESOLUTIONS['day']
+        result = query(parsed.path, parsed.meas, parsed.resolution, start=query_start)
+
+        print('timestamp,min,max,mean,count')
+        for row in zip(*result):
+            print('{0},{1:.2f},{2:.2f},{3:.2f},{4}'.format(
+                datetime.datetime.fromtimestamp(row[0], datetime.timezone.utc).isoformat(),
+                *row[1:]
+            ))
@@ -0,0 +1,122 @@
+import collections
+import concurrent.futures
+import time
+
+DEFAULT_TIMEOUT_SECONDS = 8
+DEFAULT_RETRY_DELAY_SECONDS = 2
+
+# Result of a successful read.
+Reading = collections.namedtuple('Reading', ['humidity', 'temperature', 'duration', 'retries'])
+
+
+class Sensor_Reader:
+    """
+    Reads the sensor on a worker thread, retrying failed reads until the timeout,
+    so that a bad read never blocks the caller longer than the timeout.
+    Every attempt is a task of its own and the delay between the attempts is waited
+    on the caller's thread, so a worker shared by several sensors reads them one
+    at a time without a failing sensor holding it between its retries.
+    """
+
+    def __init__(self, read_function, sensor_type, pin,
+                 timeout=DEFAULT_TIMEOUT_SECONDS, retry_delay=DEFAULT_RETRY_DELAY_SECONDS, executor=None):
+        if read_function is None:
+            raise ValueError('Invalid read_function')
+        if timeout is None or timeout <= 0:
+            raise ValueError('Invalid timeout')
+        if retry_delay is None or retry_delay < 0:
+            raise ValueError('Invalid retry_delay')
+
+        # Function doing a single read attempt, returning humidity and temperature or Nones.
+        self.read_function = read_function
+        self.sensor_type = sensor_type
+        self.pin = pin
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+
+        # Readers can share a single worker executor, so that the sensors are read one at a time.
+        self.owns_executor = executor is None
+        self.executor = executor if executor is not None else \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='sensor')
+        # Attempt which is still running after the timeout.
+        self.pending = None
+        self.stats = {
+            'reads': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'skipped': 0,
+            'retries': 0,
+            'seconds': 0.0,
+        }
+
+        print('Sensor_Reader initialized with pin:{0}, timeout:{1}, retry_delay:{2}, shared executor:{3}'.format(
+            self.pin,
+            self.timeout,
+            self.retry_delay,
+            not self.owns_executor
+        ))
+
+    def read(self):
+        """
+        Read the sensor, retrying failed reads, waiting at most the timeout.
+        Returns Reading, or None if the read failed or timed out.
+        """
+
+        if self.pending is not None:
+            if not self.pending.done():
+                print('Previous read on pin {0} is still running, skipping'.format(self.pin))
+                self.stats['skipped'] += 1
+                return None
+
+            self.pending = None
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        retries = 0
+
+        while True:
+            future = self.executor.submit(self.read_function, self.sensor_type, self.pin)
+
+            try:
+                humidity, temperature = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except concurrent.futures.TimeoutError:
+                print('Read on pin {0} timed out after {1} seconds'.format(self.pin, self.timeout))
+                self.stats['timeouts'] += 1
+                self.pending = future
+                return None
+            except Exception as err:
+                print('Exception while reading pin {0}: {1}'.format(self.pin, err))
+                self.stats['failed'] += 1
+                return None
+
+            if humidity is not None and temperature is not None:
+                break
+
+            if time.monotonic() + self.retry_delay >= deadline:
+                self.stats['failed'] += 1
+                return None
+
+            retries += 1
+            # Waited here rather than on the worker, which reads the other sensors meanwhile.
+            time.sleep(self.retry_delay)
+
+        reading = Reading(humidity, temperature, time.monotonic() - start, retries)
+
+        self.stats['reads'] += 1
+        self.stats['retries'] += reading.retries
+        self.stats['seconds'] += reading.duration
+
+        print('Read pin {0} in {1:.3f}s with {2} retries'.format(
+            self.pin,
+            reading.duration,
+            reading.retries
+        ))
+
+        return reading
+
+    def close(self):
+        if self.owns_executor:
+            self.executor.shutdown(wait=False)
+
+    def log_stats(self):
+        print('Sensor stats for pin {0}: {1}'.format(self.pin, self.stats))
@@ -0,0 +1,55 @@
+import collections
+import json
+
+# Sensor types supported by Adafruit_DHT.
+SENSOR_TYPES = ('DHT11', 'DHT22', 'AM2302')
+
+# Single sensor to poll. Prefix is prepended to the measurement names.
+Sensor_Config = collections.namedtuple('Sensor_Config', ['name', 'pin', 'type', 'interval', 'prefix'])
+
+
+def load_sensors(config_file, default_interval):
+    """
+    Load the sensors from a JSON config file of form
+    {"sensors": [{"name": "bedroom", "pin": 17, "type": "DHT22", "interval": 10, "prefix": "bedroom."}]}
+    where only the pin is required.
+    """
+
+    with open(config_file) as f:
+        config = json.load(f)
+
+    sensors = []
+    for i, entry in enumerate(config.get('sensors', [])):
+        pin = entry.get('pin')
+        sensor_type = entry.get('type', 'DHT22')
+        interval = entry.get('interval', default_interval)
+        name = entry.get('name', 'sensor{0}'.format(i))
+        prefix = entry.get('prefix', '{0}.'.format(name))
+
+        if pin is None or not isinstance(pin, int) or pin < 0:
+            raise ValueError('Invalid pin for sensor {0}'.format(name))
+        if sensor_type not in SENSOR_TYPES:
+            raise ValueError('Invalid type {0} for sensor {1}'.format(sensor_type, name))
+        if interval is None or interval <= 0:
+            raise ValueError('Invalid interval for sensor {0}'.format(name))
+
+        sensors.append(Sensor_Config(name, pin, sensor_type, interval, prefix))
+
+    if len(sensors) == 0:
+        raise ValueError('No sensors in config file {0}'.format(config_file))
+
+    pins = [sensor.pin for sensor in sensors]
+    if len(set(pins)) != len(pins):
+        raise ValueError('Same pin used for several sensors')
+
+    return sensors
+
+
+def get_start_offsets(sensors):
+    """
+    Get start offset in seconds for each sensor, spreading the reads evenly
+    over the shortest interval so that they don't run at the same time.
+    """
+
+    stagger = min(sensor.interval for sensor in sensors) / len(sensors)
+    return [i * stagger for i in range(len(sensors))]
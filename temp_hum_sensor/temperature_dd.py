@@ -1,156 +1,265 @@
 import argparse
-import datetime
-import json
+import concurrent.futures
 import os
-import sched
+import signal
 import sys
+import threading
 import time
 
 # 3rd party modules.
 import Adafruit_DHT
-import datadog
+
+from common.scheduler import Periodic_Scheduler
+from temp_hum_sensor import metrics_buffer, sensor_reader, sensors
+from temp_hum_sensor.csv_writer import Buffered_Csv_Writer, DEFAULT_FLUSH_LINES, DEFAULT_FLUSH_INTERVAL_SECONDS
 
 # Parse command line arguments.
-parser = argparse.ArgumentParser(description='Measure values from DHT22 sensor and send them to cloud')
+parser = argparse.ArgumentParser(description='Measure values from DHT22 sensors and send them to cloud')
 parser.add_argument('--nocloud', action='store_true', help='If present, don\'t forward to cloud')
 parser.add_argument('--storefile', action='store_true', help='If present, save into file')
 parser.add_argument('--path', help='The directory into which the measurements are also sent')
-parser.add_argument('--credentials', help='The DD credentials file')
+parser.add_argument('--storage', choices=('csv', 'binary'), default='csv',
+                    help='Save into daily CSV files, or into binary files which are fast to query')
+parser.add_argument('--rollups', action='store_true',
+                    help='Also maintain minute, hour and day rollups of the measurements in the directory')
+parser.add_argument('--statsd_host', default=metrics_buffer.DEFAULT_HOST, help='DogStatsD host')
+parser.add_argument('--statsd_port', type=int, default=metrics_buffer.DEFAULT_PORT, help='DogStatsD port')
+parser.add_argument('--cloud_flush_interval', type=int, default=metrics_buffer.DEFAULT_FLUSH_INTERVAL_SECONDS,
+                    help='Interval in seconds at which the aggregated metrics are sent to DD')
+parser.add_argument('--tags', help='Comma separated tags added to the metrics, e.g. room:bedroom')
+parser.add_argument('--spool', help='File into which metrics are spooled when DD agent cannot be reached')
 parser.add_argument('--interval', type=int, help='The interval in seconds at which measurements are recorded and sent')
-parser.add_argument('--pin', type=int, required=True, help='BCM numbering scheme GPIO pin number to use')
-parsed = parser.parse_args()
-
-# Credentials file.
-DEFAULT_CREDENTIALS_FILE = os.path.join(
-    os.path.dirname(os.path.realpath(__file__)),
-    'credentials.json'
-)
-cred_file = parsed.credentials if parsed.credentials is not None else DEFAULT_CREDENTIALS_FILE
-# Flag of whether to use clod storage or not.
-USE_CLOUD = not parsed.nocloud
-# Flag whether to save to filesystem.
-USE_FILE = parsed.storefile
-# Meas files directory.
-FILE_DIR = parsed.path if parsed.path is not None else '.'
-# Interval.
-INTERVAL_SECONDS = parsed.interval if parsed.interval is not None else 10
-# Sensor pin number.
-SENSOR_PIN_BCM = parsed.pin
-
-FILE_DIRNAME = os.path.dirname(os.path.realpath(__file__))
-
-if INTERVAL_SECONDS <= 0:
-    raise ValueError('Interval is zero or below')
-
-print('Using interval of {0} seconds'.format(INTERVAL_SECONDS))
-
-if USE_FILE:
-    print('Saving measurements to directory {0}'.format(
-        os.path.realpath(FILE_DIR)
-    ))
-
-if not USE_CLOUD and not USE_FILE:
-    print('You don\'t store the values anywhere! Specify either a cloud endpoint or file')
-    sys.exit(1)
-
-# Read credentials from file.
-if not os.path.exists(cred_file):
-    print('Credentials file {0} does not exists!'.format(cred_file))
-    sys.exit(1)
-
-try:
-    with open(cred_file) as f:
-        credentials_obj = json.load(f)
-    DD_API_KEY = credentials_obj['api']
-    DD_APP_KEY = credentials_obj['app']
-    if len(DD_API_KEY) == 0:
-        raise Exception()
-    if len(DD_APP_KEY) == 0:
-        raise Exception()
-except:
-    print('Invalid credentials file!')
-    sys.exit(1)
-
-# Settings
-SENSOR_TYPE = Adafruit_DHT.DHT22
-
-# Initialize datadog connection.
-datadog.initialize(DD_API_KEY, DD_APP_KEY)
-
-# Initialize task scheduler.
-scheduler = sched.scheduler(time.time, time.sleep)
-
-
-def get_filename(meas_name, extension='csv'):
+parser.add_argument('--flush_lines', type=int, default=DEFAULT_FLUSH_LINES,
+                    help='Count of buffered lines after which measurements are written to files')
+parser.add_argument('--flush_interval', type=int, default=DEFAULT_FLUSH_INTERVAL_SECONDS,
+                    help='Max seconds measurements are buffered before they are written to files')
+parser.add_argument('--read_timeout', type=float, default=sensor_reader.DEFAULT_TIMEOUT_SECONDS,
+                    help='Max seconds a sensor read with retries may take')
+parser.add_argument('--retry_delay', type=float, default=sensor_reader.DEFAULT_RETRY_DELAY_SECONDS,
+                    help='Seconds to wait between retries of a failed sensor read')
+parser.add_argument('--pin', type=int, help='BCM numbering scheme GPIO pin number to use')
+parser.add_argument('--config', help='JSON file listing the sensors to use instead of --pin')
+
+# Seconds to wait for the running reads on exit.
+STOP_TIMEOUT_SECONDS = 30
+
+
+def main(argv=None, scheduler=None):
     """
-    Generate the daily rotating file name for the given measurement.
+    Poll the sensors until the scheduler is stopped.
+    Scheduler can be passed in by a supervisor which stops it.
     """
-    date_str = datetime.datetime.now().isoformat()[:10]
-    return '{0}-{1}.{2}'.format(meas_name, date_str, extension)
 
+    parsed = parser.parse_args(argv)
 
-def send_meas_cloud(**kwargs):
-    """
-    Send arbitrary float values to DD.
-    """
-    for meas_name, value in kwargs.items():
-        if value is None:
-            continue
+    if scheduler is None:
+        scheduler = Periodic_Scheduler(name='sensor')
 
-        datadog.statsd.gauge(meas_name, float(value))
+    # Flag of whether to use clod storage or not.
+    USE_CLOUD = not parsed.nocloud
+    # Flag whether to save to filesystem.
+    USE_FILE = parsed.storefile
+    # Meas files directory.
+    FILE_DIR = parsed.path if parsed.path is not None else '.'
+    # Interval.
+    INTERVAL_SECONDS = parsed.interval if parsed.interval is not None else 10
 
+    if (parsed.pin is None) == (parsed.config is None):
+        print('Specify either --pin or --config')
+        sys.exit(1)
 
-def send_meas_filesystem(**kwargs):
-    """
-    Save values to file system.
-    """
-    for meas_name, value in kwargs.items():
-        if value is None:
-            continue
+    if INTERVAL_SECONDS <= 0:
+        raise ValueError('Interval is zero or below')
 
-        filename = get_filename(meas_name)
-        full_path = os.path.join(FILE_DIR, filename)
-        file_mode = 'a' if os.path.exists(full_path) else 'w'
-        timestamp = int(time.time())
+    print('Using interval of {0} seconds'.format(INTERVAL_SECONDS))
 
-        with open(full_path, mode=file_mode) as f:
-            f.write('{0},{1}\n'.format(timestamp, float(value)))
+    if USE_FILE:
+        print('Saving measurements to directory {0}'.format(
+            os.path.realpath(FILE_DIR)
+        ))
 
+    if not USE_CLOUD and not USE_FILE:
+        print('You don\'t store the values anywhere! Specify either a cloud endpoint or file')
+        sys.exit(1)
 
-def get_readings_task():
-    """
-    Regular task which reads the sensor readings and forwards them
-    to to cloud and/or filesystem CSV files.
-    """
+    if parsed.rollups and not USE_FILE:
+        print('Rollups are saved with the measurement files, --rollups requires --storefile')
+        sys.exit(1)
 
-    print('Getting readings')
+    # Sensors to poll. A single --pin sensor keeps the plain measurement names.
+    try:
+        if parsed.config is not None:
+            SENSORS = sensors.load_sensors(parsed.config, INTERVAL_SECONDS)
+        else:
+            SENSORS = [sensors.Sensor_Config('sensor', parsed.pin, 'DHT22', INTERVAL_SECONDS, '')]
+    except Exception as err:
+        print('Invalid sensor config: {0}'.format(err))
+        sys.exit(1)
+
+    for sensor in SENSORS:
+        print('Using sensor {0} of type {1} on pin {2} with interval {3}'.format(
+            sensor.name,
+            sensor.type,
+            sensor.pin,
+            sensor.interval
+        ))
 
+    # All sensors are read on a single worker thread, so a bad read cannot delay the schedule
+    # and the reads never run at the same time. The readers wait between their retries on
+    # their own scheduler threads, so a failing sensor doesn't hold the worker meanwhile.
+    read_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='sensor')
+    readers = dict()
+    metrics = None
+    file_writers = []
+    # Sensors are handled on their own scheduler threads, the writers are shared.
+    file_writers_lock = threading.Lock()
+
+    # Everything set up is closed also when setting up fails, so that a restart by the
+    # supervisor doesn't leave the reads running or the binary storage locked.
     try:
-        humidity, temperature = \
-            Adafruit_DHT.read_retry(SENSOR_TYPE, SENSOR_PIN_BCM)
+        for sensor in SENSORS:
+            readers[sensor.name] = sensor_reader.Sensor_Reader(Adafruit_DHT.read,
+                                                               getattr(Adafruit_DHT, sensor.type),
+                                                               sensor.pin,
+                                                               timeout=parsed.read_timeout,
+                                                               retry_delay=parsed.retry_delay,
+                                                               executor=read_executor)
+
+        # Buffer which aggregates metrics between flushes to DD.
+        if USE_CLOUD:
+            metrics = metrics_buffer.Metrics_Buffer(host=parsed.statsd_host,
+                                                    port=parsed.statsd_port,
+                                                    tags=parsed.tags.split(',') if parsed.tags is not None else None,
+                                                    spool_file=parsed.spool)
 
-        print('Humidity {0}, temperature {1}'.format(humidity,
-                                                     temperature))
+        # Writers which keep the measurement files open and write them in batches.
+        if USE_FILE:
+            if parsed.storage == 'binary':
+                # NumPy is only needed for the binary storage.
+                from temp_hum_sensor.binary_storage import Binary_Writer
+
+                file_writers.append(Binary_Writer(FILE_DIR,
+                                                  flush_lines=parsed.flush_lines,
+                                                  flush_interval=parsed.flush_interval))
+            else:
+                file_writers.append(Buffered_Csv_Writer(FILE_DIR,
+                                                        flush_lines=parsed.flush_lines,
+                                                        flush_interval=parsed.flush_interval))
+
+            if parsed.rollups:
+                from temp_hum_sensor.rollups import Rollup_Writer
+
+                file_writers.append(Rollup_Writer(FILE_DIR))
+
+        def send_meas_cloud(**kwargs):
+            """
+            Send arbitrary float values to DD.
+            """
+            for meas_name, value in kwargs.items():
+                if value is None:
+                    continue
+
+                metrics.gauge(meas_name, float(value))
+
+        def flush_metrics_task():
+            """
+            Regular task which sends the aggregated metrics to DD.
+            """
+
+            for reader in readers.values():
+                reader.log_stats()
+
+            scheduler.log_stats()
+
+            try:
+                metrics.flush()
+            except Exception as err:
+                print('Exception while flushing metrics: {0}'.format(err))
+
+        def send_meas_filesystem(**kwargs):
+            """
+            Save values to file system.
+            """
+            timestamp = int(time.time())
+
+            with file_writers_lock:
+                for meas_name, value in kwargs.items():
+                    if value is None:
+                        continue
+
+                    for file_writer in file_writers:
+                        file_writer.write(meas_name, timestamp, value)
+
+        def get_readings_task(sensor):
+            """
+            Regular task which reads the sensor readings and forwards them
+            to to cloud and/or filesystem CSV files.
+            """
+
+            print('Getting readings from {0}'.format(sensor.name))
+
+            try:
+                reading = readers[sensor.name].read()
+                if reading is None:
+                    raise Exception('No reading from sensor {0}'.format(sensor.name))
+
+                humidity = reading.humidity
+                temperature = reading.temperature
+
+                print('Humidity {0}, temperature {1}'.format(humidity,
+                                                             temperature))
+
+                values = {
+                    sensor.prefix + 'temperature': float(temperature),
+                    sensor.prefix + 'humidity': float(humidity),
+                }
+
+                if USE_CLOUD:
+                    send_meas_cloud(**values)
+                    metrics.histogram(sensor.prefix + 'sensor.read_seconds', reading.duration)
+                    metrics.histogram(sensor.prefix + 'sensor.read_retries', reading.retries)
+
+                if USE_FILE:
+                    send_meas_filesystem(**values)
+
+            except Exception as err:
+                print('Exception while reading/sending measurements: {0}'.format(
+                    err
+                ))
+
+        # Schedule the readings, staggered so that the sensors are not read at the same time.
+        for sensor, offset in zip(SENSORS, sensors.get_start_offsets(SENSORS)):
+            scheduler.add('readings-{0}'.format(sensor.name), get_readings_task, sensor.interval,
+                          first_run=offset, args=(sensor,))
 
         if USE_CLOUD:
-            send_meas_cloud(temperature=float(temperature)
-                            , humidity=float(humidity))
+            scheduler.add('flush-metrics', flush_metrics_task, parsed.cloud_flush_interval)
 
-        if USE_FILE:
-            send_meas_filesystem(temperature=float(temperature)
-                                 , humidity=float(humidity))
+        print('Entering main application loop')
+        scheduler.run()
+    finally:
+        # Let the running reads finish, then send and write out the buffered measurements.
+        scheduler.stop(timeout=STOP_TIMEOUT_SECONDS)
+        read_executor.shutdown(wait=False)
 
-    except Exception as err:
-        print('Exception while reading/sending measurements: {0}'.format(
-            err
-        ))
+        for reader in readers.values():
+            reader.log_stats()
+
+        if metrics is not None:
+            metrics.close()
+
+        for file_writer in file_writers:
+            file_writer.close()
 
-    # Reschedule.
-    scheduler.enter(INTERVAL_SECONDS, 1, get_readings_task)
 
+def handle_sigterm(signum, frame):
+    """
+    Exit normally on SIGTERM so that the buffered measurements are written.
+    """
+    print('Received SIGTERM, exiting')
+    sys.exit(0)
 
-# Initial readings.
-get_readings_task()
 
-print('Entering main application loop')
-scheduler.run()
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    main()
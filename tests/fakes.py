@@ -0,0 +1,177 @@
+"""
+Stand-ins for the hardware and services the monitors use, so that
+the tests and the benchmarks run on any machine.
+"""
+
+import io
+import os
+import random
+import socket
+import stat
+import sys
+import threading
+import time
+import types
+
+FAKE_FSWEBCAM = """#!/bin/sh
+sleep {latency}
+for last; do true; done
+if [ "$last" = "-" ]; then cat "{jpeg}"; else cp "{jpeg}" "$last"; fi
+"""
+
+
+def make_jpeg(width=640, height=480, quality=85, seed=0):
+    """
+    Make a JPEG of noise, which compresses about as badly as a webcam capture.
+    Falls back to random bytes between JPEG markers without Pillow.
+    """
+
+    rng = random.Random(seed)
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return b'\xff\xd8' + bytes(rng.getrandbits(8) for _ in range(width * height // 10)) + b'\xff\xd9'
+
+    image = Image.frombytes('L', (width, height), bytes(rng.getrandbits(8) for _ in range(width * height)))
+    output = io.BytesIO()
+    image.convert('RGB').save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def install_fake_fswebcam(directory, latency=0.0, jpeg=None):
+    """
+    Write a fake fswebcam, which outputs the same JPEG after the latency,
+    into the directory and put the directory first on PATH.
+    """
+
+    jpeg_path = os.path.join(directory, 'fake.jpg')
+    with open(jpeg_path, 'wb') as f:
+        f.write(jpeg if jpeg is not None else make_jpeg())
+
+    script_path = os.path.join(directory, 'fswebcam')
+    with open(script_path, 'w') as f:
+        f.write(FAKE_FSWEBCAM.format(latency=latency, jpeg=jpeg_path))
+    os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IEXEC)
+
+    os.environ['PATH'] = directory + os.pathsep + os.environ.get('PATH', '')
+
+    return script_path
+
+
+def make_dht_read(latency=0.0, failure_rate=0.0, seed=0):
+    """
+    Make a function with the signature of Adafruit_DHT.read, which takes the latency
+    and fails at the failure rate.
+    """
+
+    rng = random.Random(seed)
+
+    def read(sensor_type, pin):
+        time.sleep(latency)
+
+        if rng.random() < failure_rate:
+            return None, None
+
+        return 40.0 + rng.random() * 20, 20.0 + rng.random() * 5
+
+    return read
+
+
+class Recording_GPIO(types.ModuleType):
+    """
+    RPi.GPIO which records the time of every output call.
+    """
+
+    BCM = 'BCM'
+    OUT = 'OUT'
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self):
+        super().__init__('RPi.GPIO')
+
+        # List of (perf_counter_ns, level) tuples.
+        self.edges = []
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, mode, initial=0):
+        pass
+
+    def output(self, pin, level):
+        self.edges.append((time.perf_counter_ns(), level))
+
+    def cleanup(self):
+        pass
+
+
+def install_recording_gpio():
+    """
+    Make import RPi.GPIO return a Recording_GPIO.
+    """
+
+    gpio = Recording_GPIO()
+    package = types.ModuleType('RPi')
+    package.GPIO = gpio
+
+    sys.modules['RPi'] = package
+    sys.modules['RPi.GPIO'] = gpio
+
+    return gpio
+
+
+class Udp_Sink:
+    """
+    Receives the DogStatsD packets and counts them on a thread.
+    """
+
+    def __init__(self, host='127.0.0.1'):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, 0))
+        self.socket.settimeout(0.1)
+        self.host, self.port = self.socket.getsockname()
+
+        self.packets = 0
+        self.lines = 0
+        self.bytes = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='udp-sink', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+        self.socket.close()
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                data = self.socket.recv(65535)
+            except socket.timeout:
+                continue
+
+            if len(data) == 0:
+                continue
+
+            self.packets += 1
+            self.lines += data.count(b'\n') + 1
+            self.bytes += len(data)
+
+
+def mock_s3():
+    """
+    Get moto's S3 mock as a context manager. Requires moto and boto3.
+    """
+
+    # Moto accepts any credentials but boto3 still needs a region.
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    try:
+        from moto import mock_aws
+        return mock_aws()
+    except ImportError:
+        # Before moto 5 every service had its own mock.
+        from moto import mock_s3 as mock
+        return mock()
@@ -0,0 +1,170 @@
+"""
+Checks the pulses sent for Nexa commands against the protocol, by sending them
+with the RPi.GPIO transmitter to a fake GPIO which records the edges.
+"""
+
+import contextlib
+import io
+import sys
+import time
+import types
+
+import pytest
+
+from tests import fakes
+from nexa_sockets import nexa_protocol, transmitters
+
+CODE = '10110011100011110000101010'
+PIN = 17
+
+# Protocol as in http://tech.jolowe.se/home-automation-rf-protocols/
+T = 250
+# Every symbol is a single high slot followed by this many low slots.
+SYNC_SLOTS = 10
+BIT_SLOTS = {1: '1', 5: '0'}
+PAUSE_SLOTS = 40
+# Frame bits after the code: group, on/off, two channel bits and two unit bits.
+ONOFF_BITS = {1: '0', 0: '1'}
+CHANNEL_BITS = '11'
+UNIT_BITS = {1: '11', 2: '10', 3: '01'}
+
+# Microseconds the fake clock advances on every read.
+CLOCK_STEP_US = 2
+# Allowed error of a single pulse in microseconds.
+TOLERANCE_US = 3 * CLOCK_STEP_US
+
+
+@pytest.fixture
+def gpio(monkeypatch):
+    """
+    Install a recording RPi.GPIO, timed by a fake clock which advances on every read,
+    so that the busy-wait transmitter runs fast and the edges are exact.
+    """
+
+    gpio = fakes.Recording_GPIO()
+    package = types.ModuleType('RPi')
+    package.GPIO = gpio
+    monkeypatch.setitem(sys.modules, 'RPi', package)
+    monkeypatch.setitem(sys.modules, 'RPi.GPIO', gpio)
+
+    now = [0]
+
+    def clock():
+        now[0] += CLOCK_STEP_US * 1000
+        return now[0]
+
+    monkeypatch.setattr(time, 'perf_counter_ns', clock)
+
+    return gpio
+
+
+def send(gpio, pulses):
+    with contextlib.redirect_stdout(io.StringIO()):
+        transmitter = transmitters.Gpio_Transmitter(PIN)
+        transmitter.open()
+        try:
+            transmitter.send(pulses)
+        finally:
+            transmitter.close()
+
+    return gpio.edges
+
+
+def get_slots(edges):
+    """
+    Get list of (level, slots) of the recorded edges, checking every pulse is whole slots.
+    The last edge only ends the transmission.
+    """
+
+    slots = []
+    for (start, level), (end, _) in zip(edges, edges[1:]):
+        us = (end - start) / 1000.0
+        count = int(round(us / T))
+        assert count >= 1 and abs(us - count * T) <= TOLERANCE_US, \
+            'Pulse of {0}us is not a whole count of {1}us slots'.format(us, T)
+        slots.append((level, count))
+
+    assert edges[-1][1] == 0, 'Transmission does not end low'
+
+    return slots
+
+
+def get_frames(slots):
+    """
+    Split the symbols into frames at the pauses, each frame a list of counts of low slots.
+    """
+
+    assert len(slots) % 2 == 0
+    frames = [[]]
+    for (high, high_slots), (low, low_slots) in zip(slots[::2], slots[1::2]):
+        assert (high, high_slots) == (1, 1), 'Symbol does not start with a single high slot'
+        assert low == 0
+        frames[-1].append(low_slots)
+        if low_slots == PAUSE_SLOTS:
+            frames.append([])
+
+    assert frames[-1] == [], 'Transmission does not end with a pause'
+
+    return frames[:-1]
+
+
+def decode_frame(frame):
+    """
+    Check the frame is a sync, 32 bits and a pause, and get the bits.
+    """
+
+    assert frame[0] == SYNC_SLOTS
+    assert frame[-1] == PAUSE_SLOTS
+    assert len(frame) == 1 + nexa_protocol.CODE_LENGTH + 6 + 1
+
+    for slots in frame[1:-1]:
+        assert slots in BIT_SLOTS, 'Bit of {0} low slots'.format(slots)
+
+    return ''.join(BIT_SLOTS[slots] for slots in frame[1:-1])
+
+
+@pytest.mark.parametrize('unit', nexa_protocol.UNITS)
+@pytest.mark.parametrize('onoff', (0, 1))
+def test_encode_matches_protocol(gpio, unit, onoff):
+    pulses = nexa_protocol.encode(CODE, unit, onoff)
+    frames = get_frames(get_slots(send(gpio, pulses)))
+
+    assert len(frames) == nexa_protocol.CODE_REPEATS
+
+    expected = CODE + ONOFF_BITS[onoff] + ONOFF_BITS[onoff] + CHANNEL_BITS + UNIT_BITS[unit]
+    for frame in frames:
+        assert decode_frame(frame) == expected
+
+
+@pytest.mark.parametrize('onoff', (0, 1))
+def test_encode_all_units_matches_protocol(gpio, onoff):
+    commands = nexa_protocol.expand_commands([(CODE, nexa_protocol.ALL_UNITS, onoff)])
+    frames = get_frames(get_slots(send(gpio, nexa_protocol.encode_batch(commands))))
+
+    assert len(frames) == len(UNIT_BITS) * nexa_protocol.CODE_REPEATS
+
+    for i, frame in enumerate(frames):
+        unit = nexa_protocol.UNITS[i // nexa_protocol.CODE_REPEATS]
+        assert decode_frame(frame) == CODE + ONOFF_BITS[onoff] + ONOFF_BITS[onoff] + CHANNEL_BITS + UNIT_BITS[unit]
+
+
+@pytest.mark.parametrize('unit', nexa_protocol.UNITS)
+@pytest.mark.parametrize('onoff', (0, 1))
+def test_encode_symbols_matches_pulses(unit, onoff):
+    symbols = nexa_protocol.encode_symbols(CODE, unit, onoff)
+    pulses = nexa_protocol.encode(CODE, unit, onoff, repeats=1)
+
+    assert pulses == [pulse for symbol in symbols for pulse in ((1, T), (0, T * symbol))]
+    assert nexa_protocol.get_duration(pulses) == T * sum(1 + symbol for symbol in symbols)
+
+
+@pytest.mark.parametrize('code, unit, onoff', [
+    (CODE[:-1], 1, 1),
+    (CODE[:-1] + '2', 1, 1),
+    (CODE, 4, 1),
+    (CODE, nexa_protocol.ALL_UNITS, 1),
+    (CODE, 1, 2),
+])
+def test_encode_rejects_invalid_commands(code, unit, onoff):
+    with pytest.raises(ValueError):
+        nexa_protocol.encode(code, unit, onoff)